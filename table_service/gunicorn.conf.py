@@ -0,0 +1,38 @@
+# Настройки gunicorn для продакшн-режима (run.sh при DEBUG=0)
+# Все значения переопределяются переменными окружения WEB_*
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+
+# Процессы и потоки в каждом из них. gthread обслуживает потоком и соединения событий
+# таблиц (SSE): каждое живёт до 30 секунд с перерывом на столько же (tables.events), так что
+# открытая страница занимает поток примерно половину времени. 32 потока процесса хватает
+# на ~50 открытых страниц и обычные запросы; при большем числе страниц - WEB_THREADS или ASGI:
+# WEB_WORKER_CLASS=uvicorn.workers.UvicornWorker и WEB_APP=table_service.asgi:application
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 32))
+# Число процессов видно настройкам Django: локальные события с несколькими процессами не работают
+os.environ['WEB_WORKERS'] = str(workers)
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+wsgi_app = os.environ.get('WEB_APP', 'table_service.wsgi:application')
+
+# Импорт больших файлов идёт в запросе
+timeout = int(os.environ.get('WEB_TIMEOUT', 300))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = os.environ.get('WEB_ACCESS_LOG', '-')
+errorlog = '-'
+
+# Метрики процессов складываются через файлы в METRICS_DIR (tables.metrics).
+# Каталог очищается при запуске: счётчики начинаются с нуля вместе с сервером
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'table_service_metrics'))
+
+
+def on_starting(server):
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['METRICS_DIR'])
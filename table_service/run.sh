@@ -1,3 +1,8 @@
 #!/bin/bash
 echo "Старт контейнера"
-python manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+if [ "${DEBUG:-1}" = "1" ]; then
+    exec python manage.py runserver 0.0.0.0:8000
+fi
+
+python manage.py collectstatic --noinput
+exec gunicorn -c gunicorn.conf.py
@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import importlib.util
 import os
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -33,9 +35,14 @@ DB_PASSWORD = os.environ.get('DB_PASSWORD')
 
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Режим задаётся окружением: DEBUG=0 - продакшн (gunicorn, см. run.sh). В режиме отладки
+# Django хранит в памяти каждый выполненный запрос к базе.
+DEBUG = os.environ.get('DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = ['localhost', 'test-vapp-03.sgp.ru', 'sco1-vapp-04.sgp.ru', '0.0.0.0', '127.0.0.1']
+ALLOWED_HOSTS = os.environ.get(
+    'ALLOWED_HOSTS',
+    'localhost,test-vapp-03.sgp.ru,sco1-vapp-04.sgp.ru,0.0.0.0,127.0.0.1'
+).split(',')
 
 
 # Application definition
@@ -47,6 +54,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'tables.apps.TablesConfig',
     'django_tables2',
     'django_bootstrap5',
@@ -56,6 +64,8 @@ CORS_ORIGIN_ALLOW_ALL = True
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'tables.metrics.MetricsMiddleware',
+    'tables.profiling.SQLProfileMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -98,9 +108,96 @@ DATABASES = {
         'PASSWORD': DB_PASSWORD,
         'HOST': DB_HOST,
         'PORT': DB_PORT,
+        # Соединение живёт DB_CONN_MAX_AGE секунд и проверяется перед повторным использованием
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Пул соединений psycopg 3 вместо постоянных соединений (DB_POOL=1, нужен пакет psycopg[pool])
+if os.environ.get('DB_POOL') == '1':
+    # С psycopg2 из req.txt Django не принимает OPTIONS['pool'] и падает на первом соединении
+    if importlib.util.find_spec('psycopg') is None or importlib.util.find_spec('psycopg_pool') is None:
+        raise ImproperlyConfigured('DB_POOL=1 требует psycopg 3 с пулом: pip install "psycopg[binary,pool]"')
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        },
+    }
+
+
+# Кэш
+# CACHE_BACKEND: locmem - в памяти процесса (по умолчанию), file - общий для процессов
+# одного сервера, redis или memcached - общий для нескольких серверов (адрес в CACHE_LOCATION)
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+}
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHE_DEFAULT_LOCATIONS = {
+    'locmem': 'table_service',
+    'file': os.path.join(BASE_DIR, 'cache'),
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('CACHE_LOCATION', CACHE_DEFAULT_LOCATIONS.get(CACHE_BACKEND, '')),
+    }
+}
+
+# Сколько секунд хранится HTML таблицы для одной версии данных
+GRID_CACHE_TIMEOUT = int(os.environ.get('GRID_CACHE_TIMEOUT', 300))
+
+
+# События таблиц (блокировки и изменения строк) для открытых страниц
+# EVENTS_BACKEND: local - в пределах процесса (по умолчанию при DEBUG=1),
+# postgres - LISTEN/NOTIFY между процессами и узлами (по умолчанию в продакшне)
+EVENTS_BACKENDS = {
+    'local': 'tables.events.LocalBroker',
+    'postgres': 'tables.events.PostgresBroker',
+}
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'local' if DEBUG else 'postgres')
+EVENTS_BROKER = EVENTS_BACKENDS[EVENTS_BACKEND]
+# Событие из одного процесса gunicorn не дошло бы до страниц, открытых в других.
+# WEB_WORKERS выставляет gunicorn.conf.py
+if EVENTS_BACKEND == 'local' and int(os.environ.get('WEB_WORKERS', 1)) > 1:
+    raise ImproperlyConfigured('EVENTS_BACKEND=local работает только с одним процессом (WEB_WORKERS=1)')
+
+
+# Профилирование SQL по запросам (tables.profiling): доля профилируемых запросов, 0 - выключено.
+# Сотрудники (is_staff) могут профилировать свой запрос заголовком X-SQL-Profile: 1
+SQL_PROFILE_RATE = float(os.environ.get('SQL_PROFILE_RATE', 0))
+
+# Метрики Prometheus (/metrics/, tables.metrics) считаются в памяти каждого процесса.
+# Без входа их можно забрать с заголовком Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Каталог, через который процессы складывают метрики; задаёт gunicorn.conf.py
+METRICS_DIR = os.environ.get('METRICS_DIR')
+
+# Логи приложения (профили SQL, ошибки событий и выгрузок) пишутся в stdout, уровень - LOG_LEVEL
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'tables': {
+            'handlers': ['console'],
+            'level': os.environ.get('LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -136,6 +233,16 @@ USE_TZ = False
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = os.environ.get('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+
+# Раздача статики самим приложением без DEBUG, если перед ним нет отдельного веб-сервера
+SERVE_STATIC = os.environ.get('SERVE_STATIC', '1') == '1'
+
+# Фоновые выгрузки таблиц
+# Каталог для готовых файлов и число потоков, которые их пишут
+
+EXPORT_ROOT = os.environ.get('EXPORT_ROOT', os.path.join(BASE_DIR, 'exports'))
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 2))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
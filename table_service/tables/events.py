@@ -0,0 +1,298 @@
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+import queue
+import select
+import threading
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Пустой комментарий раз в EVENTS_KEEPALIVE секунд не даёт прокси закрыть соединение
+EVENTS_KEEPALIVE = 15
+
+# Очередь медленного подписчика не растёт бесконечно: при переполнении он получает reload
+EVENTS_QUEUE_SIZE = 1000
+
+# Об изменении большего числа строк сообщается одним событием reload
+ROW_EVENTS_LIMIT = 100
+
+# Канал LISTEN/NOTIFY для PostgresBroker
+EVENTS_CHANNEL = 'table_events'
+
+# Под WSGI соединение событий занимает поток сервера: оно закрывается через EVENTS_WSGI_LIFETIME
+# секунд, и браузер переподключается через EVENTS_WSGI_RETRY, так что поток занят половину времени
+EVENTS_WSGI_LIFETIME = 30
+EVENTS_WSGI_RETRY = 30
+
+# Перед закрытием соединения ещё столько секунд доставляются события, опубликованные
+# до чтения версии данных
+EVENTS_CLOSE_GRACE = 1
+
+
+class CommitBatch:
+    """Действие, которое выполняется один раз после фиксации транзакции
+
+    Хранится только в списке on_commit соединения: при откате транзакции или точки
+    сохранения Django отбрасывает его, и запись в _pending исчезает вместе с ним.
+    """
+
+    def __init__(self, action, items):
+        self.action = action
+        self.items = None if items is None else dict.fromkeys(items)
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        if self.items is None:
+            self.action()
+        else:
+            self.action(list(self.items))
+
+
+# Запланированные в транзакции потока действия: ключ -> CommitBatch (слабые ссылки)
+_pending = threading.local()
+
+
+def on_commit_once(key, action, items=None):
+    """Планирует action на момент фиксации транзакции один раз для ключа key
+
+    Повторные вызовы с тем же ключом в этой транзакции только добавляют items,
+    action получит их все списком без повторов.
+    """
+    batches = getattr(_pending, 'batches', None)
+    if batches is None:
+        batches = _pending.batches = weakref.WeakValueDictionary()
+    batch = batches.get(key)
+    if batch is not None and not batch.done:
+        if items is not None:
+            batch.items.update(dict.fromkeys(items))
+        return
+    batch = batches[key] = CommitBatch(action, items)
+    transaction.on_commit(batch)
+
+
+def publish_rows(table_id, event_type, row_ids):
+    """Планирует событие insert/update/delete по строкам таблицы на момент фиксации транзакции
+
+    События одного типа в одной транзакции объединяются: сохранение десяти
+    ячеек строки даёт одно событие update.
+    """
+    on_commit_once(('rows', table_id, event_type), functools.partial(send_rows, table_id, event_type), row_ids)
+
+
+def send_rows(table_id, event_type, row_ids):
+    if len(row_ids) > ROW_EVENTS_LIMIT:
+        send(table_id, {'type': 'reload'})
+    else:
+        send(table_id, {'type': event_type, 'rows': row_ids})
+
+
+def publish(table_id, event):
+    """Отправляет событие подписчикам таблицы после фиксации транзакции"""
+    transaction.on_commit(functools.partial(send, table_id, event))
+
+
+def send(table_id, event):
+    # Ошибка доставки не должна ломать запись, ради которой событие отправлялось
+    try:
+        get_broker().publish(table_id, event)
+    except Exception:
+        logger.exception('Не удалось отправить событие таблицы %s', table_id)
+
+
+def format_event(event):
+    """Событие в формате text/event-stream; None - комментарий для поддержания соединения"""
+    if event is None:
+        return ': keepalive\n\n'
+    return f'event: {event["type"]}\ndata: {json.dumps(event)}\n\n'
+
+
+def event_stream(table_id, resync, version):
+    """Тело ответа text/event-stream для WSGI
+
+    Соединение закрывается через EVENTS_WSGI_LIFETIME. Последним приходит id - версия
+    данных (version()), до которой дошли события; браузер вернёт её при переподключении
+    в Last-Event-ID, и resync() после подписки восполнит пропущенное за перерыв.
+    """
+    with get_broker().listen(table_id) as events:
+        yield f'retry: {EVENTS_WSGI_RETRY * 1000}\n\n'
+        for event in resync():
+            yield format_event(event)
+        # Соединение с базой не держится открытым, пока поток ждёт событий
+        connection.close()
+        for event in _receive(events, time.monotonic() + EVENTS_WSGI_LIFETIME):
+            yield format_event(event)
+        last_version = version()
+        connection.close()
+        for event in _receive(events, time.monotonic() + EVENTS_CLOSE_GRACE):
+            yield format_event(event)
+    yield f'id: {last_version}\n\n'
+
+
+async def aevent_stream(table_id, resync):
+    """Тело ответа text/event-stream для ASGI
+
+    Соединение не ограничено по времени; resync() после подписки сообщает то, что
+    страница пропустила до подключения.
+    """
+    events = get_broker().asubscribe(table_id)
+    yield format_event(await anext(events))
+    for event in await sync_to_async(resync)():
+        yield format_event(event)
+    async for event in events:
+        yield format_event(event)
+
+
+def _receive(events, until):
+    """События из очереди до момента until (time.monotonic); None - время keepalive"""
+    while (remaining := until - time.monotonic()) > 0:
+        try:
+            yield events.get(timeout=min(remaining, EVENTS_KEEPALIVE))
+        except queue.Empty:
+            yield None
+
+
+def _offer(events, event):
+    try:
+        events.put_nowait(event)
+    except (asyncio.QueueFull, queue.Full):
+        # Подписчик не успевает: пропущенные события заменяются перезагрузкой
+        while not events.empty():
+            events.get_nowait()
+        events.put_nowait({'type': 'reload'})
+
+
+class LocalBroker:
+    """Рассылка событий подписчикам в пределах одного процесса
+
+    Подходит для одного узла; publish можно вызывать из любого потока.
+    """
+
+    def __init__(self):
+        self._subscribers = {}  # table_id -> {deliver}
+        self._lock = threading.Lock()
+
+    def publish(self, table_id, event):
+        self.dispatch(table_id, event)
+
+    def dispatch(self, table_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(table_id, ()))
+        for deliver in subscribers:
+            deliver(event)
+
+    def _add(self, table_id, deliver):
+        with self._lock:
+            self._subscribers.setdefault(table_id, set()).add(deliver)
+
+    def _remove(self, table_id, deliver):
+        with self._lock:
+            subscribers = self._subscribers.get(table_id, set())
+            subscribers.discard(deliver)
+            if not subscribers:
+                self._subscribers.pop(table_id, None)
+
+    @contextlib.contextmanager
+    def listen(self, table_id):
+        """Очередь событий таблицы для WSGI на время блока with: поток ждёт их в ней сам"""
+        events = queue.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        deliver = functools.partial(_offer, events)
+        self._add(table_id, deliver)
+        try:
+            yield events
+        finally:
+            self._remove(table_id, deliver)
+
+    async def asubscribe(self, table_id):
+        """События таблицы для ASGI: ожидание не занимает поток
+
+        Первым сразу после подписки приходит None (keepalive).
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+
+        def deliver(event):
+            loop.call_soon_threadsafe(_offer, events, event)
+
+        self._add(table_id, deliver)
+        try:
+            yield None
+            while True:
+                try:
+                    yield await asyncio.wait_for(events.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            self._remove(table_id, deliver)
+
+
+class PostgresBroker(LocalBroker):
+    """События через LISTEN/NOTIFY PostgreSQL для нескольких узлов
+
+    publish выполняет NOTIFY, а фоновый поток каждого процесса слушает канал
+    и раздаёт события своим подписчикам.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def publish(self, table_id, event):
+        payload = json.dumps({'table': table_id, 'event': event})
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [EVENTS_CHANNEL, payload])
+
+    def _add(self, table_id, deliver):
+        super()._add(table_id, deliver)
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='table-events', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                self._listen_once()
+            except Exception:
+                logger.exception('Соединение LISTEN %s потеряно, переподключение', EVENTS_CHANNEL)
+                time.sleep(5)
+
+    def _listen_once(self):
+        # Отдельное соединение вне пула Django: оно всё время занято ожиданием
+        wrapper = connections.create_connection('default')
+        wrapper.connect()
+        raw = wrapper.connection
+        try:
+            raw.autocommit = True
+            raw.cursor().execute(f'LISTEN {EVENTS_CHANNEL}')
+            while True:
+                for payload in self._wait(raw):
+                    message = json.loads(payload)
+                    self.dispatch(message['table'], message['event'])
+        finally:
+            wrapper.close()
+
+    @staticmethod
+    def _wait(raw):
+        if hasattr(raw, 'poll'):  # psycopg2
+            if select.select([raw], [], [], EVENTS_KEEPALIVE)[0]:
+                raw.poll()
+                while raw.notifies:
+                    yield raw.notifies.pop(0).payload
+        else:  # psycopg 3
+            for notify in raw.notifies(timeout=EVENTS_KEEPALIVE):
+                yield notify.payload
+
+
+@functools.cache
+def get_broker():
+    return import_string(settings.EVENTS_BROKER)()
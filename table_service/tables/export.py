@@ -0,0 +1,164 @@
+import csv
+import datetime
+import functools
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q
+from openpyxl import Workbook
+
+from .metrics import EXPORT_DURATION, EXPORT_BYTES
+from .models import Row, ExportJob
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк читается из базы за один раз
+EXPORT_BATCH_SIZE = 2000
+
+# Форматы, которые выгружаются фоновой задачей
+BACKGROUND_FORMATS = ('csv', 'xlsx')
+
+# Незавершённая задача старше этого срока считается потерянной (например, после перезапуска)
+EXPORT_JOB_TIMEOUT = datetime.timedelta(hours=1)
+
+_executor = ThreadPoolExecutor(max_workers=settings.EXPORT_WORKERS, thread_name_prefix='export')
+
+
+def iter_export_rows(table_obj, rows, progress=None):
+    """Возвращает строки выгрузки (заголовок, затем значения) пачками по EXPORT_BATCH_SIZE"""
+    columns = list(table_obj.columns.all())
+    yield [column.name for column in columns] + ['Филиал', 'Пользователь']
+
+    rows = rows.defer('search_text', 'search_vector').iterator(chunk_size=EXPORT_BATCH_SIZE)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield from _batch_values(batch, columns, progress)
+            batch = []
+    yield from _batch_values(batch, columns, progress)
+
+
+def _batch_values(batch, columns, progress):
+    # Авторы и филиалы подгружаются для всей пачки двумя запросами
+    Row.resolve_creators(batch)
+    for row in batch:
+        values = row.cell_values
+        yield [values.get(column.id) for column in columns] + [
+            row.filial_values['name'],
+            row.user_values['full_name'],
+        ]
+    if progress and batch:
+        progress(len(batch))
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.date):
+        return value.strftime('%d.%m.%Y')
+    return value
+
+
+def write_csv(table_obj, file, progress=None):
+    """Пишет CSV-выгрузку таблицы в текстовый файл"""
+    writer = csv.writer(file)
+    for values in iter_export_rows(table_obj, table_obj.rows.all(), progress):
+        writer.writerow([_csv_value(value) for value in values])
+
+
+def sheet_title(title, used=()):
+    """Название листа Excel: без запрещённых символов, не длиннее 31 символа и не повторяющееся"""
+    title = re.sub(r'[\[\]:*?/\\]', ' ', title)[:31].strip() or 'Таблица'
+    base, number = title, 1
+    while title in used:
+        number += 1
+        suffix = f' ({number})'
+        title = base[:31 - len(suffix)] + suffix
+    return title
+
+
+def write_xlsx(tables, file, progress=None):
+    """Пишет книгу XLSX с листом на каждую таблицу в write-only режиме openpyxl"""
+    workbook = Workbook(write_only=True)
+    titles = set()
+    for table_obj in tables:
+        title = sheet_title(table_obj.title, titles)
+        titles.add(title)
+        sheet = workbook.create_sheet(title=title)
+        for values in iter_export_rows(table_obj, table_obj.rows.all(), progress):
+            sheet.append(values)
+    workbook.save(file)
+
+
+def start_export(tables, export_format, user):
+    """Возвращает выгрузку для текущих версий таблиц, при необходимости ставя новую в очередь"""
+    cache_key = ExportJob.cache_key_for(tables, export_format)
+    fresh = Q(status=ExportJob.Status.DONE) | Q(created_at__gte=datetime.datetime.now() - EXPORT_JOB_TIMEOUT)
+    job = (ExportJob.objects.filter(fresh, cache_key=cache_key)
+           .exclude(status=ExportJob.Status.FAILED)
+           .order_by('-created_at')
+           .first())
+    # Готовый файл с той же версией данных отдаётся без повторной выгрузки
+    if job and (job.status != ExportJob.Status.DONE or job.is_ready):
+        return job
+
+    with transaction.atomic():
+        job = ExportJob.objects.create(
+            created_by=user,
+            export_format=export_format,
+            cache_key=cache_key,
+        )
+        job.tables.set(tables)
+        transaction.on_commit(functools.partial(_executor.submit, _run_in_worker, job.pk))
+    return job
+
+
+def _report_progress(job_pk, count):
+    ExportJob.objects.filter(pk=job_pk).update(processed_rows=F('processed_rows') + count)
+
+
+def run_export_job(job_pk):
+    """Выполняет выгрузку: пишет файл в EXPORT_ROOT и отмечает задачу готовой"""
+    jobs = ExportJob.objects.filter(pk=job_pk)
+    start = time.perf_counter()
+    try:
+        job = jobs.get()
+        tables = list(job.tables.order_by('title', 'pk'))
+        jobs.update(
+            status=ExportJob.Status.RUNNING,
+            total_rows=Row.objects.filter(table__in=tables).count(),
+        )
+
+        os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+        file_name = f'{job.pk}.{job.export_format}'
+        path = os.path.join(settings.EXPORT_ROOT, file_name)
+        progress = functools.partial(_report_progress, job.pk)
+        # Файл пишется под временным именем, чтобы не отдать недописанную выгрузку
+        if job.export_format == 'csv':
+            with open(path + '.part', 'w', newline='', encoding='utf-8') as file:
+                write_csv(tables[0], file, progress)
+        else:
+            with open(path + '.part', 'wb') as file:
+                write_xlsx(tables, file, progress)
+        os.replace(path + '.part', path)
+
+        jobs.update(status=ExportJob.Status.DONE, file_name=file_name, finished_at=datetime.datetime.now())
+        EXPORT_DURATION.observe(time.perf_counter() - start, format=job.export_format)
+        EXPORT_BYTES.observe(os.path.getsize(path), format=job.export_format)
+    except Exception as e:
+        logger.exception('Ошибка выгрузки %s', job_pk)
+        jobs.update(status=ExportJob.Status.FAILED, error=str(e), finished_at=datetime.datetime.now())
+
+
+def _run_in_worker(job_pk):
+    try:
+        run_export_job(job_pk)
+    finally:
+        # Поток пула живёт дольше запроса: соединение закрывается явно
+        connections.close_all()
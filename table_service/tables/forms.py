@@ -14,9 +14,12 @@ class TableForm(forms.ModelForm):
 class ColumnForm(forms.ModelForm):
     class Meta:
         model = Column
-        fields = ['name', 'data_type', 'is_required']
+        fields = ['name', 'data_type', 'is_required', 'default_permission_type']
         widgets = {
             'data_type': forms.Select(choices=Column.ColumnType.choices),
+            'default_permission_type': forms.Select(attrs={
+                'class': 'form-select'
+            }),
             'is_required': forms.CheckboxInput(attrs={
                 'class': 'form-check-input'
             })
@@ -26,6 +29,14 @@ class ColumnForm(forms.ModelForm):
         'is_required': 'Обязательное поле'
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['default_permission_type'].required = False
+
+    def clean_default_permission_type(self):
+        # Без поля (форма со старой страницы, скрипт) действует значение модели
+        return self.cleaned_data['default_permission_type'] or Column._meta.get_field('default_permission_type').default
+
 
 class ColumnPermissionForm(forms.ModelForm):
     class Meta:
@@ -38,6 +49,17 @@ class ColumnPermissionForm(forms.ModelForm):
         }
 
 
+class ColumnDefaultPermissionForm(forms.ModelForm):
+    class Meta:
+        model = Column
+        fields = ['default_permission_type']
+        widgets = {
+            'default_permission_type': forms.Select(attrs={
+                'class': 'form-select'
+            })
+        }
+
+
 class ColumnFilialPermissionForm(forms.ModelForm):
     class Meta:
         model = ColumnFilialPermission
@@ -85,6 +107,24 @@ class ColumnPermissionFilialForm(forms.Form):
             self.fields['filial'].queryset = Filial.objects.all()
 
 
+class ImportForm(forms.Form):
+    file = forms.FileField(
+        label='Файл CSV или XLSX',
+        widget=forms.ClearableFileInput(attrs={
+            'class': 'form-control',
+            'accept': '.csv,.xlsx'
+        })
+    )
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        extension = file.name.rsplit('.', 1)[-1].lower()
+        if extension not in ('csv', 'xlsx'):
+            raise ValidationError('Поддерживаются только файлы .csv и .xlsx')
+        self.cleaned_data['import_format'] = extension
+        return file
+
+
 class AddRowForm(forms.Form):
     def __init__(self, *args, columns, **kwargs):
         self.table = kwargs.pop('table', None)
@@ -102,6 +142,9 @@ class AddRowForm(forms.Form):
                         label=column.name,
                         required=required,
                         initial=initial_value,
+                        # Границы integer в PostgreSQL: больше не поместится в ячейку
+                        min_value=-2147483648,
+                        max_value=2147483647,
                         widget=forms.NumberInput(attrs={
                             'class': 'form-control',
                             'step': '1',
@@ -152,21 +195,52 @@ class AddRowForm(forms.Form):
                         }),
                     )
 
+    def clean_values(self, values):
+        """Проверяет значения одной строки полями формы, возвращает (cleaned_data, errors)
+
+        Ключи values - имена полей (col_<id>) или названия колонок. Одна форма
+        проверяет любое число строк, поля не создаются заново для каждой.
+        """
+        field_names = {field.label: name for name, field in self.fields.items()}
+        data = {}
+        errors = {}
+        for key, value in values.items():
+            name = key if key in self.fields else field_names.get(key)
+            if name is None:
+                errors[key] = ['Неизвестная колонка']
+            else:
+                data[name] = value
+
+        cleaned_data = {}
+        for name, field in self.fields.items():
+            try:
+                cleaned_data[name] = field.clean(data.get(name))
+            except ValidationError as e:
+                errors[name] = e.messages
+        return cleaned_data, errors
+
 
 class RowEditForm(forms.Form):
-    def __init__(self, *args, columns, **kwargs):
+    def __init__(self, *args, columns, cells=None, **kwargs):
         self.row = kwargs.pop('row', None)
         super().__init__(*args, **kwargs)
 
+        # Колонки по имени поля: clean() берёт тип и обязательность отсюда, без запросов
+        self.columns = {f'col_{column.id}': column for column in columns}
+
         if self.row:
-            for column in columns:
-                cell = self.row.cells.filter(column=column).first()
-                if cell:
-                    initial_value = cell.value
-                else:
+            # Значения ячеек {column_id: value}, по умолчанию - из документа строки
+            if cells is None:
+                cells = {
+                    column.id: Cell.from_document(self.row.data.get(str(column.id)), column.data_type)
+                    for column in self.columns.values()
+                }
+
+            for field_name, column in self.columns.items():
+                initial_value = cells.get(column.id)
+                if initial_value is None:
                     initial_value = ''
 
-                field_name = f'col_{column.id}'
                 required = column.is_required
 
                 if column.data_type == Column.ColumnType.INTEGER:
@@ -174,6 +248,9 @@ class RowEditForm(forms.Form):
                         label=column.name,
                         required=required,
                         initial=initial_value,
+                        # Границы integer в PostgreSQL: больше не поместится в ячейку
+                        min_value=-2147483648,
+                        max_value=2147483647,
                         widget=forms.NumberInput(attrs={
                             'class': 'form-control',
                             'step': '1',
@@ -228,8 +305,7 @@ class RowEditForm(forms.Form):
         cleaned_data = super().clean()
 
         for field_name, value in cleaned_data.items():
-            column_id = int(field_name.split('_')[1])
-            column = Column.objects.get(id=column_id)
+            column = self.columns[field_name]
             value_type = type(value)
 
             if column.is_required and value in [None, '']:
@@ -238,14 +314,20 @@ class RowEditForm(forms.Form):
                     code='required'
                 ))
 
+            # Пустое необязательное поле проверять не нужно
+            if value is None:
+                continue
+
             if column.data_type == Column.ColumnType.FLOAT:
                 if value_type is not float:
-                    self.add_error(column, ValidationError('Invalid value', code='Должно быть float числом'))
+                    self.add_error(field_name, ValidationError('Должно быть float числом', code='invalid'))
             elif column.data_type == Column.ColumnType.INTEGER:
                 if value_type is not int:
-                    self.add_error(column, ValidationError('Invalid value', code='Должно быть int числом'))
+                    self.add_error(field_name, ValidationError('Должно быть int числом', code='invalid'))
             elif column.data_type == Column.ColumnType.BOOLEAN:
                 if value_type is not bool:
-                    self.add_error(column, ValidationError('Invalid value', code='Должно быть true/false'))
+                    self.add_error(field_name, ValidationError('Должно быть true/false', code='invalid'))
             elif column.data_type == Column.ColumnType.DATE:
                 pass  # Пока не реализовано
+
+        return cleaned_data
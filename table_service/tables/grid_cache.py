@@ -0,0 +1,101 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
+
+# Метка вместо CSRF-токена в кэшируемом HTML: токен свой у каждой сессии и подставляется при выдаче
+CSRF_TOKEN_PLACEHOLDER = '__csrf_token_placeholder__'
+
+
+def permission_fingerprint(permissions):
+    """Всё, от чего зависят видимые пользователю строки, колонки и кнопки таблицы"""
+    fingerprint = (f'{permissions.user.pk}:{int(permissions.is_owner)}:'
+                   f'{int(permissions.is_admin)}:{permissions.filial_id or 0}')
+    return hashlib.md5(fingerprint.encode()).hexdigest()
+
+
+def grid_cache_key(request, table_obj, permissions, view_name):
+    """Ключ HTML таблицы: (представление, таблица, версия данных, права пользователя, параметры запроса)"""
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    return ':'.join([
+        'grid',
+        view_name,
+        str(table_obj.pk),
+        str(table_obj.data_version),
+        permission_fingerprint(permissions),
+        hashlib.md5(query.encode()).hexdigest(),
+    ])
+
+
+def render_grid(request, table_obj, permissions, view_name, build_table):
+    """HTML таблицы строк из кэша; при промахе таблица строится функцией build_table
+
+    Версия данных в ключе меняется при любой записи в таблицу, поэтому
+    устаревшие записи не удаляются явно, а просто перестают запрашиваться.
+    """
+    key = grid_cache_key(request, table_obj, permissions, view_name)
+    html = cache.get(key)
+    if html is None:
+        html = build_table().as_html(request)
+        cache.set(key, html, settings.GRID_CACHE_TIMEOUT)
+    return mark_safe(html.replace(CSRF_TOKEN_PLACEHOLDER, get_token(request)))
+
+
+def render_rows(request, table):
+    """HTML строк таблицы без заголовка, для замены отдельных строк на открытой странице"""
+    table.before_render(request)
+    html = render_to_string('tables/row_fragment.html', {'table': table}, request=request)
+    return mark_safe(html.replace(CSRF_TOKEN_PLACEHOLDER, get_token(request)))
+
+
+def page_etag(request, table_obj, permissions, view_name):
+    """Сильный ETag ответа: версия данных таблицы, права пользователя, параметры запроса и CSRF-секрет
+
+    Возвращает None, если ответ нельзя подтверждать по версии: нет CSRF-cookie
+    (в ответе появится новый токен) или есть неполученные сообщения.
+    """
+    csrf_secret = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    if not csrf_secret or len(messages.get_messages(request)):
+        return None
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    etag = ':'.join([
+        view_name,
+        str(table_obj.pk),
+        str(table_obj.data_version),
+        permission_fingerprint(permissions),
+        query,
+        csrf_secret,
+    ])
+    return '"%s"' % hashlib.md5(etag.encode()).hexdigest()
+
+
+def conditional_page(request, table_obj, permissions, view_name, get_response):
+    """Отвечает 304, если у клиента актуальная версия; иначе вызывает get_response и ставит валидаторы
+
+    Проверка идёт до запросов к строкам: достаточно загруженной таблицы и прав.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return get_response()
+    etag = page_etag(request, table_obj, permissions, view_name)
+    if etag is None:
+        return get_response()
+    last_modified = table_obj.data_changed_at and table_obj.data_changed_at.timestamp()
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = get_response()
+        if response.status_code != 200:
+            return response
+        response.headers.setdefault('ETag', etag)
+        if last_modified:
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+    # Браузер хранит ответ, но перепроверяет его при каждом открытии
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,265 @@
+import csv
+import datetime
+import io
+import multiprocessing
+import os
+from queue import Empty
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.crypto import get_random_string
+
+from .models import Column, Cell, Row
+from .xlsx_reader import iter_xlsx_rows, xlsx_worker
+
+# Сколько строк файла проверяется и загружается за один раз
+IMPORT_BATCH_SIZE = 2000
+
+# XLSX больше этого размера разбирается в отдельном процессе, параллельно с загрузкой в базу
+IMPORT_PROCESS_MIN_SIZE = 5 * 1024 * 1024
+
+# Раз в столько секунд ожидания пачки проверяется, жив ли процесс разбора XLSX
+IMPORT_PROCESS_POLL = 5
+
+IMPORT_FORMATS = ('csv', 'xlsx')
+
+INTEGER_MIN, INTEGER_MAX = -2147483648, 2147483647
+
+REPORT_HEADER = ['Строка', 'Колонка', 'Значение', 'Ошибка']
+
+
+class ImportResult:
+    """Итог импорта: сколько строк добавлено, ошибки по ячейкам и файл отчёта"""
+
+    def __init__(self):
+        self.created = 0
+        self.errors = []  # (номер строки файла, колонка, значение, сообщение)
+        self.ignored_headers = []
+        self.report_name = None
+
+
+def _to_integer(value):
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, str):
+        value = value.strip().replace(' ', '').replace(',', '.')
+        value = float(value) if '.' in value or 'e' in value.lower() else int(value)
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError
+        value = int(value)
+    if not INTEGER_MIN <= value <= INTEGER_MAX:
+        raise ValueError
+    return value
+
+
+def _to_float(value):
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, str):
+        value = value.strip().replace(' ', '').replace(',', '.')
+    return float(value)
+
+
+def _to_boolean(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in Cell.TRUE_VALUES or value == '1':
+        return True
+    if value in Cell.FALSE_VALUES or value == '0':
+        return False
+    raise ValueError
+
+
+def _to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    value = str(value).strip()
+    for fmt in Cell.DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError
+
+
+def _to_text(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%d.%m.%Y %H:%M')
+    if isinstance(value, datetime.date):
+        return value.strftime('%d.%m.%Y')
+    return str(value)
+
+
+CONVERTERS = {
+    Column.ColumnType.INTEGER: _to_integer,
+    Column.ColumnType.FLOAT: _to_float,
+    Column.ColumnType.BOOLEAN: _to_boolean,
+    Column.ColumnType.DATE: _to_date,
+    Column.ColumnType.TEXT: _to_text,
+}
+
+
+def coerce_column(values, column):
+    """Приводит значения одной колонки пачки к её типу, возвращает (значения, {индекс: ошибка})"""
+    convert = CONVERTERS.get(column.data_type, _to_text)
+    coerced = []
+    errors = {}
+    for index, value in enumerate(values):
+        if value is None or (isinstance(value, str) and not value.strip()):
+            if column.is_required:
+                errors[index] = 'Поле обязательно для заполнения'
+            coerced.append(None)
+            continue
+        try:
+            coerced.append(convert(value))
+        except (ValueError, TypeError, OverflowError):
+            errors[index] = f'Ожидается значение типа «{column.get_data_type_display()}»'
+            coerced.append(None)
+    return coerced, errors
+
+
+def iter_csv_rows(file):
+    """Строки CSV-файла; разделитель (запятая, точка с запятой, табуляция) определяется по началу файла"""
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    sample = text.read(64 * 1024)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    try:
+        yield from csv.reader(text, dialect)
+    finally:
+        # Исходный файл закрывает Django, обёртка его не трогает
+        text.detach()
+
+
+def iter_xlsx_rows_in_process(path):
+    """Строки большого XLSX: разбор идёт в отдельном процессе, пока текущая пачка пишется в базу"""
+    # fork из многопоточного процесса gunicorn копирует чужие блокировки и соединения с базой:
+    # дочерний процесс запускается заново и загружает только xlsx_reader, без Django
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue(maxsize=4)
+    process = context.Process(target=xlsx_worker, args=(path, queue, IMPORT_BATCH_SIZE), daemon=True)
+    process.start()
+    try:
+        while True:
+            try:
+                batch = queue.get(timeout=IMPORT_PROCESS_POLL)
+            except Empty:
+                if process.is_alive():
+                    continue
+                # Процесс мог завершиться сразу после последней пачки; убитый до конца файла
+                # процесс иначе держал бы запрос и транзакцию вечно
+                try:
+                    batch = queue.get(timeout=1)
+                except Empty:
+                    raise ValueError(f'Процесс разбора XLSX завершился аварийно (код {process.exitcode})')
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+    finally:
+        process.kill()
+        process.join()
+
+
+def iter_upload_rows(uploaded_file, import_format):
+    """Строки загруженного файла, первая - заголовок"""
+    if import_format == 'csv':
+        return iter_csv_rows(uploaded_file.file)
+    path = getattr(uploaded_file, 'temporary_file_path', None)
+    if path and uploaded_file.size >= IMPORT_PROCESS_MIN_SIZE:
+        return iter_xlsx_rows_in_process(path())
+    return iter_xlsx_rows(uploaded_file.file)
+
+
+def _iter_batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_rows(table, user, filial_id, uploaded_file, import_format):
+    """Импортирует строки из CSV/XLSX: заголовки сопоставляются с колонками по названию
+
+    Строки с ошибками пропускаются и попадают в отчёт, остальные добавляются
+    пачками через Row.bulk_insert в одной транзакции.
+    """
+    result = ImportResult()
+    columns = list(table.columns.all())
+    rows = iter_upload_rows(uploaded_file, import_format)
+
+    header = next(rows, None) or []
+    columns_by_name = {column.name.strip(): column for column in columns}
+    positions = {}  # column -> индекс в строке файла
+    for index, name in enumerate(header):
+        name = str(name).strip() if name is not None else ''
+        column = columns_by_name.get(name)
+        if column and column not in positions:
+            positions[column] = index
+        elif name:
+            result.ignored_headers.append(name)
+
+    line_number = 1  # заголовок
+    with transaction.atomic():
+        for batch in _iter_batches(rows):
+            first_line = line_number + 1
+            line_number += len(batch)
+            # Пустые строки файла пропускаются
+            batch = [
+                (first_line + offset, values) for offset, values in enumerate(batch)
+                if any(value not in (None, '') for value in values)
+            ]
+
+            coerced = {}
+            bad_rows = set()
+            for column in columns:
+                position = positions.get(column)
+                raw = [
+                    values[position] if position is not None and position < len(values) else None
+                    for _, values in batch
+                ]
+                coerced[column], errors = coerce_column(raw, column)
+                for index, message in errors.items():
+                    bad_rows.add(index)
+                    result.errors.append((batch[index][0], column.name, raw[index], message))
+
+            rows_values = [
+                {column: coerced[column][index] for column in columns}
+                for index in range(len(batch))
+                if index not in bad_rows
+            ]
+            if rows_values:
+                result.created += len(Row.bulk_insert(table, user, filial_id, rows_values))
+
+    if result.errors:
+        result.errors.sort(key=lambda error: error[0])
+        result.report_name = write_error_report(table, result.errors)
+    return result
+
+
+def report_path(table, report_name):
+    return os.path.join(settings.EXPORT_ROOT, 'import_reports', f'{table.pk}_{report_name}.csv')
+
+
+def write_error_report(table, errors):
+    """Сохраняет отчёт об ошибках импорта в CSV, возвращает его имя"""
+    report_name = get_random_string(32)
+    path = report_path(table, report_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.writer(file)
+        writer.writerow(REPORT_HEADER)
+        writer.writerows(errors)
+    return report_name
@@ -0,0 +1,90 @@
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def login_opener(base_url, username, password):
+    """urllib-клиент с сессией пользователя: вход через форму /accounts/login/"""
+    jar = CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    login_url = urllib.parse.urljoin(base_url, '/accounts/login/')
+    opener.open(login_url).read()
+    data = urllib.parse.urlencode({
+        'username': username,
+        'password': password,
+        'csrfmiddlewaretoken': csrf_token(opener),
+    }).encode()
+    opener.open(urllib.request.Request(login_url, data=data, headers={'Referer': login_url})).read()
+    if not any(cookie.name == 'sessionid' for cookie in jar):
+        raise CommandError(f'Не удалось войти как {username}')
+    return opener
+
+
+def csrf_token(opener):
+    """CSRF-токен из cookie сессии клиента; после входа Django его меняет, поэтому читается перед каждым POST"""
+    jar = next(handler.cookiejar for handler in opener.handlers
+               if isinstance(handler, urllib.request.HTTPCookieProcessor))
+    return next((cookie.value for cookie in jar if cookie.name == 'csrftoken'), '')
+
+
+def timed_get(opener, url):
+    """GET запроса, возвращает (код ответа, время в секундах)"""
+    return timed_request(opener, url)
+
+
+def timed_request(opener, request):
+    """Запрос (URL или urllib.request.Request), возвращает (код ответа, время в секундах)"""
+    start = time.perf_counter()
+    try:
+        with opener.open(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0
+    return status, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = 'Замеряет пропускную способность запущенного сервера (запросов в секунду) на страницах таблиц'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000',
+                            help='Адрес запущенного сервера')
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--path', action='append', dest='paths', default=None,
+                            help='Путь страницы (можно указать несколько раз), по умолчанию - список таблиц')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Количество запросов на каждую страницу')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Количество одновременных запросов')
+
+    def handle(self, *args, **options):
+        opener = login_opener(options['base_url'], options['username'], options['password'])
+        for path in options['paths'] or ['/']:
+            url = urllib.parse.urljoin(options['base_url'], path)
+            # Прогрев: первые запросы открывают соединения с базой и заполняют кэши
+            for _ in range(options['concurrency']):
+                timed_get(opener, url)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                results = list(executor.map(lambda _: timed_get(opener, url), range(options['requests'])))
+            elapsed = time.perf_counter() - start
+
+            latencies = sorted(duration for _, duration in results)
+            errors = sum(1 for status, _ in results if status != 200)
+            self.stdout.write(
+                f'{path}: {len(results) / elapsed:.1f} запросов/с, '
+                f'среднее {statistics.mean(latencies) * 1000:.1f} мс, '
+                f'медиана {statistics.median(latencies) * 1000:.1f} мс, '
+                f'ошибок {errors}'
+            )
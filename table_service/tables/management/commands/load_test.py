@@ -0,0 +1,222 @@
+import datetime
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from tables.models import Table, Column, TablePermission, RowFilialPermission, PermissionContext
+from .benchmark_serving import login_opener, csrf_token, timed_request
+
+# Сценарий сотрудника: доли действий между паузами
+ACTIONS = ['view', 'add_row', 'edit_row']
+ACTION_WEIGHTS = [6, 2, 2]
+
+# Порядок строк в отчёте
+ENDPOINTS = ['shared_table_view', 'add_row GET', 'add_row POST', 'edit_row GET', 'edit_row POST',
+             'revoke_redact_rows']
+
+
+def percentile(values, percent):
+    """Перцентиль отсортированного списка (метод ближайшего ранга)"""
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+
+class VirtualUser(threading.Thread):
+    """Сотрудник филиала со своей сессией: смотрит таблицу, добавляет и редактирует строки"""
+
+    def __init__(self, harness, username, filial_id, columns, row_ids, revoke, seed):
+        super().__init__(name=f'load-{username}', daemon=True)
+        self.harness = harness
+        self.username = username
+        self.filial_id = filial_id
+        self.columns = columns
+        self.row_ids = row_ids
+        # Один сотрудник каждого филиала завершает редактирование ближе к концу срока
+        self.revoke = revoke
+        self.rng = random.Random(seed)
+        # Вход до начала теста: его время не попадает в замеры, а ошибка входа видна сразу
+        self.opener = login_opener(harness.base_url, username, harness.password)
+
+    def request(self, endpoint, path, data=None):
+        url = urllib.parse.urljoin(self.harness.base_url, path)
+        if data is None:
+            request = url
+        else:
+            request = urllib.request.Request(url, data=urllib.parse.urlencode(data).encode(), headers={
+                'X-CSRFToken': csrf_token(self.opener),
+                'Referer': url,
+            })
+        status, duration = timed_request(self.opener, request)
+        self.harness.record(endpoint, status, duration)
+        return status
+
+    def row_data(self):
+        data = {}
+        for pk, data_type in self.columns:
+            field = f'col_{pk}'
+            if data_type == Column.ColumnType.INTEGER:
+                data[field] = self.rng.randint(0, 100000)
+            elif data_type == Column.ColumnType.FLOAT:
+                data[field] = round(self.rng.uniform(0, 10000), 2)
+            elif data_type == Column.ColumnType.BOOLEAN:
+                if self.rng.random() < 0.5:
+                    data[field] = 'on'
+            elif data_type == Column.ColumnType.DATE:
+                data[field] = (datetime.date(2025, 1, 1) + datetime.timedelta(days=self.rng.randrange(365))).isoformat()
+            else:
+                data[field] = f'Нагрузочный тест {self.rng.randint(1, 1000)}'
+        return data
+
+    def run(self):
+        harness = self.harness
+        table = harness.table
+        while time.monotonic() < harness.deadline:
+            if self.revoke and time.monotonic() >= harness.revoke_at:
+                self.request('revoke_redact_rows', reverse('revoke_redact_rows', args=[table.share_token]), {})
+                self.revoke = False
+
+            action = self.rng.choices(ACTIONS, ACTION_WEIGHTS)[0]
+            if action == 'view':
+                path = reverse('shared_table_view', args=[table.share_token])
+                self.request('shared_table_view', f'{path}?page={self.rng.randint(1, harness.pages)}')
+            elif action == 'add_row':
+                path = reverse('add_row', args=[table.pk])
+                if self.request('add_row GET', path) == 200:
+                    self.think()
+                    self.request('add_row POST', path, self.row_data())
+            elif self.row_ids:
+                # Сотрудники филиала правят одни и те же строки: отсюда ответы 423
+                path = reverse('edit_row', args=[table.pk, self.rng.choice(self.row_ids)])
+                if self.request('edit_row GET', path) == 200:
+                    self.think()
+                    self.request('edit_row POST', path, self.row_data())
+            self.think()
+
+    def think(self):
+        if self.harness.think:
+            time.sleep(self.rng.uniform(0, 2 * self.harness.think))
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест запущенного сервера в духе сдачи отчётности: сотрудники нескольких филиалов '
+            'одновременно смотрят таблицу, добавляют и редактируют строки и завершают редактирование. '
+            'Выводит p50/p95/p99, пропускную способность и долю ошибок и ответов 423 по представлениям. '
+            'Изменяет данные таблицы: запускать на базе, заполненной seed_scale')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Адрес запущенного сервера')
+        parser.add_argument('--table', type=int, required=True, help='id таблицы')
+        parser.add_argument('--password', default='password', help='Пароль сотрудников (как в seed_scale)')
+        parser.add_argument('--filials', type=int, default=10, help='Сколько филиалов участвует')
+        parser.add_argument('--users-per-filial', type=int, default=3)
+        parser.add_argument('--duration', type=float, default=60, help='Длительность теста, секунд')
+        parser.add_argument('--think', type=float, default=0.5,
+                            help='Средняя пауза сотрудника между действиями, секунд')
+        parser.add_argument('--hot-rows', type=int, default=20,
+                            help='Сколько строк своего филиала правят сотрудники; меньше - больше конфликтов')
+        parser.add_argument('--revoke-at', type=float, default=0.8,
+                            help='Доля длительности, после которой филиалы завершают редактирование; 0 - не завершать')
+        parser.add_argument('--pages', type=int, default=5, help='Из скольких первых страниц таблицы выбирать')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', dest='json_path', help='Сохранить результаты в JSON-файл')
+
+    def handle(self, *args, **options):
+        try:
+            self.table = Table.objects.get(pk=options['table'])
+        except Table.DoesNotExist:
+            raise CommandError(f'Таблица {options["table"]} не найдена')
+        self.base_url = options['base_url']
+        self.password = options['password']
+        self.think = options['think']
+        self.pages = options['pages']
+        self.results = defaultdict(list)  # endpoint -> [(код ответа, время)]
+        self.lock = threading.Lock()
+
+        users = self.virtual_users(options)
+        self.stdout.write(f'Сотрудников: {len(users)}, филиалов: {len({user.filial_id for user in users})}, '
+                          f'длительность {options["duration"]:.0f} с')
+
+        start = time.monotonic()
+        self.deadline = start + options['duration']
+        self.revoke_at = start + options['duration'] * options['revoke_at'] if options['revoke_at'] else math.inf
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        self.report(time.monotonic() - start, options['json_path'])
+
+    def record(self, endpoint, status, duration):
+        with self.lock:
+            self.results[endpoint].append((status, duration))
+
+    def virtual_users(self, options):
+        """Сотрудники филиалов с правом просмотра таблицы, их редактируемые колонки и общие строки филиала"""
+        rng = random.Random(options['seed'])
+        by_filial = defaultdict(list)
+        permissions = TablePermission.objects.filter(table=self.table, can_view=True).select_related(
+            'user__profile__employee').order_by('user_id')
+        for permission in permissions:
+            employee = getattr(getattr(permission.user, 'profile', None), 'employee', None)
+            if employee and employee.id_filial:
+                by_filial[employee.id_filial].append(permission.user)
+        if not by_filial:
+            raise CommandError('У таблицы нет сотрудников филиалов с правом просмотра')
+
+        filial_ids = sorted(by_filial)
+        filial_ids = sorted(rng.sample(filial_ids, min(options['filials'], len(filial_ids))))
+        users = []
+        for filial_id in filial_ids:
+            row_ids = list(RowFilialPermission.objects.filter(
+                row__table=self.table, filial_id=filial_id, can_edit=True
+            ).order_by('row_id').values_list('row_id', flat=True)[:options['hot_rows']])
+            for index, user in enumerate(by_filial[filial_id][:options['users_per_filial']]):
+                permissions = PermissionContext(user, self.table)
+                columns = list(Column.get_editable_columns(user, self.table, permissions)
+                               .values_list('pk', 'data_type'))
+                users.append(VirtualUser(self, user.username, filial_id, columns, row_ids,
+                                         revoke=index == 0, seed=rng.random()))
+        return users
+
+    def report(self, elapsed, json_path):
+        summary = {}
+        self.stdout.write(f'{"Представление":<20} {"запросов":>8} {"в сек":>7} {"p50 мс":>8} {"p95 мс":>8} '
+                          f'{"p99 мс":>8} {"ошибок":>7} {"423":>6}  коды ответов')
+        for endpoint in ENDPOINTS:
+            results = self.results.get(endpoint)
+            if not results:
+                continue
+            latencies = sorted(duration * 1000 for _, duration in results)
+            statuses = defaultdict(int)
+            for status, _ in results:
+                statuses[status] += 1
+            errors = sum(count for status, count in statuses.items()
+                         if status == 0 or (status >= 400 and status != 423))
+            summary[endpoint] = {
+                'requests': len(results),
+                'throughput': len(results) / elapsed,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'error_rate': errors / len(results),
+                'locked_rate': statuses.get(423, 0) / len(results),
+                'statuses': dict(sorted(statuses.items())),
+            }
+            row = summary[endpoint]
+            self.stdout.write(
+                f'{endpoint:<20} {row["requests"]:>8} {row["throughput"]:>7.1f} {row["p50"]:>8.1f} '
+                f'{row["p95"]:>8.1f} {row["p99"]:>8.1f} {row["error_rate"]:>7.1%} {row["locked_rate"]:>6.1%}  '
+                + ', '.join(f'{status}×{count}' for status, count in row['statuses'].items())
+            )
+        total = sum(len(results) for results in self.results.values())
+        self.stdout.write(self.style.SUCCESS(f'Всего {total} запросов за {elapsed:.1f} с: {total / elapsed:.1f} в секунду'))
+
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as file:
+                json.dump({'elapsed': elapsed, 'endpoints': summary}, file, indent=2, ensure_ascii=False)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from tables.models import Row
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает JSON-документы строк (Row.data) по ячейкам Cell'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', type=int, action='append', dest='tables',
+                            help='id таблицы (можно указать несколько раз), по умолчанию - все таблицы')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Количество строк, обрабатываемых за одну транзакцию')
+
+    def handle(self, *args, **options):
+        rows = Row.objects.all()
+        if options['tables']:
+            rows = rows.filter(table_id__in=options['tables'])
+
+        count = Row.rebuild_data(rows, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Документы пересобраны для {count} строк'))
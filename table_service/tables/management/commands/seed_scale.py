@@ -0,0 +1,271 @@
+import datetime
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from tables.models import ADMINISTRATION_FILIAL_ID, Filial, Department, Employee, Profile, Table, Column, Row, Cell, \
+    TablePermission, TableFilialPermission, ColumnPermission, ColumnFilialPermission, RowPermission, TableFilialLock
+
+# Сколько строк подряд добавляет один сотрудник: строки таблицы вносятся порциями разных авторов
+ROWS_PER_AUTHOR = 50
+
+BATCH_SIZE = 5000
+
+WORDS = [
+    'отчёт', 'план', 'факт', 'заявка', 'договор', 'поставка', 'ремонт', 'объект', 'участок', 'бригада',
+    'смета', 'акт', 'согласовано', 'в работе', 'выполнено', 'перенос', 'лимит', 'резерв', 'квартал', 'итог',
+]
+POSTS = ['Инженер', 'Ведущий инженер', 'Экономист', 'Мастер', 'Начальник участка', 'Специалист', 'Бухгалтер']
+NAMES = ['Иван', 'Пётр', 'Анна', 'Мария', 'Сергей', 'Ольга', 'Алексей', 'Елена', 'Дмитрий', 'Наталья']
+SURNAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов', 'Морозов']
+PATRONYMICS = ['Иванович', 'Петрович', 'Сергеевич', 'Алексеевич', 'Ивановна', 'Петровна', 'Сергеевна']
+
+# Распределение типов колонок и прав на колонки
+COLUMN_TYPES = [Column.ColumnType.TEXT] * 4 + [Column.ColumnType.INTEGER] * 2 + [
+    Column.ColumnType.FLOAT, Column.ColumnType.BOOLEAN, Column.ColumnType.DATE, Column.ColumnType.DATE]
+PERMISSION_TYPES = ['EV'] * 5 + ['VO'] * 4 + ['NA']
+
+# Позиция типизированного значения в наборе Cell.COPY_FIELDS
+VALUE_POSITIONS = {
+    Column.ColumnType.TEXT: Cell.COPY_FIELDS.index('text_value'),
+    Column.ColumnType.INTEGER: Cell.COPY_FIELDS.index('integer_value'),
+    Column.ColumnType.FLOAT: Cell.COPY_FIELDS.index('float_value'),
+    Column.ColumnType.BOOLEAN: Cell.COPY_FIELDS.index('boolean_value'),
+    Column.ColumnType.DATE: Cell.COPY_FIELDS.index('date_value'),
+}
+
+
+class Command(BaseCommand):
+    help = ('Создаёт синтетический набор данных для нагрузочного тестирования: филиалы, отделы, '
+            'сотрудников с пользователями, таблицы, строки и права. '
+            'На пустой базе одинаковый --seed даёт одинаковые данные')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора случайных чисел')
+        parser.add_argument('--prefix', default='scale', help='Префикс логинов и названий таблиц')
+        parser.add_argument('--password', default='password', help='Пароль всех создаваемых пользователей')
+        parser.add_argument('--filials', type=int, default=20)
+        parser.add_argument('--departments', type=int, default=5, help='Отделов в каждом филиале')
+        parser.add_argument('--employees', type=int, default=50, help='Сотрудников в каждом филиале')
+        parser.add_argument('--tables', type=int, default=10)
+        parser.add_argument('--columns', type=int, default=20, help='Колонок в каждой таблице')
+        parser.add_argument('--rows', type=int, default=5000, help='Строк в каждой таблице')
+        parser.add_argument('--share', type=float, default=0.5,
+                            help='Доля филиалов, которым открыта каждая таблица')
+        parser.add_argument('--row-grants', type=float, default=0.02,
+                            help='Доля строк с личными правами сотрудника другого филиала')
+        parser.add_argument('--locked', type=float, default=0.1,
+                            help='Доля филиалов, завершивших редактирование таблицы')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(f'Пользователи с префиксом {prefix}_ уже есть, укажите другой --prefix')
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            filials = self.create_filials()
+            self.owner = self.create_users([(f'{prefix}_owner', ADMINISTRATION_FILIAL_ID, None)])[0]
+            employees = self.create_employees(filials)
+            cells = 0
+            for index in range(options['tables']):
+                cells += self.create_table(index, filials, employees)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: филиалов {len(filials)}, пользователей {sum(map(len, employees.values())) + 1}, '
+            f'таблиц {options["tables"]}, строк {options["tables"] * options["rows"]}, ячеек {cells} '
+            f'за {time.perf_counter() - start:.1f} с. Владелец таблиц: {self.owner.username}'
+        ))
+
+    def next_id(self, model, field='id'):
+        return (model.objects.aggregate(value=Max(field))['value'] or 0) + 1
+
+    def create_filials(self):
+        Filial.objects.get_or_create(id=ADMINISTRATION_FILIAL_ID, defaults={'name': 'Администрация'})
+        filial_ids = []
+        next_id = self.next_id(Filial)
+        while len(filial_ids) < self.options['filials']:
+            if next_id != ADMINISTRATION_FILIAL_ID:
+                filial_ids.append(next_id)
+            next_id += 1
+        filials = Filial.objects.bulk_create([
+            Filial(id=filial_id, name=f'Филиал {filial_id}', short_name=f'Ф{filial_id}')
+            for filial_id in filial_ids
+        ])
+
+        departments = []
+        department_id = self.next_id(Department)
+        for filial in filials:
+            parent_id = department_id
+            for index in range(self.options['departments']):
+                departments.append(Department(
+                    id=department_id,
+                    id_parent=parent_id if index else None,
+                    id_filial=filial.pk,
+                    name=f'Отдел {index + 1} филиала {filial.pk}',
+                ))
+                department_id += 1
+        Department.objects.bulk_create(departments, batch_size=BATCH_SIZE)
+        self.departments = {}
+        for department in departments:
+            self.departments.setdefault(department.id_filial, []).append(department.pk)
+        return filials
+
+    def create_users(self, specs):
+        """Пользователи с сотрудником и профилем; specs - [(логин, филиал, отдел)]"""
+        password = make_password(self.options['password'])
+        users = User.objects.bulk_create(
+            [User(username=username, password=password) for username, _, _ in specs], batch_size=BATCH_SIZE)
+        employee_id = self.next_id(Employee)
+        tabnumber = self.next_id(Employee, 'tabnumber')
+        employees = Employee.objects.bulk_create([
+            Employee(
+                id=employee_id + index,
+                tabnumber=tabnumber + index,
+                id_filial=filial_id,
+                id_department=department_id,
+                post_name=self.rng.choice(POSTS),
+                firstname=self.rng.choice(NAMES),
+                secondname=self.rng.choice(SURNAMES),
+                lastname=self.rng.choice(PATRONYMICS),
+            )
+            for index, (_, filial_id, department_id) in enumerate(specs)
+        ], batch_size=BATCH_SIZE)
+        Profile.objects.bulk_create([
+            Profile(user=user, employee=employee) for user, employee in zip(users, employees)
+        ], batch_size=BATCH_SIZE)
+        return users
+
+    def create_employees(self, filials):
+        """Сотрудники по филиалам: {filial_id: [user]}"""
+        specs = [
+            (f'{self.options["prefix"]}_{filial.pk}_{index}', filial.pk, self.rng.choice(self.departments[filial.pk]))
+            for filial in filials
+            for index in range(self.options['employees'])
+        ]
+        employees = {}
+        for user, (_, filial_id, _) in zip(self.create_users(specs), specs):
+            employees.setdefault(filial_id, []).append(user)
+        return employees
+
+    def cell_value(self, column):
+        if not column.is_required and self.rng.random() < 0.1:
+            # Пустая текстовая ячейка хранится как '', как при сохранении через Cell.value
+            return '' if column.data_type == Column.ColumnType.TEXT else None
+        if column.data_type == Column.ColumnType.INTEGER:
+            return self.rng.randint(-1000, 100000)
+        if column.data_type == Column.ColumnType.FLOAT:
+            return round(self.rng.uniform(0, 10000), 2)
+        if column.data_type == Column.ColumnType.BOOLEAN:
+            return self.rng.random() < 0.5
+        if column.data_type == Column.ColumnType.DATE:
+            return datetime.date(2025, 1, 1) + datetime.timedelta(days=self.rng.randrange(365))
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(1, 4)))
+
+    def create_table(self, index, filials, employees):
+        """Таблица с колонками, строками и правами; возвращает число ячеек"""
+        rng = self.rng
+        options = self.options
+        table = Table.objects.create(
+            title=f'{options["prefix"]} таблица {index + 1}',
+            owner=self.owner,
+            created_at=datetime.datetime.now(),
+        )
+        columns = Column.objects.bulk_create([
+            Column(table=table, name=f'Колонка {order + 1}', order=order,
+                   data_type=rng.choice(COLUMN_TYPES), is_required=rng.random() < 0.1)
+            for order in range(options['columns'])
+        ])
+
+        # Таблица открыта части филиалов; как и в manage_table_permissions, права получают все их сотрудники
+        shared = rng.sample(filials, max(1, round(len(filials) * options['share'])))
+        shared_users = [user for filial in shared for user in employees[filial.pk]]
+        TableFilialPermission.objects.bulk_create([
+            TableFilialPermission(table=table, filial=filial, can_view=True) for filial in shared
+        ])
+        TablePermission.objects.bulk_create([
+            TablePermission(table=table, user=user, can_view=True) for user in shared_users
+        ], batch_size=BATCH_SIZE)
+
+        # Права на колонки: право филиала действует на его сотрудников, у части сотрудников - своё исключение
+        column_permissions = []
+        filial_permissions = []
+        for filial in shared:
+            for column in columns:
+                permission_type = rng.choice(PERMISSION_TYPES)
+                filial_permissions.append(
+                    ColumnFilialPermission(column=column, filial=filial, permission_type=permission_type))
+                for user in employees[filial.pk]:
+                    if rng.random() < 0.05:
+                        column_permissions.append(
+                            ColumnPermission(column=column, user=user, permission_type=rng.choice(PERMISSION_TYPES)))
+        ColumnFilialPermission.objects.bulk_create(filial_permissions, batch_size=BATCH_SIZE)
+        ColumnPermission.objects.bulk_create(column_permissions, batch_size=BATCH_SIZE)
+
+        row_ids = self.create_rows(table, columns, shared, employees)
+
+        # Личные права на отдельные строки сотрудникам других филиалов
+        granted = rng.sample(row_ids, round(len(row_ids) * options['row_grants']))
+        RowPermission.objects.bulk_create([
+            RowPermission(row_id=row_id, user=rng.choice(shared_users),
+                          can_edit=rng.random() < 0.7, can_delete=rng.random() < 0.2)
+            for row_id in granted
+        ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+        locked = rng.sample(shared, round(len(shared) * options['locked']))
+        TableFilialLock.objects.bulk_create([
+            TableFilialLock(table=table, filial=filial, locked_by=rng.choice(employees[filial.pk]),
+                            locked_at=datetime.datetime.now())
+            for filial in locked
+        ])
+        return len(row_ids) * len(columns)
+
+    def create_rows(self, table, columns, shared, employees):
+        """Строки с документами и ячейками, возвращает их id
+
+        То же, что Row.bulk_insert, но ячейки пишутся в COPY прямо из значений,
+        без создания объектов Cell: так миллион ячеек загружается за секунды.
+        """
+        rng = self.rng
+        # Строки вносят порциями сотрудники филиалов, которым открыта таблица
+        authors = []
+        rows = []
+        cells = []
+        for order in range(self.options['rows']):
+            if order % ROWS_PER_AUTHOR == 0:
+                filial = rng.choice(shared)
+                authors.append((rng.choice(employees[filial.pk]), filial.pk, []))
+            author, _, author_rows = authors[-1]
+            values = [(column, self.cell_value(column)) for column in columns]
+            row = Row(table=table, order=order, created_by=author, data={
+                str(column.pk): value.isoformat() if isinstance(value, datetime.date) else value
+                for column, value in values
+            })
+            rows.append(row)
+            author_rows.append(row)
+            cells.append(values)
+
+        Row.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        copy_values = []
+        for row, values in zip(rows, cells):
+            for column, value in values:
+                cell = [row.pk, column.pk, '', None, None, None, None]
+                cell[VALUE_POSITIONS[column.data_type]] = value
+                copy_values.append(cell)
+        Cell.copy_values(copy_values)
+        Row.refresh_search(table.rows.all())
+        for author, filial_id, author_rows in authors:
+            Row.grant_creator_permissions(author_rows, author, filial_id)
+        # bulk_create не отправляет сигналы, версия данных увеличивается явно
+        Table.touch(table.pk)
+        return [row.pk for row in rows]
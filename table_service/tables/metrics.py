@@ -0,0 +1,254 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Метрики собираются в памяти процесса. Процессы gunicorn отвечают на /metrics/ по очереди,
+# поэтому с METRICS_DIR каждый раз в METRICS_FLUSH_INTERVAL секунд записывает свои значения
+# в <pid>.json, а ответ складывает файлы всех процессов, в том числе завершившихся:
+# счётчики не убывают при перезапуске процесса. Без METRICS_DIR отдаются значения процесса.
+METRICS_FLUSH_INTERVAL = 1
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (1024, 16 * 1024, 128 * 1024, 1024 ** 2, 8 * 1024 ** 2, 64 * 1024 ** 2, 512 * 1024 ** 2)
+ROWS_BUCKETS = (0, 1, 2, 5, 10, 100, 1000, 10000, 100000)
+EXPORT_DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+REGISTRY = []
+
+# Значения изменились после последней записи в METRICS_DIR; процесс, в котором запущен поток записи
+_dirty = False
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}  # значения меток -> значение метрики
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _changed(self):
+        global _dirty
+        _dirty = True
+        if _flusher_pid != os.getpid():
+            _start_flusher()
+
+    def snapshot(self):
+        """Значения в виде, пригодном для JSON"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def render(self, values):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for key, value in sorted(values.items()):
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(Metric):
+    """Счётчик событий с метками"""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self._changed()
+
+    @staticmethod
+    def merge(value, other):
+        return other if value is None else value + other
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_number(value)}']
+
+
+class Histogram(Metric):
+    """Гистограмма наблюдений с метками и фиксированными границами корзин"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+        self._changed()
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), [list(counts), total]] for key, (counts, total) in self._values.items()]
+
+    @staticmethod
+    def merge(value, other):
+        if value is None:
+            return other
+        return [a + b for a, b in zip(value[0], other[0])], value[1] + other[1]
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(self.labels, key, [('le', _format_number(bound))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labels, key)
+        lines.append(f'{self.name}_sum{labels} {_format_number(total)}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def _snapshot():
+    return {metric.name: metric.snapshot() for metric in REGISTRY}
+
+
+def flush(directory):
+    """Записывает значения процесса в METRICS_DIR: файл заменяется целиком"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(_snapshot(), file)
+    os.replace(f'{path}.tmp', path)
+
+
+def _flush_periodically():
+    global _dirty
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        if _dirty and settings.METRICS_DIR:
+            _dirty = False
+            try:
+                flush(settings.METRICS_DIR)
+            except OSError:
+                logger.exception('Не удалось записать метрики в %s', settings.METRICS_DIR)
+
+
+def _start_flusher():
+    # Поток не переживает fork, поэтому запускается в каждом процессе при первом изменении
+    global _flusher_pid
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        if settings.METRICS_DIR:
+            threading.Thread(target=_flush_periodically, name='metrics-flush', daemon=True).start()
+
+
+def _read_snapshots(directory):
+    flush(directory)
+    snapshots = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            logger.exception('Не удалось прочитать метрики %s', name)
+    return snapshots
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus: всех процессов с METRICS_DIR, иначе этого"""
+    directory = settings.METRICS_DIR
+    snapshots = _read_snapshots(directory) if directory else [_snapshot()]
+    lines = []
+    for metric in REGISTRY:
+        values = {}
+        for snapshot in snapshots:
+            for key, value in snapshot.get(metric.name, ()):
+                key = tuple(key)
+                values[key] = metric.merge(values.get(key), value)
+        lines.extend(metric.render(values))
+    return '\n'.join(lines) + '\n'
+
+
+VIEW_DURATION = Histogram(
+    'table_service_view_duration_seconds', 'Время ответа представления',
+    ['view', 'method'], DURATION_BUCKETS)
+VIEW_QUERIES = Histogram(
+    'table_service_view_queries', 'Число SQL-запросов за HTTP-запрос',
+    ['view'], QUERY_BUCKETS)
+ROW_LOCKS = Counter(
+    'table_service_row_lock_total', 'Попытки заблокировать строку: acquired, conflict, expired (захват истёкшей чужой)',
+    ['outcome'])
+EXPORT_DURATION = Histogram(
+    'table_service_export_duration_seconds', 'Время выгрузки таблицы',
+    ['format'], EXPORT_DURATION_BUCKETS)
+EXPORT_BYTES = Histogram(
+    'table_service_export_bytes', 'Размер выгрузки таблицы',
+    ['format'], SIZE_BUCKETS)
+PERMISSION_ROWS = Histogram(
+    'table_service_permission_rows_written', 'Число строк прав, записанных одной операцией',
+    ['operation'], ROWS_BUCKETS)
+
+
+class QueryCounter:
+    """Считает SQL-запросы через connection.execute_wrapper"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Время ответа и число SQL-запросов по имени URL"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        # Имя URL, а не путь: число меток не растёт с числом таблиц и строк
+        view = match.view_name if match else 'unmatched'
+        VIEW_DURATION.observe(elapsed, view=view, method=request.method)
+        VIEW_QUERIES.observe(counter.count, view=view)
+        return response
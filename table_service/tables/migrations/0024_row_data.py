@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:39
+
+from django.db import migrations, models
+
+
+def fill_row_data(apps, schema_editor):
+    """Заполняет документы существующих строк по ячейкам"""
+    Row = apps.get_model('tables', 'Row')
+    Cell = apps.get_model('tables', 'Cell')
+
+    value_fields = {
+        'integer': 'integer_value',
+        'float': 'float_value',
+        'boolean': 'boolean_value',
+        'date': 'date_value',
+    }
+    documents = {}
+    cells = Cell.objects.values(
+        'row_id', 'column_id', 'column__data_type',
+        'text_value', 'integer_value', 'float_value', 'boolean_value', 'date_value',
+    )
+    for cell in cells.iterator(chunk_size=5000):
+        value = cell[value_fields.get(cell['column__data_type'], 'text_value')]
+        if cell['column__data_type'] == 'date' and value is not None:
+            value = value.isoformat()
+        documents.setdefault(cell['row_id'], {})[str(cell['column_id'])] = value
+
+    Row.objects.bulk_update(
+        [Row(pk=row_id, data=document) for row_id, document in documents.items()],
+        ['data'],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0023_alter_admin_created_at_columnfilialpermission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='row',
+            name='data',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(fill_row_data, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:43
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.operations
+import django.contrib.postgres.search
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0024_row_data'),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.TrigramExtension(),
+        migrations.AddField(
+            model_name='row',
+            name='search_text',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='row',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='row',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('search_text'), name='gin_trgm_ops'), name='row_search_text_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='row',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='row_search_vector'),
+        ),
+        migrations.AddIndex(
+            model_name='row',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['data'], name='row_data_path_ops', opclasses=['jsonb_path_ops']),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE tables_row SET search_text = COALESCE((
+                SELECT string_agg(document.value, ' ')
+                FROM jsonb_each_text(tables_row.data) AS document
+                JOIN tables_column ON tables_column.id = document.key::bigint
+                WHERE tables_column.data_type = 'text'
+            ), '');
+            UPDATE tables_row SET search_vector = to_tsvector('simple', search_text);
+            """,
+            migrations.RunSQL.noop
+        ),
+    ]
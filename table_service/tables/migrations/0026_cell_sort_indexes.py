@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:45
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0025_row_search_document'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cell',
+            index=models.Index(fields=['column', 'integer_value', 'row'], name='cell_sort_integer'),
+        ),
+        migrations.AddIndex(
+            model_name='cell',
+            index=models.Index(fields=['column', 'float_value', 'row'], name='cell_sort_float'),
+        ),
+        migrations.AddIndex(
+            model_name='cell',
+            index=models.Index(fields=['column', 'boolean_value', 'row'], name='cell_sort_boolean'),
+        ),
+        migrations.AddIndex(
+            model_name='cell',
+            index=models.Index(fields=['column', 'date_value', 'row'], name='cell_sort_date'),
+        ),
+        migrations.AddIndex(
+            model_name='cell',
+            index=models.Index(models.F('column'), django.db.models.functions.text.Substr('text_value', 1, 100), models.F('row'), name='cell_sort_text'),
+        ),
+    ]
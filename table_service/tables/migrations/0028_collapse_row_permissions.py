@@ -0,0 +1,47 @@
+from django.db import migrations
+
+# Права администрации и сотрудников филиала на строку становятся одной записью
+# RowFilialPermission, личные RowPermission с теми же правами удаляются. Личное право
+# автора строки остаётся: оно действует и после его перехода в другой филиал.
+COLLAPSE_SQL = """
+INSERT INTO tables_rowfilialpermission (row_id, filial_id, can_edit, can_delete)
+SELECT DISTINCT rp.row_id, e.id_filial, TRUE, TRUE
+FROM tables_rowpermission rp
+JOIN tables_profile p ON p.user_id = rp.user_id
+JOIN tables_employee e ON e.id = p.employee_id
+JOIN tables_filial f ON f.id = e.id_filial
+WHERE e.id_filial = 1910 AND rp.can_edit AND rp.can_delete
+ON CONFLICT (row_id, filial_id) DO NOTHING;
+
+DELETE FROM tables_rowpermission rp
+USING tables_row r, tables_profile p, tables_employee e, tables_rowfilialpermission fp
+WHERE r.id = rp.row_id
+  AND rp.user_id IS DISTINCT FROM r.created_by_id
+  AND p.user_id = rp.user_id
+  AND e.id = p.employee_id
+  AND fp.row_id = rp.row_id
+  AND fp.filial_id = e.id_filial
+  AND fp.can_edit = rp.can_edit
+  AND fp.can_delete = rp.can_delete;
+"""
+
+# Обратно: права филиала снова раздаются каждому сотруднику
+EXPAND_SQL = """
+INSERT INTO tables_rowpermission (row_id, user_id, can_edit, can_delete)
+SELECT fp.row_id, p.user_id, fp.can_edit, fp.can_delete
+FROM tables_rowfilialpermission fp
+JOIN tables_employee e ON e.id_filial = fp.filial_id
+JOIN tables_profile p ON p.employee_id = e.id
+ON CONFLICT (row_id, user_id) DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0027_export_job'),
+    ]
+
+    operations = [
+        migrations.RunSQL(COLLAPSE_SQL, EXPAND_SQL),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 01:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0028_collapse_row_permissions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='table',
+            name='data_changed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-19 01:40
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0029_table_data_changed_at'),
+    ]
+
+    operations = [
+        # Существующие блокировки считаются истёкшими
+        migrations.AddField(
+            model_name='rowlock',
+            name='expires_at',
+            field=models.DateTimeField(default=datetime.datetime.now),
+            preserve_default=False,
+        ),
+    ]
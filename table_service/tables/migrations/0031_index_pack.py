@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-19 01:22
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся без блокировки записи в таблицы прав и сотрудников
+    atomic = False
+
+    dependencies = [
+        ('tables', '0030_rowlock_expires_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='columnpermission',
+            index=models.Index(fields=['user', 'permission_type', 'column'], name='colperm_user_type_column'),
+        ),
+        AddIndexConcurrently(
+            model_name='employee',
+            index=models.Index(fields=['id_filial'], name='employee_id_filial'),
+        ),
+        AddIndexConcurrently(
+            model_name='rowfilialpermission',
+            index=models.Index(fields=['filial', 'row'], include=('can_edit', 'can_delete'), name='rowfilialperm_filial_row'),
+        ),
+        AddIndexConcurrently(
+            model_name='rowpermission',
+            index=models.Index(fields=['user', 'row'], include=('can_edit', 'can_delete'), name='rowperm_user_row'),
+        ),
+        AddIndexConcurrently(
+            model_name='tablefiliallock',
+            index=models.Index(condition=models.Q(('locked_by__isnull', False)), fields=['table', 'filial', 'locked_by'], name='tablefiliallock_locked_by'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.4 on 2026-10-19 02:07
+
+from django.db import migrations, models
+
+# Пользователи с правом просмотра таблицы: лично или через филиал
+VIEWERS_SQL = """
+SELECT tp.table_id, tp.user_id
+FROM tables_tablepermission tp
+WHERE tp.can_view
+UNION
+SELECT fp.table_id, p.user_id
+FROM tables_tablefilialpermission fp
+JOIN tables_employee e ON e.id_filial = fp.filial_id
+JOIN tables_profile p ON p.employee_id = e.id
+WHERE fp.can_view
+"""
+
+# Права колонок становятся исключениями из доступа по умолчанию (VO, для филиала
+# администрации EV). Пользователи без записи раньше не видели колонку: тем, кто может
+# открыть таблицу, записывается явный запрет, затем удаляются записи, совпадающие
+# с умолчанием. Остальные, получив право на таблицу, увидят колонку по умолчанию.
+# Владелец таблицы и администраторы сервиса видят все колонки и не учитываются.
+COLLAPSE_SQL = f"""
+INSERT INTO tables_columnpermission (column_id, user_id, permission_type)
+SELECT c.id, v.user_id, 'NA'
+FROM tables_column c
+JOIN tables_table t ON t.id = c.table_id
+JOIN ({VIEWERS_SQL}) v ON v.table_id = t.id
+WHERE v.user_id <> t.owner_id
+  AND NOT EXISTS (SELECT 1 FROM tables_admin a WHERE a.user_id = v.user_id)
+ON CONFLICT (column_id, user_id) DO NOTHING;
+
+DELETE FROM tables_columnpermission cp
+USING tables_column c
+WHERE c.id = cp.column_id
+  AND cp.permission_type = CASE
+      WHEN EXISTS (
+          SELECT 1 FROM tables_profile p JOIN tables_employee e ON e.id = p.employee_id
+          WHERE p.user_id = cp.user_id AND e.id_filial = 1910
+      ) THEN 'EV'
+      ELSE c.default_permission_type
+  END;
+"""
+
+# Обратно: доступ по умолчанию снова записывается каждому пользователю без исключения
+EXPAND_SQL = """
+INSERT INTO tables_columnpermission (column_id, user_id, permission_type)
+SELECT c.id, u.id, CASE
+    WHEN EXISTS (
+        SELECT 1 FROM tables_profile p JOIN tables_employee e ON e.id = p.employee_id
+        WHERE p.user_id = u.id AND e.id_filial = 1910
+    ) THEN 'EV'
+    ELSE c.default_permission_type
+END
+FROM tables_column c
+CROSS JOIN auth_user u
+ON CONFLICT (column_id, user_id) DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0031_index_pack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='column',
+            name='default_permission_type',
+            field=models.CharField(choices=[('EV', 'Редактировать + Просмотр'), ('VO', 'Только просмотр'), ('NA', 'Нет доступа')], default='VO', help_text='Для пользователей без личного исключения; филиал администрации по умолчанию редактирует колонку', max_length=2, verbose_name='Доступ по умолчанию'),
+        ),
+        migrations.RunSQL(COLLAPSE_SQL, EXPAND_SQL),
+    ]
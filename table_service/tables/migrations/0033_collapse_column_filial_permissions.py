@@ -0,0 +1,58 @@
+from django.db import migrations
+
+# Уровень доступа пользователя без личной записи до этой миграции: доступ колонки по умолчанию,
+# для филиала администрации - EV (Column.ADMINISTRATION_PERMISSION)
+DEFAULT_SQL = "CASE WHEN e.id_filial = 1910 THEN 'EV' ELSE c.default_permission_type END"
+
+# Право филиала на колонку теперь действует на его сотрудников при чтении. Сотрудники,
+# которые могут открыть таблицу, без личной записи и с правом филиала, отличным от
+# прежнего умолчания, получают его явно (как в 0032); затем удаляются копии права
+# филиала в личных записях.
+COLLAPSE_SQL = f"""
+INSERT INTO tables_columnpermission (column_id, user_id, permission_type)
+SELECT fp.column_id, p.user_id, {DEFAULT_SQL}
+FROM tables_columnfilialpermission fp
+JOIN tables_column c ON c.id = fp.column_id
+JOIN tables_table t ON t.id = c.table_id
+JOIN tables_employee e ON e.id_filial = fp.filial_id
+JOIN tables_profile p ON p.employee_id = e.id
+WHERE fp.permission_type <> {DEFAULT_SQL}
+  AND (
+      EXISTS (SELECT 1 FROM tables_tablepermission tp
+              WHERE tp.table_id = t.id AND tp.user_id = p.user_id AND tp.can_view)
+      OR EXISTS (SELECT 1 FROM tables_tablefilialpermission tfp
+                 WHERE tfp.table_id = t.id AND tfp.filial_id = e.id_filial AND tfp.can_view)
+  )
+  AND p.user_id <> t.owner_id
+  AND NOT EXISTS (SELECT 1 FROM tables_admin a WHERE a.user_id = p.user_id)
+ON CONFLICT (column_id, user_id) DO NOTHING;
+
+DELETE FROM tables_columnpermission cp
+USING tables_profile p, tables_employee e, tables_columnfilialpermission fp
+WHERE p.user_id = cp.user_id
+  AND e.id = p.employee_id
+  AND fp.column_id = cp.column_id
+  AND fp.filial_id = e.id_filial
+  AND fp.permission_type = cp.permission_type;
+"""
+
+# Обратно: право филиала снова записывается каждому сотруднику без личной записи
+EXPAND_SQL = """
+INSERT INTO tables_columnpermission (column_id, user_id, permission_type)
+SELECT fp.column_id, p.user_id, fp.permission_type
+FROM tables_columnfilialpermission fp
+JOIN tables_employee e ON e.id_filial = fp.filial_id
+JOIN tables_profile p ON p.employee_id = e.id
+ON CONFLICT (column_id, user_id) DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0032_column_default_permission'),
+    ]
+
+    operations = [
+        migrations.RunSQL(COLLAPSE_SQL, EXPAND_SQL),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-19 02:35
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся без блокировки записи в справочник сотрудников
+    atomic = False
+
+    dependencies = [
+        ('tables', '0033_collapse_column_filial_permissions'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='employee',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('firstname'), name='gin_trgm_ops'), name='employee_firstname_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='employee',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('secondname'), name='gin_trgm_ops'), name='employee_secondname_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='employee',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('lastname'), name='gin_trgm_ops'), name='employee_lastname_trgm'),
+        ),
+    ]
@@ -1,13 +1,31 @@
 import datetime
+import functools
+import io
+import os
 
-from django.db import models
+from django.conf import settings
+from django.db import connection, models, transaction
 from django.contrib.auth.models import User
-from django.db.models.functions import Concat
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Coalesce, Substr, Upper
 from django.urls import reverse
 from django.utils.crypto import get_random_string
-from django.db.models import IntegerField, FloatField, BooleanField, DateField, F, TextField, Value
+from django.utils.functional import cached_property
+from django.db.models import Exists, F, OuterRef, TextField, Value
 from datetime import date
 
+from .events import on_commit_once, publish_rows
+from .metrics import PERMISSION_ROWS
+
+# Филиал администрации: получает права на строки всех филиалов
+ADMINISTRATION_FILIAL_ID = 1910
+
+# Сколько первых символов текста участвует в сортировке (и в индексе cell_sort_text)
+TEXT_SORT_PREFIX = 100
+
 
 class Filial(models.Model):
     id = models.IntegerField(primary_key=True)
@@ -34,6 +52,16 @@ class Employee(models.Model):
     set_date = models.DateField(null=True, blank=True)
     end_date = models.DateField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Сотрудники филиала: выдача прав филиалу, поиск по филиалу автора
+            models.Index(fields=['id_filial'], name='employee_id_filial'),
+            # Поиск строк по ФИО автора (icontains)
+            GinIndex(OpClass(Upper('firstname'), name='gin_trgm_ops'), name='employee_firstname_trgm'),
+            GinIndex(OpClass(Upper('secondname'), name='gin_trgm_ops'), name='employee_secondname_trgm'),
+            GinIndex(OpClass(Upper('lastname'), name='gin_trgm_ops'), name='employee_lastname_trgm'),
+        ]
+
     def __str__(self):
         return f"{self.secondname} {self.firstname} {self.lastname}"
 
@@ -67,6 +95,10 @@ class Table(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField()
     share_token = models.CharField(max_length=32, unique=True, blank=True)
+    # Растёт при каждом изменении строк, ячеек или колонок таблицы
+    data_version = models.PositiveBigIntegerField(default=0)
+    # Время последнего увеличения data_version (для Last-Modified)
+    data_changed_at = models.DateTimeField(null=True, blank=True)
 
     def save(self, *args, **kwargs):
         if not self.share_token:
@@ -82,6 +114,23 @@ class Table(models.Model):
     def get_url_for_users(self):
         return f'/shared/{self.share_token}'
 
+    @cached_property
+    def column_types(self):
+        """Типы данных колонок таблицы: {column_id: data_type}"""
+        return dict(self.columns.values_list('id', 'data_type'))
+
+    @classmethod
+    def touch(cls, table_id):
+        """Увеличивает версию данных таблицы после фиксации транзакции (один раз на транзакцию)"""
+        on_commit_once(('data_version', table_id), functools.partial(cls.bump_data_version, table_id))
+
+    @classmethod
+    def bump_data_version(cls, table_id):
+        cls.objects.filter(pk=table_id).update(
+            data_version=F('data_version') + 1,
+            data_changed_at=datetime.datetime.now()
+        )
+
     def is_admin(self, user):
         """Проверяет, является ли пользователь админом таблицы"""
         return Admin.objects.filter(user=user).exists()
@@ -137,6 +186,14 @@ class Column(models.Model):
         BOOLEAN = 'boolean', 'Логическое'
         DATE = 'date', 'Дата'
 
+    class PermissionType(models.TextChoices):
+        EDIT_VIEW = 'EV', 'Редактировать + Просмотр'
+        VIEW_ONLY = 'VO', 'Только просмотр'
+        NO_ACCESS = 'NA', 'Нет доступа'
+
+    # Доступ филиала администрации к колонке, если для сотрудника нет личного исключения
+    ADMINISTRATION_PERMISSION = PermissionType.EDIT_VIEW
+
     table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='columns')
     name = models.CharField(max_length=100)
     order = models.PositiveIntegerField(default=0)
@@ -150,29 +207,67 @@ class Column(models.Model):
         choices=ColumnType.choices,
         default=ColumnType.TEXT
     )
+    default_permission_type = models.CharField(
+        max_length=2,
+        choices=PermissionType.choices,
+        default=PermissionType.VIEW_ONLY,
+        verbose_name='Доступ по умолчанию',
+        help_text='Для пользователей без личного исключения; филиал администрации по умолчанию редактирует колонку'
+    )
 
     class Meta:
         ordering = ['order']
 
     @classmethod
-    def get_visible_columns(cls, user, table):
+    def with_permission_type(cls, user, table, permissions=None):
+        """Колонки таблицы с уровнем доступа пользователя в permission_type
+
+        Порядок: личное исключение ColumnPermission, право филиала пользователя
+        ColumnFilialPermission, доступ колонки по умолчанию. Права филиала
+        присоединяются по Employee.id_filial и не копируются его сотрудникам,
+        поэтому изменение права филиала - запись одной строки.
+        """
+        permissions = permissions or PermissionContext(user, table)
+        if permissions.filial_id == ADMINISTRATION_FILIAL_ID:
+            default = Value(cls.ADMINISTRATION_PERMISSION)
+        else:
+            default = F('default_permission_type')
+        relations = {
+            'user_permission': models.FilteredRelation('permissions', condition=models.Q(permissions__user=user)),
+        }
+        levels = ['user_permission__permission_type']
+        if permissions.filial_id:
+            relations['filial_permission'] = models.FilteredRelation(
+                'filial_permissions', condition=models.Q(filial_permissions__filial_id=permissions.filial_id))
+            levels.append('filial_permission__permission_type')
+        return table.columns.annotate(**relations).annotate(permission_type=Coalesce(*levels, default))
+
+    def fallback_permission_type(self, filial_id, filial_permissions):
+        """Доступ сотрудника филиала filial_id без личного исключения
+
+        filial_permissions - права филиалов на эту колонку: {filial_id: уровень доступа}.
+        """
+        if filial_id in filial_permissions:
+            return filial_permissions[filial_id]
+        if filial_id == ADMINISTRATION_FILIAL_ID:
+            return self.ADMINISTRATION_PERMISSION
+        return self.default_permission_type
+
+    @classmethod
+    def get_visible_columns(cls, user, table, permissions=None):
         """Возвращает колонки, которые пользователь может видеть"""
-        if table.owner == user:
+        permissions = permissions or PermissionContext(user, table)
+        if permissions.has_full_access:
             return table.columns.all()
-        if table.is_admin(user):
-            return table.columns.all()
-        result = models.Q(permissions__user=user, permissions__permission_type__in=['EV', 'VO'])
-        return table.columns.filter(result).distinct()
+        return cls.with_permission_type(user, table, permissions).filter(permission_type__in=['EV', 'VO'])
 
     @classmethod
-    def get_editable_columns(cls, user, table):
+    def get_editable_columns(cls, user, table, permissions=None):
         """Возвращает колонки, которые пользователь может редактировать"""
-        if table.owner == user:
-            return table.columns.all()
-        if table.is_admin(user):
+        permissions = permissions or PermissionContext(user, table)
+        if permissions.has_full_access:
             return table.columns.all()
-        result = models.Q(permissions__user=user, permissions__permission_type='EV')
-        return table.columns.filter(result).distinct()
+        return cls.with_permission_type(user, table, permissions).filter(permission_type='EV')
 
     def __str__(self):
         return f"{self.table.title} - {self.name}"
@@ -194,6 +289,10 @@ class ColumnPermission(models.Model):
 
     class Meta:
         unique_together = ('column', 'user')
+        indexes = [
+            # Видимые и редактируемые колонки пользователя (get_visible_columns, get_editable_columns)
+            models.Index(fields=['user', 'permission_type', 'column'], name='colperm_user_type_column'),
+        ]
 
 
 class ColumnFilialPermission(models.Model):
@@ -214,6 +313,35 @@ class ColumnFilialPermission(models.Model):
         unique_together = ('column', 'filial')
 
 
+class JSONBConcat(models.Func):
+    """Слияние jsonb-документов: data || patch"""
+    arg_joiner = ' || '
+    template = '(%(expressions)s)'
+    output_field = models.JSONField()
+
+
+class JSONBDeleteKey(models.Func):
+    """Удаление ключа из jsonb-документа: data - 'key'"""
+    arg_joiner = ' - '
+    template = '(%(expressions)s)'
+    output_field = models.JSONField()
+
+
+class DocumentValue(KeyTextTransform):
+    """Значение колонки из документа строки как текст: data ->> 'column_id'
+
+    Стандартный KeyTransform превращает числовой ключ в индекс массива,
+    поэтому id колонки всегда передаётся строкой.
+    """
+
+    def __init__(self, column_id, document='data', **kwargs):
+        super().__init__(str(column_id), document, **kwargs)
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = compiler.compile(self.lhs)
+        return '(%s %s %%s)' % (lhs, self.postgres_operator), tuple(params) + (self.key_name,)
+
+
 class Row(models.Model):
     table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='rows')
     order = models.PositiveIntegerField(default=0)
@@ -224,25 +352,36 @@ class Row(models.Model):
         blank=True,
         related_name='created_rows'
     )
+    # Денормализованный документ строки {column_id: value} для чтения грида.
+    # Источник истины - Cell, документ обновляется в той же транзакции
+    data = models.JSONField(default=dict, blank=True)
+    # Поисковый документ строки: текстовые значения документа и их tsvector
+    search_text = models.TextField(default='', blank=True)
+    search_vector = SearchVectorField(null=True, blank=True)
+
+    # Текстовые значения документа строки, склеенные через пробел
+    SEARCH_TEXT_SQL = (
+        "COALESCE((SELECT string_agg(document.value, ' ') "
+        "FROM jsonb_each_text(tables_row.data) AS document "
+        "JOIN tables_column ON tables_column.id = document.key::bigint "
+        "WHERE tables_column.data_type = 'text'), '')"
+    )
 
     class Meta:
         ordering = ['order']
+        indexes = [
+            GinIndex(OpClass(Upper('search_text'), name='gin_trgm_ops'), name='row_search_text_trgm'),
+            GinIndex(fields=['search_vector'], name='row_search_vector'),
+            GinIndex(fields=['data'], opclasses=['jsonb_path_ops'], name='row_data_path_ops'),
+        ]
 
     def has_edit_permission(self, user):
         """Проверяет, может ли пользователь редактировать строку"""
-        if self.table.owner == user:
-            return True
-        if self.table.is_admin(user):
-            return True
-        return self.permissions.filter(user=user, can_edit=True).exists()
+        return PermissionContext(user, self.table).can_edit_row(self)
 
     def has_delete_permission(self, user):
         """Проверяет, может ли пользователь удалять строку"""
-        if self.table.owner == user:
-            return True
-        if self.table.is_admin(user):
-            return True
-        return self.permissions.filter(user=user, can_delete=True).exists()
+        return PermissionContext(user, self.table).can_delete_row(self)
 
     def has_manage_permission(self, user):
         """Проверяет, может ли пользователь управлять правами на строку"""
@@ -253,113 +392,235 @@ class Row(models.Model):
         return False
 
     @classmethod
-    def get_visible_rows(cls, user, table):
+    def get_visible_rows(cls, user, table, permissions=None):
         """Возвращает строки, которые пользователь может видеть"""
-        if table.owner == user:
-            return table.rows.all()
-        if table.is_admin(user):
+        permissions = permissions or PermissionContext(user, table)
+        if permissions.has_full_access:
             return table.rows.all()
-        result = models.Q(permissions__user=user)
+        # Личное право или право филиала пользователя, без размножения строк join'ом
+        result = Exists(RowPermission.objects.filter(row=OuterRef('pk'), user=user))
+        if permissions.filial_id:
+            result |= Exists(RowFilialPermission.objects.filter(row=OuterRef('pk'), filial_id=permissions.filial_id))
 
-        return table.rows.filter(result).distinct()
+        return table.rows.filter(result)
+
+    @classmethod
+    def grant_creator_permissions(cls, rows, user, filial_id):
+        """Выдаёт права на новые строки автору, его филиалу и администрации, возвращает число записанных прав
+
+        Права сотрудников вычисляются при чтении через RowFilialPermission, поэтому
+        число запросов не зависит ни от числа строк, ни от числа пользователей в филиале.
+        """
+        filial_ids = {filial_id, ADMINISTRATION_FILIAL_ID} if filial_id else set()
+        existing = set(Filial.objects.filter(pk__in=filial_ids).values_list('pk', flat=True))
+        written = len(RowFilialPermission.objects.bulk_create([
+            RowFilialPermission(row=row, filial_id=existing_id, can_edit=True, can_delete=True)
+            for row in rows
+            for existing_id in existing
+        ]))
+        # Личное право автора сохраняет доступ к его строкам и после перехода в другой филиал
+        written += len(RowPermission.objects.bulk_create([
+            RowPermission(row=row, user=user, can_edit=True, can_delete=True)
+            for row in rows
+        ]))
+        return written
+
+    @classmethod
+    def bulk_insert(cls, table, user, filial_id, rows_values, batch_size=1000):
+        """Добавляет строки с ячейками и правами пачками, возвращает созданные строки
+
+        rows_values - список словарей {column: значение}. Число запросов зависит
+        от числа пачек, а не от числа строк и колонок.
+        """
+        with transaction.atomic():
+            # Блокировка таблицы: параллельные вставки не получат одинаковый order
+            list(Table.objects.select_for_update().filter(pk=table.pk).values_list('pk'))
+            start = table.rows.count()
+
+            created = []
+            permission_rows = 0
+            for offset in range(0, len(rows_values), batch_size):
+                rows = []
+                cells = []
+                for order, values in enumerate(rows_values[offset:offset + batch_size], start=start + offset):
+                    row_cells = [Cell(column=column, value=value) for column, value in values.items()]
+                    row = cls(
+                        table=table,
+                        order=order,
+                        created_by=user,
+                        data={str(cell.column_id): cell.document_value for cell in row_cells}
+                    )
+                    for cell in row_cells:
+                        cell.row = row
+                    rows.append(row)
+                    cells.extend(row_cells)
+
+                cls.objects.bulk_create(rows)
+                # row_id ячеек берётся из строк, получивших pk при вставке
+                for cell in cells:
+                    cell.row_id = cell.row.pk
+                Cell.copy_create(cells)
+                cls.refresh_search(cls.objects.filter(pk__in=[row.pk for row in rows]))
+                permission_rows += cls.grant_creator_permissions(rows, user, filial_id)
+                created.extend(rows)
+
+            # bulk_create не отправляет сигналы, версия данных и событие - явно
+            Table.touch(table.pk)
+            publish_rows(table.pk, 'insert', [row.pk for row in created])
+        PERMISSION_ROWS.observe(permission_rows, operation='add_row')
+        return created
 
     @property
     def user_values(self):
         if not hasattr(self, '_user_values_cache'):
-            # Получаем пользователя через создателя строки (если он есть)
-            user = None
-            if self.created_by and hasattr(self.created_by, 'profile') and self.created_by.profile.employee:
-                user = self.created_by.profile.employee
+            Row.resolve_creators([self])
+        return self._user_values_cache
 
-            self._user_values_cache = {
+    @property
+    def filial_values(self):
+        if not hasattr(self, '_filial_values_cache'):
+            Row.resolve_creators([self])
+        return self._filial_values_cache
+
+    @classmethod
+    def resolve_creators(cls, rows):
+        """Подгружает авторов строк и их филиалы для всего набора строк (два запроса)"""
+        rows = [row for row in rows if not hasattr(row, '_user_values_cache')]
+        if not rows:
+            return
+
+        # Получаем сотрудников через создателей строк (если они есть)
+        user_ids = {row.created_by_id for row in rows if row.created_by_id}
+        users = User.objects.filter(pk__in=user_ids).select_related('profile__employee')
+        employees = {}
+        for user in users:
+            if hasattr(user, 'profile') and user.profile.employee:
+                employees[user.pk] = user.profile.employee
+
+        filial_ids = {employee.id_filial for employee in employees.values() if employee.id_filial}
+        filials = Filial.objects.in_bulk(filial_ids) if filial_ids else {}
+
+        for row in rows:
+            user = employees.get(row.created_by_id)
+            filial = filials.get(user.id_filial) if user else None
+
+            row._user_values_cache = {
                 'id': user.id if user else None,
                 'firstname': user.firstname if user else '',
                 'secondname': user.secondname if user else '',
                 'lastname': user.lastname if user else '',
                 'full_name': f'{user.secondname} {user.firstname} {user.lastname}' if user else ''
             }
-        return self._user_values_cache
-
-    @property
-    def filial_values(self):
-        if not hasattr(self, '_filial_values_cache'):
-            # Получаем филиал через создателя строки (если он есть)
-            filial = None
-            if self.created_by and hasattr(self.created_by, 'profile') and self.created_by.profile.employee:
-                filial_id = self.created_by.profile.employee.id_filial
-                filial = Filial.objects.get(id=filial_id)
-
-            self._filial_values_cache = {
+            row._filial_values_cache = {
                 'id': filial.id if filial else None,
                 'name': filial.name if filial else '',
             }
-        return self._filial_values_cache
 
     @property
     def cell_values(self):
         if not hasattr(self, '_cell_values_cache'):
-            cells = self.cells.select_related('column').all()
+            column_types = self.table.column_types
             self._cell_values_cache = {
-                cell.column_id: cell.value
-                for cell in cells
+                int(column_id): Cell.from_document(value, column_types.get(int(column_id)))
+                for column_id, value in self.data.items()
             }
         return self._cell_values_cache
 
+    def update_data(self, values):
+        """Дописывает значения {column_id: value} в документ строки одним UPDATE"""
+        patch = {str(column_id): value for column_id, value in values.items()}
+        Row.objects.filter(pk=self.pk).update(
+            data=JSONBConcat(F('data'), Cast(Value(patch, output_field=models.JSONField()), models.JSONField()))
+        )
+        Row.refresh_search(Row.objects.filter(pk=self.pk))
+        self.data.update(patch)
+        if hasattr(self, '_cell_values_cache'):
+            del self._cell_values_cache
+
+    def save_cells(self, values):
+        """Сохраняет значения {column: value}, записывая только изменившиеся ячейки
+
+        Текущие ячейки читаются одним запросом, изменённые пишутся одним
+        INSERT ... ON CONFLICT (row_id, column_id) DO UPDATE. Возвращает число записанных ячеек.
+        """
+        current = {cell.column_id: cell for cell in self.cells.filter(column__in=list(values))}
+        changed = []
+        for column, value in values.items():
+            cell = Cell(row=self, column=column, value=value)
+            existing = current.get(column.id)
+            if existing is None or existing.typed_values != cell.typed_values:
+                changed.append(cell)
+        if not changed:
+            return 0
+
+        with transaction.atomic():
+            Cell.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=['row', 'column'],
+                update_fields=Cell.VALUE_FIELDS,
+            )
+            # Документ строки обновляется в той же транзакции, что и ячейки
+            self.update_data({cell.column_id: cell.document_value for cell in changed})
+            # bulk_create не отправляет сигналы, версия данных и событие - явно
+            Table.touch(self.table_id)
+            publish_rows(self.table_id, 'update', [self.pk])
+        return len(changed)
+
+    @classmethod
+    def remove_column_data(cls, column):
+        """Удаляет значения колонки из документов всех строк таблицы"""
+        rows = cls.objects.filter(table_id=column.table_id)
+        rows.update(data=JSONBDeleteKey(F('data'), Cast(Value(str(column.id)), TextField())))
+        cls.refresh_search(rows)
+
+    @classmethod
+    def refresh_search(cls, queryset):
+        """Пересчитывает поисковый документ строк по их JSON-документу"""
+        search_text = RawSQL(cls.SEARCH_TEXT_SQL, ())
+        queryset.update(
+            search_text=search_text,
+            search_vector=SearchVector(search_text, config='simple')
+        )
+
+    @classmethod
+    def rebuild_data(cls, queryset, batch_size=1000):
+        """Пересобирает документы строк по ячейкам, возвращает число обработанных строк"""
+        row_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(row_ids), batch_size):
+            batch = row_ids[start:start + batch_size]
+            documents = {row_id: {} for row_id in batch}
+            for cell in Cell.objects.filter(row_id__in=batch).select_related('column'):
+                documents[cell.row_id][str(cell.column_id)] = cell.document_value
+
+            with transaction.atomic():
+                cls.objects.bulk_update(
+                    [cls(pk=row_id, data=document) for row_id, document in documents.items()],
+                    ['data']
+                )
+                cls.refresh_search(cls.objects.filter(pk__in=batch))
+        return len(row_ids)
+
     @classmethod
     def annotate_for_sorting(cls, queryset, column_id, data_type):
-        """Добавляет аннотации для сортировки по типу данных"""
-        # Создаем подзапрос для каждого типа данных
+        """Добавляет аннотацию для сортировки по типу данных колонки"""
+        # Ячейка колонки присоединяется один раз (LEFT JOIN по индексу
+        # (column, typed_value, row)) вместо коррелированного подзапроса
+        sort_cell = f'sort_cell_{column_id}'
+        queryset = queryset.annotate(**{
+            sort_cell: models.FilteredRelation('cells', condition=models.Q(cells__column_id=column_id))
+        })
         if data_type == Column.ColumnType.INTEGER:
-            subquery = Cell.objects.filter(
-                row=models.OuterRef('pk'),
-                column_id=column_id
-            ).values('integer_value')[:1]
-            return queryset.annotate(
-                **{f'sort_value_{column_id}': models.Subquery(subquery, output_field=IntegerField())}
-            )
+            sort_value = F(f'{sort_cell}__integer_value')
         elif data_type == Column.ColumnType.FLOAT:
-            subquery = Cell.objects.filter(
-                row=models.OuterRef('pk'),
-                column_id=column_id
-            ).values('float_value')[:1]
-            return queryset.annotate(
-                **{f'sort_value_{column_id}': models.Subquery(subquery, output_field=FloatField())}
-            )
+            sort_value = F(f'{sort_cell}__float_value')
         elif data_type == Column.ColumnType.BOOLEAN:
-            subquery = Cell.objects.filter(
-                row=models.OuterRef('pk'),
-                column_id=column_id
-            ).values('boolean_value')[:1]
-            return queryset.annotate(
-                **{f'sort_value_{column_id}': models.Subquery(subquery, output_field=BooleanField())}
-            )
+            sort_value = F(f'{sort_cell}__boolean_value')
         elif data_type == Column.ColumnType.DATE:
-            subquery = Cell.objects.filter(
-                row=models.OuterRef('pk'),
-                column_id=column_id
-            ).values('date_value')[:1]
-            return queryset.annotate(
-                **{f'sort_value_{column_id}': models.Subquery(subquery, output_field=DateField())}
-            )
+            sort_value = F(f'{sort_cell}__date_value')
         else:  # TEXT
-            queryset = queryset.annotate(
-                user_full_name=Concat(
-                    F('created_by__profile__employee__secondname'),
-                    Value(' '),
-                    F('created_by__profile__employee__firstname'),
-                    Value(' '),
-                    F('created_by__profile__employee__lastname'),
-                    output_field=TextField()
-                )
-            )
-
-            subquery = Cell.objects.filter(
-                row=models.OuterRef('pk'),
-                column_id=column_id
-            ).values('text_value')[:1]
-            return queryset.annotate(
-                **{f'sort_value_{column_id}': models.Subquery(subquery, output_field=TextField())}
-            )
+            sort_value = Substr(f'{sort_cell}__text_value', 1, TEXT_SORT_PREFIX)
+        return queryset.annotate(**{f'sort_value_{column_id}': sort_value})
 
 
 class Cell(models.Model):
@@ -372,8 +633,16 @@ class Cell(models.Model):
     boolean_value = models.BooleanField(blank=True, null=True)
     date_value = models.DateField(blank=True, null=True)
 
-    class Meta:
-        unique_together = ('row', 'column')
+    # Форматы дат и записи логических значений, которые принимают поиск и импорт
+    DATE_FORMATS = ['%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%m/%d/%Y']
+    TRUE_VALUES = ['true', 'да', 'yes', 'истина']
+    FALSE_VALUES = ['false', 'нет', 'no', 'ложь']
+
+    # Поля, в которых хранится значение ячейки (заполняется одно, по типу колонки)
+    VALUE_FIELDS = ['text_value', 'integer_value', 'float_value', 'boolean_value', 'date_value']
+
+    # Колонки tables_cell в порядке, в котором их пишет copy_create
+    COPY_FIELDS = ['row_id', 'column_id', 'text_value', 'integer_value', 'float_value', 'boolean_value', 'date_value']
 
     @staticmethod
     def get_default_value(data_type):
@@ -415,13 +684,75 @@ class Cell(models.Model):
         else:  # TEXT
             self.text_value = str(val) if val is not None else ''
 
+    @property
+    def typed_values(self):
+        """Содержимое всех полей значения: по нему сравниваются старая и новая ячейки"""
+        return tuple(getattr(self, field) for field in self.VALUE_FIELDS)
+
+    @property
+    def document_value(self):
+        """Значение ячейки в виде, пригодном для JSON-документа строки"""
+        value = self.value
+        if isinstance(value, date):
+            return value.isoformat()
+        return value
+
+    @staticmethod
+    def from_document(value, data_type):
+        """Восстанавливает значение ячейки из JSON-документа строки"""
+        if data_type == Column.ColumnType.DATE and value:
+            return date.fromisoformat(value)
+        return value
+
+    @classmethod
+    def copy_create(cls, cells):
+        """Вставляет ячейки одной командой COPY вместо INSERT (у строк уже должен быть pk)"""
+        cls.copy_values([getattr(cell, field) for field in cls.COPY_FIELDS] for cell in cells)
+
+    @classmethod
+    def copy_values(cls, values):
+        """Вставляет ячейки командой COPY из наборов значений полей в порядке COPY_FIELDS"""
+        buffer = io.StringIO()
+        for cell_values in values:
+            buffer.write('\t'.join(_copy_value(value) for value in cell_values))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        sql = f'COPY {cls._meta.db_table} ({", ".join(cls.COPY_FIELDS)}) FROM STDIN'
+        with connection.cursor() as cursor:
+            if hasattr(cursor, 'copy_expert'):  # psycopg2
+                cursor.copy_expert(sql, buffer)
+            else:  # psycopg 3
+                with cursor.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
     class Meta:
         unique_together = ('row', 'column')
+        indexes = [
+            # Индексы сортировки: (column_id, typed_value, row_id)
+            models.Index(fields=['column', 'integer_value', 'row'], name='cell_sort_integer'),
+            models.Index(fields=['column', 'float_value', 'row'], name='cell_sort_float'),
+            models.Index(fields=['column', 'boolean_value', 'row'], name='cell_sort_boolean'),
+            models.Index(fields=['column', 'date_value', 'row'], name='cell_sort_date'),
+            models.Index(F('column'), Substr('text_value', 1, TEXT_SORT_PREFIX), F('row'), name='cell_sort_text'),
+        ]
 
     def __str__(self):
         return f"{self.row} - {self.column}: {self.value}"
 
 
+def _copy_value(value):
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, date):
+        return value.isoformat()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
 class TablePermission(models.Model):
     table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='permissions')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -448,6 +779,10 @@ class RowPermission(models.Model):
 
     class Meta:
         unique_together = ('row', 'user')
+        indexes = [
+            # Права пользователя на строки (get_visible_rows, load_rows) читаются только из индекса
+            models.Index(fields=['user', 'row'], include=['can_edit', 'can_delete'], name='rowperm_user_row'),
+        ]
 
 
 class RowFilialPermission(models.Model):
@@ -458,6 +793,10 @@ class RowFilialPermission(models.Model):
 
     class Meta:
         unique_together = ('row', 'filial')
+        indexes = [
+            # Права филиала на строки (get_visible_rows, load_rows) читаются только из индекса
+            models.Index(fields=['filial', 'row'], include=['can_edit', 'can_delete'], name='rowfilialperm_filial_row'),
+        ]
 
 
 class RowLock(models.Model):
@@ -472,6 +811,8 @@ class RowLock(models.Model):
         related_name='row_locks'
     )
     locked_at = models.DateTimeField()
+    # Аренда: после этого времени блокировку может занять другой пользователь
+    expires_at = models.DateTimeField()
 
 
 class TableFilialLock(models.Model):
@@ -482,3 +823,177 @@ class TableFilialLock(models.Model):
 
     class Meta:
         unique_together = ('table', 'filial')
+        indexes = [
+            # Проверка блокировки добавления строк (PermissionContext.can_add_rows)
+            models.Index(fields=['table', 'filial', 'locked_by'], condition=models.Q(locked_by__isnull=False),
+                         name='tablefiliallock_locked_by'),
+        ]
+
+
+class ExportJob(models.Model):
+    """Фоновая выгрузка одной или нескольких таблиц в файл"""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        DONE = 'done', 'Готово'
+        FAILED = 'failed', 'Ошибка'
+
+    tables = models.ManyToManyField(Table, related_name='export_jobs')
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    export_format = models.CharField(max_length=10)
+    # Таблицы, их версии данных и формат: одинаковый ключ - одинаковый файл
+    cache_key = models.CharField(max_length=255, db_index=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    processed_rows = models.PositiveIntegerField(default=0)
+    total_rows = models.PositiveIntegerField(default=0)
+    file_name = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=datetime.datetime.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @staticmethod
+    def cache_key_for(tables, export_format):
+        """Ключ выгрузки по версиям данных таблиц"""
+        versions = ','.join(f'{table.pk}:{table.data_version}' for table in sorted(tables, key=lambda t: t.pk))
+        return f'{versions}/{export_format}'
+
+    @property
+    def file_path(self):
+        return os.path.join(settings.EXPORT_ROOT, self.file_name)
+
+    @property
+    def is_ready(self):
+        return self.status == self.Status.DONE and bool(self.file_name) and os.path.exists(self.file_path)
+
+    @property
+    def progress(self):
+        """Процент выполнения"""
+        if self.status == self.Status.DONE:
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(99, self.processed_rows * 100 // self.total_rows)
+
+    @property
+    def download_name(self):
+        if self.tables.count() == 1:
+            return f'table.{self.export_format}'
+        return f'tables.{self.export_format}'
+
+    def can_access(self, user):
+        """Скачать выгрузку может владелец или администратор каждой из её таблиц"""
+        if Admin.objects.filter(user=user).exists():
+            return True
+        return not self.tables.exclude(owner=user).exists()
+
+
+class PermissionContext:
+    """Права пользователя на таблицу, вычисляемые один раз за запрос
+
+    Статус администратора и владельца загружается один раз, права на строки -
+    одним запросом на страницу (load_rows), а не по запросу на каждую строку.
+    """
+
+    def __init__(self, user, table):
+        self.user = user
+        self.table = table
+        self.is_owner = table.owner_id == user.pk
+        self._row_permissions = {}  # row_id -> (can_edit, can_delete)
+
+    @cached_property
+    def is_admin(self):
+        return self.table.is_admin(self.user)
+
+    @cached_property
+    def filial_id(self):
+        """Филиал пользователя (Profile → Employee.id_filial)"""
+        return Employee.objects.filter(profile__user=self.user).values_list('id_filial', flat=True).first()
+
+    @property
+    def has_full_access(self):
+        """Владелец и администраторы имеют полный доступ к таблице"""
+        return self.is_owner or self.is_admin
+
+    @cached_property
+    def can_view(self):
+        """Проверяет, может ли пользователь видеть таблицу"""
+        if self.has_full_access:
+            return True
+        return self.table.permissions.filter(user=self.user, can_view=True).exists()
+
+    @cached_property
+    def can_add_rows(self):
+        """Не заблокировано ли добавление строк для филиала пользователя (см. Table.has_add_permission)"""
+        if not self.filial_id:
+            return True
+        return not TableFilialLock.objects.filter(
+            table=self.table,
+            filial_id=self.filial_id,
+            locked_by=self.user
+        ).exists()
+
+    def load_rows(self, rows):
+        """Загружает права пользователя на строки страницы одним запросом"""
+        if self.has_full_access:
+            return
+        row_ids = [row.pk for row in rows if row.pk not in self._row_permissions]
+        if not row_ids:
+            return
+
+        self._row_permissions.update({row_id: (False, False) for row_id in row_ids})
+        if self.filial_id:
+            filial_permissions = RowFilialPermission.objects.filter(
+                filial_id=self.filial_id,
+                row_id__in=row_ids
+            ).values_list('row_id', 'can_edit', 'can_delete')
+            for row_id, can_edit, can_delete in filial_permissions:
+                self._row_permissions[row_id] = (can_edit, can_delete)
+
+        # Личные права - исключения, они важнее прав филиала
+        permissions = RowPermission.objects.filter(
+            user=self.user,
+            row_id__in=row_ids
+        ).values_list('row_id', 'can_edit', 'can_delete')
+        for row_id, can_edit, can_delete in permissions:
+            self._row_permissions[row_id] = (can_edit, can_delete)
+
+    @property
+    def editable_row_ids(self):
+        return {row_id for row_id, (can_edit, _) in self._row_permissions.items() if can_edit}
+
+    @property
+    def deletable_row_ids(self):
+        return {row_id for row_id, (_, can_delete) in self._row_permissions.items() if can_delete}
+
+    def can_edit_row(self, row):
+        """Проверяет, может ли пользователь редактировать строку"""
+        if self.has_full_access:
+            return True
+        self.load_rows([row])
+        return self._row_permissions[row.pk][0]
+
+    def can_delete_row(self, row):
+        """Проверяет, может ли пользователь удалять строку"""
+        if self.has_full_access:
+            return True
+        self.load_rows([row])
+        return self._row_permissions[row.pk][1]
+
+    def has_any_row_permission(self, permission):
+        """Есть ли право permission ('can_edit' или 'can_delete') хотя бы на одну строку таблицы"""
+        if self.has_full_access:
+            return True
+        if self.table.rows.filter(permissions__user=self.user, **{f'permissions__{permission}': True}).exists():
+            return True
+        if not self.filial_id:
+            return False
+        # Строки с личным правом уже учтены выше: оно важнее права филиала
+        return self.table.rows.filter(**{
+            'filial_permissions__filial_id': self.filial_id,
+            f'filial_permissions__{permission}': True,
+        }).exclude(permissions__user=self.user).exists()
+
+    def can_manage_row(self, row):
+        """Проверяет, может ли пользователь управлять правами на строку"""
+        return self.has_full_access
@@ -0,0 +1,126 @@
+import heapq
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, которым сотрудник (is_staff) включает профилирование своего запроса вне выборки
+PROFILE_HEADER = 'HTTP_X_SQL_PROFILE'
+
+# Сколько самых медленных запросов попадает в запись
+SLOWEST_COUNT = 5
+
+# Один и тот же SQL, выполненный столько раз за запрос, считается повтором (N+1)
+DUPLICATE_THRESHOLD = 3
+
+# SQL в записи обрезается до этой длины
+SQL_MAX_LENGTH = 500
+
+
+class QueryProfile:
+    """SQL одного HTTP-запроса: число, общее время, самые медленные и повторяющиеся запросы
+
+    Подключается через connection.execute_wrapper и работает без DEBUG. Повторы
+    группируются по тексту SQL до подстановки параметров: Filial.objects.get(id=...)
+    в цикле по строкам даёт одну группу из многих запросов.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []  # куча (время, номер, sql)
+        self.groups = {}  # sql -> [число, время]
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, time.perf_counter() - start)
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        entry = (duration, self.count, sql)
+        if len(self.slowest) < SLOWEST_COUNT:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+        group = self.groups.setdefault(sql, [0, 0.0])
+        group[0] += 1
+        group[1] += duration
+
+    @property
+    def duplicates(self):
+        """Повторяющиеся запросы: [(sql, число, время)], самые частые первыми"""
+        return sorted(
+            ((sql, count, duration) for sql, (count, duration) in self.groups.items()
+             if count >= DUPLICATE_THRESHOLD),
+            key=lambda group: -group[1]
+        )
+
+    def as_dict(self):
+        return {
+            'queries': self.count,
+            'db_ms': round(self.duration * 1000, 2),
+            'slowest': [
+                {'ms': round(duration * 1000, 2), 'sql': sql[:SQL_MAX_LENGTH]}
+                for duration, _, sql in sorted(self.slowest, reverse=True)
+            ],
+            'duplicates': [
+                {'count': count, 'ms': round(duration * 1000, 2), 'sql': sql[:SQL_MAX_LENGTH]}
+                for sql, count, duration in self.duplicates
+            ],
+        }
+
+
+class SQLProfileMiddleware:
+    """Выборочное профилирование SQL по запросам
+
+    Профилируется доля SQL_PROFILE_RATE запросов (0 - выключено) и запросы
+    с заголовком X-SQL-Profile. Каждый профиль пишется строкой JSON в лог
+    tables.profiling; сотрудникам (is_staff) он также отдаётся заголовками ответа.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sampled = random.random() < settings.SQL_PROFILE_RATE
+        if not sampled and PROFILE_HEADER not in request.META:
+            return self.get_response(request)
+
+        profile = QueryProfile()
+        start = time.perf_counter()
+        with connection.execute_wrapper(profile):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        user = getattr(request, 'user', None)
+        is_staff = bool(user and user.is_staff)
+        # Заголовок вне выборки учитывается только от сотрудников, иначе им можно нагрузить лог
+        if not sampled and not is_staff:
+            return response
+
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(elapsed * 1000, 2),
+            **profile.as_dict(),
+        }
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+        if is_staff:
+            response['X-SQL-Queries'] = profile.count
+            response['X-SQL-Time-Ms'] = record['db_ms']
+            response['X-SQL-Duplicates'] = sum(count for _, count, _ in profile.duplicates)
+            response['Server-Timing'] = f'db;dur={record["db_ms"]};desc="{profile.count} queries"'
+        return response
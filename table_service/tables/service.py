@@ -1,28 +1,108 @@
 import datetime
 
-from django.db import transaction
-from .models import RowLock
+from django.db import connection
+from .events import publish
+from .metrics import ROW_LOCKS
+from .models import Table, Row, RowLock
+
+# Срок аренды блокировки строки; форма редактирования продлевает её раз в ROW_LOCK_HEARTBEAT
+ROW_LOCK_LEASE = datetime.timedelta(seconds=90)
+ROW_LOCK_HEARTBEAT = datetime.timedelta(seconds=30)
+
+# Одна инструкция: новая блокировка, повторное открытие своей или захват истёкшей чужой.
+# Если строка занята действующей арендой другого пользователя, ничего не возвращается;
+# иначе возвращается и прежний владелец (previous видит данные до выполнения инструкции).
+ACQUIRE_SQL = f'''
+    WITH previous AS (SELECT user_id FROM {RowLock._meta.db_table} WHERE row_id = %(row)s)
+    INSERT INTO {RowLock._meta.db_table} AS held (row_id, user_id, locked_at, expires_at)
+    VALUES (%(row)s, %(user)s, %(now)s, %(expires)s)
+    ON CONFLICT (row_id) DO UPDATE SET
+        user_id = EXCLUDED.user_id,
+        locked_at = CASE WHEN held.user_id = EXCLUDED.user_id AND held.expires_at > EXCLUDED.locked_at
+                         THEN held.locked_at ELSE EXCLUDED.locked_at END,
+        expires_at = EXCLUDED.expires_at
+    WHERE held.user_id = EXCLUDED.user_id OR held.expires_at <= EXCLUDED.locked_at
+    RETURNING (SELECT user_id FROM previous)
+'''
+
+# Продление меняет только свою аренду: если её успел занять другой пользователь, строка не найдётся
+RENEW_SQL = f'''
+    UPDATE {RowLock._meta.db_table} AS held SET expires_at = %s
+    FROM {Row._meta.db_table} AS locked_row
+    WHERE held.row_id = %s AND held.user_id = %s AND locked_row.id = held.row_id
+    RETURNING locked_row.table_id
+'''
+
+RELEASE_SQL = f'DELETE FROM {RowLock._meta.db_table} WHERE row_id = %s AND user_id = %s'
+
+
+def publish_lock(table_id, row_pk):
+    """Сообщает открытым страницам таблицы, что строка занята
+
+    Событие получают все подписчики таблицы, поэтому в нём только номер строки:
+    кто её занял, страница узнаёт из row_fragment с учётом своих прав (held_lock).
+    """
+    publish(table_id, {'type': 'lock', 'row': row_pk})
+
+
+def held_lock(row, user):
+    """Действующая блокировка строки другим пользователем или None"""
+    return RowLock.objects.filter(row=row, expires_at__gt=datetime.datetime.now()) \
+        .exclude(user=user).select_related('user').first()
+
+
+def table_version(table_id):
+    """Текущая версия данных таблицы"""
+    return Table.objects.filter(pk=table_id).values_list('data_version', flat=True).first()
+
+
+def resync_events(table_id, version):
+    """События для страницы, которая подключилась к потоку таблицы
+
+    Пока страница не была подключена, события до неё не доходили: она получает строки
+    с действующими блокировками и reload, если данные изменились после её версии version.
+    """
+    locked = RowLock.objects.filter(row__table_id=table_id, expires_at__gt=datetime.datetime.now())
+    events = [{'type': 'locks', 'rows': list(locked.values_list('row_id', flat=True))}]
+    if version is not None and version != table_version(table_id):
+        events.append({'type': 'reload'})
+    return events
 
 
 def lock_row(row, user):
-    """Блокирует строку для редактирования"""
-    with transaction.atomic():
-        # Создаем новую блокировку
-        lock, created = RowLock.objects.get_or_create(
-            row=row,
-            defaults={'user': user,
-                      'locked_at': datetime.datetime.now()}
-        )
-        if not created and lock.user != user:
-            return False, lock.user  # Уже заблокировано другим пользователем
+    """Блокирует строку для редактирования арендой на ROW_LOCK_LEASE"""
+    now = datetime.datetime.now()
+    with connection.cursor() as cursor:
+        cursor.execute(ACQUIRE_SQL, {'row': row.pk, 'user': user.pk, 'now': now, 'expires': now + ROW_LOCK_LEASE})
+        acquired = cursor.fetchone()
+    if acquired is not None:
+        previous_user_id = acquired[0]
+        expired = previous_user_id is not None and previous_user_id != user.pk
+        ROW_LOCKS.inc(outcome='expired' if expired else 'acquired')
+        publish_lock(row.table_id, row.pk)
         return True, None
+    # Уже заблокировано другим пользователем
+    ROW_LOCKS.inc(outcome='conflict')
+    lock = RowLock.objects.filter(row=row).select_related('user').first()
+    return False, lock.user if lock else None
+
+
+def renew_row_lock(row_pk, user):
+    """Продлевает аренду блокировки строки, возвращает False, если блокировка потеряна"""
+    with connection.cursor() as cursor:
+        cursor.execute(RENEW_SQL, [datetime.datetime.now() + ROW_LOCK_LEASE, row_pk, user.pk])
+        renewed = cursor.fetchone()
+    if renewed is None:
+        return False
+    publish_lock(renewed[0], row_pk)
+    return True
 
 
 def unlock_row(row, user):
     """Снимает блокировку строки"""
-    try:
-        lock = RowLock.objects.get(row=row, user=user)
-        lock.delete()
-        return True
-    except RowLock.DoesNotExist:
-        return False
+    with connection.cursor() as cursor:
+        cursor.execute(RELEASE_SQL, [row.pk, user.pk])
+        released = cursor.rowcount > 0
+    if released:
+        publish(row.table_id, {'type': 'unlock', 'row': row.pk})
+    return released
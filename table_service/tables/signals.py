@@ -0,0 +1,38 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .events import publish, publish_rows
+from .models import Table, Column, Row, Cell
+
+
+@receiver(post_save, sender=Row)
+@receiver(post_delete, sender=Row)
+@receiver(post_save, sender=Column)
+@receiver(post_delete, sender=Column)
+def touch_table(sender, instance, **kwargs):
+    """Новая версия данных таблицы при изменении строки или колонки"""
+    Table.touch(instance.table_id)
+
+
+@receiver(post_save, sender=Cell)
+def touch_table_by_cell(sender, instance, **kwargs):
+    """Новая версия данных таблицы при изменении ячейки"""
+    Table.touch(instance.row.table_id)
+    publish_rows(instance.row.table_id, 'update', [instance.row_id])
+
+
+@receiver(post_save, sender=Row)
+def publish_row_saved(sender, instance, created, **kwargs):
+    publish_rows(instance.table_id, 'insert' if created else 'update', [instance.pk])
+
+
+@receiver(post_delete, sender=Row)
+def publish_row_deleted(sender, instance, **kwargs):
+    publish_rows(instance.table_id, 'delete', [instance.pk])
+
+
+@receiver(post_save, sender=Column)
+@receiver(post_delete, sender=Column)
+def publish_columns_changed(sender, instance, **kwargs):
+    """Набор колонок изменился: строки открытых страниц перестраиваются целиком"""
+    publish(instance.table_id, {'type': 'reload'})
@@ -44,9 +44,33 @@ document.addEventListener('DOMContentLoaded', function() {
 
             const modal = new bootstrap.Modal(document.getElementById('rowEditModal'));
             let isModalInitialized = false;
+            let heartbeatTimer = null;
+
+            // Продление аренды блокировки, пока форма открыта
+            const renewLock = () => {
+                fetch(`/api/renew_row_lock/${rowId}/`, {
+                    method: 'POST',
+                    headers: {
+                        'X-CSRFToken': getCookie('csrftoken'),
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({})
+                })
+                .then(response => {
+                    if (response.status === 423) {
+                        return response.json().then(data => {
+                            clearInterval(heartbeatTimer);
+                            alert(data.message);
+                            modal.hide();
+                        });
+                    }
+                })
+                .catch(error => console.error('Error:', error));
+            };
 
             // Обработчик закрытия модалки
             const handleModalClose = () => {
+                clearInterval(heartbeatTimer);
                 if (!document.getElementById('rowEditForm')?.dataset.submitted) {
                     fetch(`/api/unlock_row/${rowId}/`, {
                         method: 'POST',
@@ -86,6 +110,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     .then(data => {
                         if (data.status === 'success') {
                             document.getElementById('modalContent').innerHTML = data.html;
+                            heartbeatTimer = setInterval(renewLock, data.heartbeat * 1000);
                         } else {
                             alert('Ошибка загрузки формы');
                             modal.hide();
@@ -0,0 +1,121 @@
+// Обновление открытой таблицы по событиям сервера: блокировки и изменения строк
+document.addEventListener('DOMContentLoaded', function() {
+    const grid = document.getElementById('table-grid');
+    if (!grid || !window.EventSource) return;
+
+    const source = new EventSource(grid.dataset.eventsUrl);
+    const lockTimers = {};
+    const lockedRows = new Set();
+
+    const findRow = rowId => grid.querySelector(`tr[data-row-id="${rowId}"]`);
+    const rowUrl = rowId => grid.dataset.rowUrl.replace(/0\/$/, `${rowId}/`);
+
+    function setLocked(rowId, user) {
+        if (user) {
+            lockedRows.add(String(rowId));
+        } else {
+            lockedRows.delete(String(rowId));
+        }
+        const row = findRow(rowId);
+        if (!row) return;
+        row.classList.toggle('table-warning', Boolean(user));
+        row.title = user ? `Редактирует ${user}` : '';
+        row.querySelectorAll('.edit-row-btn').forEach(btn => btn.classList.toggle('disabled', Boolean(user)));
+    }
+
+    // Занятость строки приходит вместе с её HTML (row_fragment): имя того, кто её
+    // редактирует, получают только те, кому строка видна
+    function applyLock(row) {
+        const rowId = row.dataset.rowId;
+        clearTimeout(lockTimers[rowId]);
+        setLocked(rowId, row.dataset.lockedBy);
+        if (row.dataset.lockedBy) {
+            // Аренда без продления истекает сама, отдельного события об этом нет
+            lockTimers[rowId] = setTimeout(() => setLocked(rowId, null), row.dataset.lockExpiresIn * 1000);
+        }
+    }
+
+    function highlight(row) {
+        row.classList.add('table-info');
+        setTimeout(() => row.classList.remove('table-info'), 2000);
+    }
+
+    // Строка запрашивается заново: сервер отдаёт её с учётом прав пользователя
+    function refreshRow(rowId, isNew, quiet) {
+        fetch(rowUrl(rowId))
+            .then(response => {
+                if (response.status === 404) {
+                    findRow(rowId)?.remove();
+                    return null;
+                }
+                return response.ok ? response.text() : null;
+            })
+            .then(html => {
+                if (!html) return;
+                const template = document.createElement('template');
+                template.innerHTML = html.trim();
+                const newRow = template.content.querySelector('tr');
+                const current = findRow(rowId);
+                if (current) {
+                    current.replaceWith(newRow);
+                } else if (isNew) {
+                    grid.querySelector('tbody').prepend(newRow);
+                } else {
+                    return;
+                }
+                applyLock(newRow);
+                if (!quiet) highlight(newRow);
+            })
+            .catch(error => console.error('Error:', error));
+    }
+
+    function showReloadNotice() {
+        if (document.getElementById('table-reload-notice')) return;
+        const notice = document.createElement('div');
+        notice.id = 'table-reload-notice';
+        notice.className = 'alert alert-info d-flex justify-content-between align-items-center';
+        notice.innerHTML = 'Таблица изменилась. <a href="" class="btn btn-sm btn-primary">Обновить</a>';
+        grid.before(notice);
+    }
+
+    // В событии только номер строки: кто её занял, сообщает сервер вместе со строкой
+    source.addEventListener('lock', function(e) {
+        const data = JSON.parse(e.data);
+        if (findRow(data.row)) refreshRow(data.row, false, true);
+    });
+
+    // После подключения: строки, которые заняты сейчас. События, пропущенные за время
+    // без соединения, восполняются этим списком и событием reload
+    source.addEventListener('locks', function(e) {
+        const rows = JSON.parse(e.data).rows.map(String);
+        lockedRows.forEach(rowId => {
+            if (!rows.includes(rowId)) {
+                clearTimeout(lockTimers[rowId]);
+                setLocked(rowId, null);
+            }
+        });
+        rows.forEach(rowId => {
+            if (findRow(rowId)) refreshRow(rowId, false, true);
+        });
+    });
+
+    source.addEventListener('unlock', function(e) {
+        const data = JSON.parse(e.data);
+        clearTimeout(lockTimers[data.row]);
+        setLocked(data.row, null);
+    });
+
+    source.addEventListener('insert', function(e) {
+        JSON.parse(e.data).rows.forEach(rowId => refreshRow(rowId, true));
+    });
+
+    source.addEventListener('update', function(e) {
+        JSON.parse(e.data).rows.forEach(rowId => refreshRow(rowId, false));
+    });
+
+    source.addEventListener('delete', function(e) {
+        JSON.parse(e.data).rows.forEach(rowId => findRow(rowId)?.remove());
+    });
+
+    source.addEventListener('reload', showReloadNotice);
+});
@@ -1,8 +1,8 @@
 import django_tables2 as tables
-from django.template.backends.utils import csrf_input
 from django.urls import reverse
 from django.utils.html import format_html
-from .models import Row, Column
+from .grid_cache import CSRF_TOKEN_PLACEHOLDER
+from .models import Row, Column, PermissionContext
 
 
 class ExportTable(tables.Table):
@@ -19,13 +19,14 @@ class ExportTable(tables.Table):
         fields = ()  # Будем заполнять динамически
 
     def __init__(self, *args, table_obj=None, request=None, **kwargs):
-        self.base_columns.clear()
+        # Колонки экземпляра передаются в extra_columns: base_columns общий для всех потоков
+        self.dynamic_columns = {}
         self.table_obj = table_obj
         self.request = request
         if table_obj:
             for column in table_obj.columns.all():
                 self._add_column(column)
-            self.base_columns['filial'] = tables.Column(
+            self.dynamic_columns['filial'] = tables.Column(
                 verbose_name='Филиал',
                 accessor=f'filial_values.name',
                 attrs={
@@ -34,7 +35,7 @@ class ExportTable(tables.Table):
                 orderable=False,
             )
 
-            self.base_columns['user'] = tables.Column(
+            self.dynamic_columns['user'] = tables.Column(
                 verbose_name='Пользователь',
                 accessor=f'user_values.full_name',
                 attrs={
@@ -43,7 +44,19 @@ class ExportTable(tables.Table):
                 orderable=False,
             )
 
-        super().__init__(*args, **kwargs)
+        super().__init__(*args, extra_columns=list(self.dynamic_columns.items()), **kwargs)
+
+    def before_render(self, request):
+        # Авторы и филиалы подгружаются пачкой для строк страницы
+        if hasattr(self, 'page'):
+            self.page.object_list = list(self.page.object_list)
+        Row.resolve_creators([row.record for row in self.paginated_rows])
+
+    def as_values(self, exclude_columns=None):
+        # Queryset кэширует строки, поэтому авторы и филиалы подгружаются
+        # один раз для всей выгрузки, а не по запросу на строку
+        Row.resolve_creators([row.record for row in self.rows])
+        return super().as_values(exclude_columns)
 
     def _add_column(self, column):
         col_name = f'col_{column.id}'
@@ -51,35 +64,35 @@ class ExportTable(tables.Table):
 
         # Выбираем соответствующий тип столбца
         if column.data_type == Column.ColumnType.INTEGER:
-            self.base_columns[col_name] = tables.Column(
+            self.dynamic_columns[col_name] = tables.Column(
                 verbose_name=column.name,
                 accessor=accessor,
                 attrs={'td': {'class': 'text-center'}},
                 orderable=False,
             )
         if column.data_type == Column.ColumnType.FLOAT:
-            self.base_columns[col_name] = tables.Column(
+            self.dynamic_columns[col_name] = tables.Column(
                 verbose_name=column.name,
                 accessor=accessor,
                 attrs={'td': {'class': 'text-center'}},
                 orderable=False,
             )
         elif column.data_type == Column.ColumnType.BOOLEAN:
-            self.base_columns[col_name] = tables.BooleanColumn(
+            self.dynamic_columns[col_name] = tables.BooleanColumn(
                 verbose_name=column.name,
                 accessor=accessor,
                 attrs={'td': {'class': 'text-center'}},
                 orderable=False,
             )
         elif column.data_type == Column.ColumnType.DATE:
-            self.base_columns[col_name] = tables.DateColumn(
+            self.dynamic_columns[col_name] = tables.DateColumn(
                 verbose_name=column.name,
                 accessor=accessor,
                 attrs={'td': {'class': 'text-center'}},
                 orderable=False,
             )
         else:  # TEXT по умолчанию
-            self.base_columns[col_name] = tables.Column(
+            self.dynamic_columns[col_name] = tables.Column(
                 verbose_name=column.name,
                 accessor=accessor,
                 attrs={'td': {'class': 'text-center'}},
@@ -100,17 +113,26 @@ class DynamicTable(tables.Table):
                 'class': 'table-light'
             }
         }
+        # По data-row-id страница находит строку при событиях таблицы. Занятость строки
+        # другим пользователем отмечает только row_fragment: HTML таблицы кешируется
+        row_attrs = {
+            'data-row-id': lambda record: record.pk,
+            'data-locked-by': lambda record: getattr(record, 'locked_by', None),
+            'data-lock-expires-in': lambda record: getattr(record, 'lock_expires_in', None),
+        }
         fields = ()  # Будем заполнять динамически
 
-    def __init__(self, *args, table_obj=None, columns=None, request=None, **kwargs):
-        self.base_columns.clear()
+    def __init__(self, *args, table_obj=None, columns=None, request=None, permissions=None, **kwargs):
+        # Колонки экземпляра передаются в extra_columns: base_columns общий для всех потоков
+        self.dynamic_columns = {}
         self.table_obj = table_obj
         self.request = request
         if table_obj:
+            self.permissions = permissions or PermissionContext(request.user, table_obj)
             for column in columns:
                 self._add_column(column)
 
-            self.base_columns['filial'] = tables.Column(
+            self.dynamic_columns['filial'] = tables.Column(
                 verbose_name=self.get_column_header(None, is_filial=True),
                 accessor=f'filial_values.name',
                 attrs={
@@ -119,7 +141,7 @@ class DynamicTable(tables.Table):
                 order_by='filial_name'
             )
 
-            self.base_columns['user'] = tables.Column(
+            self.dynamic_columns['user'] = tables.Column(
                 verbose_name=self.get_column_header(None, is_user=True),
                 accessor=f'user_values.full_name',
                 attrs={
@@ -127,7 +149,7 @@ class DynamicTable(tables.Table):
                 },
                 order_by='user_full_name'
             )
-            self.base_columns['actions'] = tables.Column(
+            self.dynamic_columns['actions'] = tables.Column(
                 empty_values=(),
                 orderable=False,
                 verbose_name='',
@@ -136,7 +158,7 @@ class DynamicTable(tables.Table):
                            'width': '125px'}
                 }
             )
-        super().__init__(*args, **kwargs)
+        super().__init__(*args, extra_columns=list(self.dynamic_columns.items()), **kwargs)
 
     def _add_column(self, column):
         col_name = f'col_{column.id}'
@@ -157,10 +179,23 @@ class DynamicTable(tables.Table):
         }
 
         column_class = column_types.get(column.data_type, tables.Column)
-        self.base_columns[col_name] = column_class(**column_kwargs)
+        self.dynamic_columns[col_name] = column_class(**column_kwargs)
+
+    @property
+    def csrf_input(self):
+        # HTML таблицы кэшируется, поэтому вместо токена - метка, её заменяет render_grid
+        return format_html('<input type="hidden" name="csrfmiddlewaretoken" value="{}">', CSRF_TOKEN_PLACEHOLDER)
+
+    def before_render(self, request):
+        # Строки страницы выбираются один раз, права, авторы и филиалы - пачкой
+        if hasattr(self, 'page'):
+            self.page.object_list = list(self.page.object_list)
+        records = [row.record for row in self.paginated_rows]
+        self.permissions.load_rows(records)
+        Row.resolve_creators(records)
 
     def render_delete(self, record):
-        if (self.table_obj.owner == self.request.user) or (record.has_delete_permission(self.request.user)):
+        if self.permissions.can_delete_row(record):
             delete_url = reverse('delete_row',
                                  kwargs={'table_pk': self.table_obj.pk,
                                          'row_pk': record.id
@@ -173,13 +208,13 @@ class DynamicTable(tables.Table):
                 '×</button>'
                 '</form>',
                 delete_url,
-                csrf_input(self.request)
+                self.csrf_input
             )
         return ''
 
     def render_actions(self, record):
         edit = format_html('')
-        if record.has_edit_permission(self.request.user):
+        if self.permissions.can_edit_row(record):
             edit += format_html(
                 '<a class="btn btn-sm btn-outline-primary edit-row-btn" '
                 'title="Редактировать строку"'
@@ -188,7 +223,7 @@ class DynamicTable(tables.Table):
                 record.id,
                 self.table_obj.pk
             )
-        if record.has_delete_permission(self.request.user):
+        if self.permissions.can_delete_row(record):
             delete_url = reverse('delete_row',
                                  kwargs={'table_pk': self.table_obj.pk,
                                          'row_pk': record.id
@@ -201,10 +236,10 @@ class DynamicTable(tables.Table):
                 '<i class="bi bi-x-lg"></i></button>'
                 '</form>',
                 delete_url,
-                csrf_input(self.request)
+                self.csrf_input
             )
 
-        if record.has_manage_permission(self.request.user):
+        if self.permissions.can_manage_row(record):
             edit += format_html(
                 '<a href="{}" class="btn btn-sm btn-outline-secondary" title="Настроить разрешения">'
                 '<i class="bi bi-people-fill"></i></a>',
@@ -217,7 +252,7 @@ class DynamicTable(tables.Table):
 
     def get_column_header(self, column=None, is_user=False, is_filial=False):
         edit = format_html('')
-        if column and self.table_obj.owner == self.request.user:
+        if column and self.permissions.is_owner:
             delete_url = reverse('delete_column',
                                  kwargs={
                                      'table_pk': self.table_obj.pk,
@@ -247,9 +282,9 @@ class DynamicTable(tables.Table):
                 '</div>',
                 column.name,
                 manage_column,
-                csrf_input(self.request),
+                self.csrf_input,
                 delete_url,
-                csrf_input(self.request)
+                self.csrf_input
             )
         elif column:
             edit += format_html('<div class="d-flex mr-auto p-2">{}</div>', column.name)
@@ -1,3 +1,866 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import os
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from openpyxl import Workbook
+
+from .models import ADMINISTRATION_FILIAL_ID, Table, Column, Row, Filial, Employee, Profile, TablePermission, \
+    TableFilialPermission, ColumnPermission, ColumnFilialPermission, RowPermission, RowFilialPermission, \
+    PermissionContext, RowLock, Cell, Admin
+from . import events
+from .grid_cache import grid_cache_key
+from .importer import IMPORT_BATCH_SIZE, REPORT_HEADER, iter_xlsx_rows_in_process
+from .metrics import PERMISSION_ROWS, ROW_LOCKS, render as render_metrics
+from .profiling import QueryProfile
+from .service import lock_row, resync_events, table_version
+from .views import filter_func
+
+
+class SeededTablesTestCase(TestCase):
+    """Набор данных: несколько таблиц со строками, владелец, сотрудники филиалов и администрация"""
+    ROWS = 300
+    COLUMNS = 5
+    EMPLOYEES = 50  # сотрудников в каждом из EXTRA_FILIALS филиалов
+    EXTRA_FILIALS = 1
+    FILIAL_ID = 100
+    OTHER_FILIAL_ID = 200
+
+    COLUMN_TYPES = [Column.ColumnType.TEXT, Column.ColumnType.INTEGER, Column.ColumnType.FLOAT,
+                    Column.ColumnType.BOOLEAN, Column.ColumnType.DATE]
+
+    @classmethod
+    def create_users(cls, usernames, filial_id):
+        """Пользователи с профилем и сотрудником филиала, тремя запросами на всех"""
+        password = make_password('password')
+        users = User.objects.bulk_create([User(username=username, password=password) for username in usernames])
+        employees = Employee.objects.bulk_create([
+            Employee(id=user.pk, id_filial=filial_id, tabnumber=user.pk,
+                     firstname=user.username, secondname=user.username, lastname=user.username)
+            for user in users
+        ])
+        Profile.objects.bulk_create([
+            Profile(user=user, employee=employee) for user, employee in zip(users, employees)
+        ])
+        return users
+
+    @classmethod
+    def create_user(cls, username, filial_id):
+        return cls.create_users([username], filial_id)[0]
+
+    @classmethod
+    def create_table(cls, title, rows):
+        table = Table.objects.create(title=title, owner=cls.owner, created_at=datetime.datetime.now())
+        columns = Column.objects.bulk_create([
+            Column(table=table, name=f'Колонка {order}', data_type=cls.COLUMN_TYPES[order % 5], order=order)
+            for order in range(cls.COLUMNS)
+        ])
+        samples = {
+            Column.ColumnType.TEXT: lambda index: f'Текст {index}',
+            Column.ColumnType.INTEGER: lambda index: index,
+            Column.ColumnType.FLOAT: lambda index: index / 4,
+            Column.ColumnType.BOOLEAN: lambda index: index % 2 == 0,
+            Column.ColumnType.DATE: lambda index: datetime.date(2025, 1, 1) + datetime.timedelta(days=index % 365),
+        }
+        values = [
+            {column: samples[column.data_type](index) for column in columns}
+            for index in range(rows)
+        ]
+        # Половину строк добавляет сотрудник филиала пользователя, половину - другого филиала
+        half = rows // 2
+        Row.bulk_insert(table, cls.author, cls.FILIAL_ID, values[:half])
+        Row.bulk_insert(table, cls.other_author, cls.OTHER_FILIAL_ID, values[half:])
+        return table, columns
+
+    @classmethod
+    def setUpTestData(cls):
+        for filial_id in (ADMINISTRATION_FILIAL_ID, cls.FILIAL_ID, cls.OTHER_FILIAL_ID):
+            Filial.objects.create(id=filial_id, name=f'Филиал {filial_id}')
+        cls.owner = cls.create_user('owner', ADMINISTRATION_FILIAL_ID)
+        cls.author = cls.create_user('author', cls.FILIAL_ID)
+        cls.other_author = cls.create_user('other_author', cls.OTHER_FILIAL_ID)
+        cls.member = cls.create_user('member', cls.FILIAL_ID)
+        employees = cls.create_users([f'employee_{index}' for index in range(cls.EMPLOYEES)], cls.OTHER_FILIAL_ID)
+        for filial_index in range(1, cls.EXTRA_FILIALS):
+            filial = Filial.objects.create(id=cls.OTHER_FILIAL_ID + filial_index, name=f'Филиал {filial_index}')
+            cls.create_users([f'employee_{filial.pk}_{index}' for index in range(cls.EMPLOYEES)], filial.pk)
+
+        for index in range(3):
+            cls.create_table(f'Другая таблица {index}', cls.ROWS)
+        cls.table, cls.columns = cls.create_table('Таблица', cls.ROWS)
+
+        # Права другого филиала на колонки, личные права его сотрудников на колонки и строки всех таблиц
+        ColumnFilialPermission.objects.bulk_create([
+            ColumnFilialPermission(column=column, filial_id=cls.OTHER_FILIAL_ID, permission_type='VO')
+            for column in Column.objects.all()
+        ])
+        ColumnPermission.objects.bulk_create([
+            ColumnPermission(column=column, user=employee, permission_type='VO')
+            for column in Column.objects.all()
+            for employee in employees
+        ])
+        RowPermission.objects.bulk_create([
+            RowPermission(row=row, user=employee, can_edit=False, can_delete=False)
+            for row in Row.objects.all()[::10]
+            for employee in employees
+        ])
+
+        TablePermission.objects.create(table=cls.table, user=cls.member, can_view=True)
+        ColumnPermission.objects.bulk_create([
+            ColumnPermission(column=column, user=cls.member, permission_type=['EV', 'EV', 'VO', 'VO', 'NA'][index % 5])
+            for index, column in enumerate(cls.columns)
+        ])
+        # Личные исключения на несколько строк чужого филиала
+        other_rows = cls.table.rows.filter(created_by=cls.other_author)[:10]
+        RowPermission.objects.bulk_create([
+            RowPermission(row=row, user=cls.member, can_edit=True, can_delete=False) for row in other_rows
+        ])
+        cls.member_row = cls.table.rows.filter(created_by=cls.author).first()
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client.force_login(self.member)
+
+
+class ExplainTests(SeededTablesTestCase):
+    """Запросы представлений и проверок прав выполняются по индексам
+
+    Планировщику запрещено последовательное сканирование (enable_seqscan = off):
+    если подходящего индекса нет, в плане остаётся Seq Scan или полный обход
+    какого-нибудь индекса без условия, и тест падает.
+    """
+
+    # Большие таблицы; маленькие справочники планировщик вправе читать целиком
+    LARGE_TABLES = {
+        'tables_row', 'tables_cell', 'tables_rowpermission', 'tables_rowfilialpermission',
+        'tables_columnpermission', 'tables_columnfilialpermission', 'tables_employee', 'tables_tablefiliallock',
+    }
+
+    def seq_scans(self, sql, params=None):
+        """Большие таблицы, которые план запроса читает целиком: Seq Scan или обход индекса без условия"""
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0][0]['Plan']
+            cursor.execute('SET LOCAL enable_seqscan = on')
+
+        scans = []
+        nodes = [plan]
+        while nodes:
+            node = nodes.pop()
+            full_scan = node['Node Type'] == 'Seq Scan' or (
+                node['Node Type'] in ('Index Scan', 'Index Only Scan') and 'Index Cond' not in node)
+            if full_scan and node['Relation Name'] in self.LARGE_TABLES:
+                scans.append(node['Relation Name'])
+            nodes.extend(node.get('Plans', []))
+        return scans
+
+    def assertNoSeqScan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        self.assertEqual(self.seq_scans(sql, params), [], sql)
+
+    def assertViewNoSeqScan(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in context.captured_queries:
+            if query['sql'].startswith('SELECT'):
+                self.assertEqual(self.seq_scans(query['sql']), [], query['sql'])
+
+    def test_visible_rows(self):
+        permissions = PermissionContext(self.member, self.table)
+        self.assertNoSeqScan(Row.get_visible_rows(self.member, self.table, permissions))
+
+    def test_visible_and_editable_columns(self):
+        permissions = PermissionContext(self.member, self.table)
+        self.assertNoSeqScan(Column.get_visible_columns(self.member, self.table, permissions))
+        self.assertNoSeqScan(Column.get_editable_columns(self.member, self.table, permissions))
+
+    def test_filial_employees(self):
+        self.assertNoSeqScan(User.objects.filter(profile__employee__id_filial=self.FILIAL_ID))
+
+    def test_shared_table_view(self):
+        self.assertViewNoSeqScan(reverse('shared_table_view', args=[self.table.share_token]))
+
+    def test_shared_table_view_sorted(self):
+        self.assertViewNoSeqScan(
+            reverse('shared_table_view', args=[self.table.share_token]) + f'?sort=-col_{self.columns[1].pk}'
+        )
+
+    def test_table_detail(self):
+        self.client.force_login(self.owner)
+        self.assertViewNoSeqScan(reverse('table_detail', args=[self.table.pk]))
+
+    def test_search(self):
+        # Число ищется в тексте, целых и дробных значениях и среди авторов филиала 200, имя - среди авторов
+        columns = self.table.columns.all()
+        for query in ('2', 'author'):
+            request = RequestFactory().get(reverse('table_detail', args=[self.table.pk]), {'q': query})
+            queryset, _ = filter_func(self.table.rows.all(), PermissionContext(self.owner, self.table), columns, request)
+            self.assertNoSeqScan(queryset)
+
+    def test_edit_row_form(self):
+        self.assertViewNoSeqScan(reverse('edit_row', args=[self.table.pk, self.member_row.pk]))
+
+    def test_add_row_form(self):
+        self.assertViewNoSeqScan(reverse('add_row', args=[self.table.pk]))
+
+
+class ColumnPermissionTests(SeededTablesTestCase):
+    """Доступ к колонкам: личное исключение, право филиала, значение колонки по умолчанию"""
+    ROWS = 10
+    EMPLOYEES = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.administration = cls.create_user('administration', ADMINISTRATION_FILIAL_ID)
+
+    def column_names(self, user, method):
+        permissions = PermissionContext(user, self.table)
+        return set(method(user, self.table, permissions).values_list('name', flat=True))
+
+    def test_overrides(self):
+        # Личные права участника: EV, EV, VO, VO, NA
+        self.assertEqual(self.column_names(self.member, Column.get_visible_columns),
+                         {column.name for column in self.columns[:4]})
+        self.assertEqual(self.column_names(self.member, Column.get_editable_columns),
+                         {column.name for column in self.columns[:2]})
+
+    def test_add_column_writes_no_permissions(self):
+        self.client.force_login(self.owner)
+        permissions = ColumnPermission.objects.count()
+        response = self.client.post(reverse('add_column', args=[self.table.pk]), {
+            'name': 'Новая колонка', 'data_type': Column.ColumnType.TEXT, 'default_permission_type': 'VO',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(ColumnPermission.objects.count(), permissions)
+
+        self.assertIn('Новая колонка', self.column_names(self.author, Column.get_visible_columns))
+        self.assertNotIn('Новая колонка', self.column_names(self.author, Column.get_editable_columns))
+        self.assertIn('Новая колонка', self.column_names(self.administration, Column.get_editable_columns))
+
+    def test_default_no_access(self):
+        column = self.columns[0]
+        Column.objects.filter(pk=column.pk).update(default_permission_type='NA')
+        self.assertNotIn(column.name, self.column_names(self.author, Column.get_visible_columns))
+        self.assertIn(column.name, self.column_names(self.administration, Column.get_editable_columns))
+        # Личное исключение важнее значения по умолчанию
+        self.assertIn(column.name, self.column_names(self.member, Column.get_editable_columns))
+
+    def test_only_owner_changes_permissions(self):
+        url = reverse('manage_column_permissions', args=[self.table.pk, self.columns[0].pk])
+        response = self.client.post(url, {'update_default': '', 'default_permission_type': 'EV'})
+        self.assertEqual(response.status_code, 403)
+        self.columns[0].refresh_from_db()
+        self.assertEqual(self.columns[0].default_permission_type, 'VO')
+
+    def test_reset_user_override(self):
+        self.client.force_login(self.owner)
+        column = self.columns[4]
+        url = reverse('manage_column_permissions', args=[self.table.pk, column.pk])
+        # Страница показывает, какой доступ останется после сброса запрета участника
+        self.assertContains(self.client.get(url), 'После сброса: Только просмотр')
+        self.client.post(url, {'reset_user': '', 'user_id': self.member.pk})
+        self.assertFalse(ColumnPermission.objects.filter(column=column, user=self.member).exists())
+        self.assertIn(column.name, self.column_names(self.member, Column.get_visible_columns))
+
+    def test_search_skips_hidden_columns(self):
+        def found(user):
+            permissions = PermissionContext(user, self.table)
+            columns = Column.get_visible_columns(user, self.table, permissions)
+            request = RequestFactory().get(reverse('shared_table_view', args=[self.table.share_token]), {'q': 'Текст 3'})
+            rows, _ = filter_func(self.table.rows.all(), permissions, columns, request)
+            return rows.exists()
+
+        self.assertTrue(found(self.member))
+        # Текст из колонки без доступа не находится, хотя он есть в документе строки
+        ColumnPermission.objects.filter(column=self.columns[0], user=self.member).update(permission_type='NA')
+        self.assertFalse(found(self.member))
+        self.assertTrue(found(self.owner))
+
+    def test_filial_grant(self):
+        self.client.force_login(self.owner)
+        column = self.columns[4]
+        url = reverse('manage_column_permissions', args=[self.table.pk, column.pk])
+        permissions = ColumnPermission.objects.count()
+
+        self.client.post(url, {'add_filial': '', 'filial': self.FILIAL_ID, 'permission_type': 'EV'})
+        self.assertTrue(ColumnFilialPermission.objects.filter(column=column, filial_id=self.FILIAL_ID).exists())
+        self.assertEqual(ColumnPermission.objects.count(), permissions)
+        # Право филиала важнее значения по умолчанию, личное исключение (NA участника) - важнее права филиала
+        self.assertIn(column.name, self.column_names(self.author, Column.get_editable_columns))
+        self.assertNotIn(column.name, self.column_names(self.member, Column.get_visible_columns))
+        self.assertNotIn(column.name, self.column_names(self.other_author, Column.get_editable_columns))
+
+        self.client.post(url, {'reset_filial': '', 'filial_id': self.FILIAL_ID})
+        self.assertNotIn(column.name, self.column_names(self.author, Column.get_editable_columns))
+        self.assertIn(column.name, self.column_names(self.author, Column.get_visible_columns))
+        self.assertEqual(ColumnPermission.objects.count(), permissions)
+
+
+class RowPermissionTests(SeededTablesTestCase):
+    """Доступ к строкам: право филиала автора и личное право автора"""
+    ROWS = 10
+    EMPLOYEES = 5
+
+    def test_author_keeps_rows_after_filial_change(self):
+        rows = self.table.rows.filter(created_by=self.author)
+        Employee.objects.filter(profile__user=self.author).update(id_filial=self.OTHER_FILIAL_ID)
+
+        permissions = PermissionContext(self.author, self.table)
+        visible = Row.get_visible_rows(self.author, self.table, permissions)
+        self.assertEqual(set(visible.filter(created_by=self.author)), set(rows))
+        self.assertTrue(all(permissions.can_edit_row(row) for row in rows))
+        # Бывшие коллеги по филиалу сохраняют доступ через право филиала
+        self.assertTrue(Row.get_visible_rows(self.member, self.table).filter(pk=self.member_row.pk).exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class QueryBudgetTests(SeededTablesTestCase):
+    """Число запросов представлений не зависит от числа строк, колонок, пользователей и филиалов
+
+    Кэш страниц отключён: бюджет считается для худшего случая. Время выполнения
+    каждого представления сохраняется как базовая линия в JSON-файл из переменной
+    окружения PERF_BASELINE, чтобы сравнивать его между изменениями.
+    """
+    ROWS = 1000
+    COLUMNS = 30
+    EMPLOYEES = 250
+    EXTRA_FILIALS = 8
+
+    timings = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        employees = list(User.objects.filter(username__startswith='employee_'))
+        filials = list(Filial.objects.exclude(id=ADMINISTRATION_FILIAL_ID))
+
+        # Страницы управления правами перечисляют выданные права целиком
+        TablePermission.objects.bulk_create([
+            TablePermission(table=cls.table, user=employee, can_view=True) for employee in employees
+        ])
+        TableFilialPermission.objects.bulk_create([
+            TableFilialPermission(table=cls.table, filial=filial, can_view=True) for filial in filials
+        ])
+        ColumnFilialPermission.objects.bulk_create([
+            ColumnFilialPermission(column=column, filial=filial, permission_type='VO')
+            for column in cls.columns
+            for filial in filials
+        ], ignore_conflicts=True)
+        RowPermission.objects.bulk_create([
+            RowPermission(row=cls.member_row, user=employee, can_edit=True, can_delete=False)
+            for employee in employees
+        ], ignore_conflicts=True)
+        RowFilialPermission.objects.bulk_create([
+            RowFilialPermission(row=cls.member_row, filial=filial, can_edit=True, can_delete=False)
+            for filial in filials
+        ], ignore_conflicts=True)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    @classmethod
+    def tearDownClass(cls):
+        path = os.environ.get('PERF_BASELINE')
+        if path:
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump({name: round(seconds * 1000, 1) for name, seconds in sorted(cls.timings.items())},
+                          file, indent=2)
+        super().tearDownClass()
+
+    def assertBudget(self, name, budget, method, url, data=None):
+        """Запрос к представлению выполняет ровно budget SQL-запросов; время записывается в timings"""
+        start = time.perf_counter()
+        with self.assertNumQueries(budget):
+            response = getattr(self.client, method)(url, data)
+        self.timings[name] = time.perf_counter() - start
+        self.assertLess(response.status_code, 400, name)
+        return response
+
+    def row_data(self, columns):
+        samples = {
+            Column.ColumnType.TEXT: 'Новый текст',
+            Column.ColumnType.INTEGER: '42',
+            Column.ColumnType.FLOAT: '4.2',
+            Column.ColumnType.BOOLEAN: 'on',
+            Column.ColumnType.DATE: '2025-06-01',
+        }
+        return {f'col_{column.pk}': samples[column.data_type] for column in columns}
+
+    def editable_columns(self):
+        permissions = PermissionContext(self.member, self.table)
+        return list(Column.get_editable_columns(self.member, self.table, permissions))
+
+    def test_table_detail(self):
+        self.client.force_login(self.owner)
+        url = reverse('table_detail', args=[self.table.pk])
+        self.assertBudget('table_detail', 12, 'get', url)
+        self.assertBudget('table_detail_sorted', 12, 'get', url, {'sort': f'-col_{self.columns[1].pk}', 'page': 3})
+
+    def test_shared_table_view(self):
+        url = reverse('shared_table_view', args=[self.table.share_token])
+        self.assertBudget('shared_table_view', 15, 'get', url)
+        self.assertBudget('shared_table_view_sorted', 15, 'get', url, {'sort': f'col_{self.columns[0].pk}'})
+
+    def test_add_row(self):
+        url = reverse('add_row', args=[self.table.pk])
+        self.assertBudget('add_row_form', 8, 'get', url)
+        self.assertBudget('add_row', 18, 'post', url, self.row_data(self.editable_columns()))
+
+    def test_edit_row(self):
+        url = reverse('edit_row', args=[self.table.pk, self.member_row.pk])
+        self.assertBudget('edit_row_form', 10, 'get', url)
+        self.assertBudget('edit_row', 17, 'post', url, self.row_data(self.editable_columns()))
+
+    def test_export_table(self):
+        self.client.force_login(self.owner)
+        url = reverse('export_table', args=[self.table.pk])
+        self.assertBudget('export_table', 9, 'get', url)
+
+    def test_manage_column_permissions(self):
+        self.client.force_login(self.owner)
+        url = reverse('manage_column_permissions', args=[self.table.pk, self.columns[0].pk])
+        self.assertBudget('manage_column_permissions', 8, 'get', url)
+
+    def test_manage_row_permissions(self):
+        self.client.force_login(self.owner)
+        url = reverse('manage_row_permissions', args=[self.table.pk, self.member_row.pk])
+        self.assertBudget('manage_row_permissions', 11, 'get', url)
+
+    def test_manage_table_permissions(self):
+        self.client.force_login(self.owner)
+        url = reverse('manage_table_permissions', args=[self.table.pk])
+        self.assertBudget('manage_table_permissions', 8, 'get', url)
+
+    def test_revoke_and_unlock_filial(self):
+        self.assertBudget('revoke_redact_rows', 19, 'post',
+                          reverse('revoke_redact_rows', args=[self.table.share_token]))
+
+        self.client.force_login(self.owner)
+        url = reverse('unlock_filial_table', args=[self.table.pk])
+        self.assertBudget('unlock_filial_table_form', 5, 'get', url)
+        self.assertBudget('unlock_filial_table', 11, 'post', url, {
+            'lock_filial': self.FILIAL_ID,
+            f'filial_can_edit_{self.FILIAL_ID}': 'on',
+        })
+
+
+class SQLProfileTests(TestCase):
+    """Профилирование SQL: повторы, заголовки для сотрудников и строка лога"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', password='password', is_staff=True)
+        cls.user = User.objects.create_user('user', password='password')
+        Filial.objects.bulk_create([Filial(id=index, name=f'Филиал {index}') for index in range(5)])
+
+    def test_duplicates(self):
+        profile = QueryProfile()
+        with connection.execute_wrapper(profile):
+            for index in range(5):
+                Filial.objects.get(pk=index)
+            Filial.objects.count()
+        self.assertEqual(profile.count, 6)
+        self.assertEqual([(count, sql.startswith('SELECT')) for sql, count, _ in profile.duplicates], [(5, True)])
+
+    def test_staff_headers_and_log(self):
+        self.client.force_login(self.staff)
+        with self.assertLogs('tables.profiling') as logs:
+            response = self.client.get(reverse('table_list'), HTTP_X_SQL_PROFILE='1')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'table_list')
+        self.assertEqual(int(response['X-SQL-Queries']), record['queries'])
+        self.assertIn('Server-Timing', response)
+
+    def test_header_ignored_for_regular_users(self):
+        self.client.force_login(self.user)
+        with self.assertNoLogs('tables.profiling'):
+            response = self.client.get(reverse('table_list'), HTTP_X_SQL_PROFILE='1')
+        self.assertNotIn('X-SQL-Queries', response)
+
+
+class MetricsTests(TestCase):
+    """Метрики Prometheus: исходы блокировки строк и доступ к /metrics/"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', password='password', is_staff=True)
+        cls.first = User.objects.create_user('first', password='password')
+        cls.second = User.objects.create_user('second', password='password')
+        table = Table.objects.create(title='Таблица', owner=cls.staff, created_at=datetime.datetime.now())
+        cls.row = Row.objects.create(table=table, created_by=cls.first)
+
+    def lock_outcome(self, user):
+        before = dict(ROW_LOCKS._values)
+        lock_row(self.row, user)
+        return [key[0] for key, value in ROW_LOCKS._values.items() if before.get(key, 0) != value]
+
+    def test_lock_outcomes(self):
+        self.assertEqual(self.lock_outcome(self.first), ['acquired'])
+        self.assertEqual(self.lock_outcome(self.first), ['acquired'])
+        self.assertEqual(self.lock_outcome(self.second), ['conflict'])
+        RowLock.objects.update(expires_at=datetime.datetime.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(self.lock_outcome(self.second), ['expired'])
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_access(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE table_service_row_lock_total counter', response.content.decode())
+
+        self.client.force_login(self.first)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(self.staff)
+        self.client.get(reverse('metrics'))
+        # Запрос учитывается после ответа: виден в следующем
+        content = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('table_service_view_duration_seconds_bucket{view="metrics",method="GET",le="+Inf"}', content)
+
+    def test_add_column_permission_rows(self):
+        def observed():
+            counts, total = PERMISSION_ROWS._values.get(('add_column',), ([0], 0))
+            return sum(counts), total
+
+        count, total = observed()
+        self.client.force_login(self.staff)
+        self.client.post(reverse('add_column', args=[self.row.table_id]), {
+            'name': 'Колонка', 'data_type': Column.ColumnType.TEXT, 'default_permission_type': 'VO',
+        })
+        # Колонка добавляется без записей прав: наблюдение с нулём
+        self.assertEqual(observed(), (count + 1, total))
+
+    def test_other_processes(self):
+        # Значения другого процесса gunicorn складываются со значениями этого
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            with open(os.path.join(directory, '1.json'), 'w') as file:
+                json.dump({
+                    ROW_LOCKS.name: [[['conflict'], 5]],
+                    PERMISSION_ROWS.name: [[['test'], [[0, 1, 0, 0, 0, 0, 0, 0, 0, 0], 1]]],
+                }, file)
+            own = ROW_LOCKS._values.get(('conflict',), 0)
+            PERMISSION_ROWS.observe(1, operation='test')
+            content = render_metrics()
+            self.assertTrue(os.path.exists(os.path.join(directory, f'{os.getpid()}.json')))
+        self.assertIn(f'table_service_row_lock_total{{outcome="conflict"}} {own + 5}', content)
+        self.assertIn('table_service_permission_rows_written_count{operation="test"} 2', content)
+
+
+class RowLockEventTests(TestCase):
+    """Событие блокировки не раскрывает пользователя, его показывает row_fragment"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='password')
+        cls.editor = User.objects.create_user('editor', password='password')
+        cls.table = Table.objects.create(title='Таблица', owner=cls.owner, created_at=datetime.datetime.now())
+        cls.row = Row.objects.create(table=cls.table, created_by=cls.owner)
+
+    def locked_by(self, user):
+        self.client.force_login(user)
+        response = self.client.get(reverse('row_fragment', args=[self.table.pk, self.row.pk]))
+        self.assertEqual(response.status_code, 200)
+        return 'data-locked-by="editor"' in response.content.decode()
+
+    def test_lock_event_and_fragment(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            lock_row(self.row, self.editor)
+        self.assertEqual([callback.args[1] for callback in callbacks], [{'type': 'lock', 'row': self.row.pk}])
+        self.assertTrue(self.locked_by(self.owner))
+
+        RowLock.objects.update(expires_at=datetime.datetime.now() - datetime.timedelta(seconds=1))
+        self.assertFalse(self.locked_by(self.owner))
+
+    def test_resync(self):
+        lock_row(self.row, self.editor)
+        version = table_version(self.table.pk)
+        self.assertEqual(resync_events(self.table.pk, version), [{'type': 'locks', 'rows': [self.row.pk]}])
+        self.assertEqual(resync_events(self.table.pk, version - 1)[1:], [{'type': 'reload'}])
+
+
+class EventStreamTests(SimpleTestCase):
+    """Поток событий под WSGI: восполнение пропущенного, ограниченное время жизни и версия в id"""
+
+    @mock.patch.object(events, 'EVENTS_CLOSE_GRACE', 0)
+    @mock.patch.object(events, 'EVENTS_WSGI_LIFETIME', 0.2)
+    def test_wsgi_stream(self):
+        stream = events.event_stream(1, lambda: [{'type': 'locks', 'rows': [5]}], lambda: 7)
+        chunks = [next(stream), next(stream)]
+        events.get_broker().publish(1, {'type': 'update', 'rows': [3]})
+        chunks += [chunk for chunk in stream if chunk != events.format_event(None)]
+        self.assertEqual(chunks, [
+            f'retry: {events.EVENTS_WSGI_RETRY * 1000}\n\n',
+            'event: locks\ndata: {"type": "locks", "rows": [5]}\n\n',
+            'event: update\ndata: {"type": "update", "rows": [3]}\n\n',
+            'id: 7\n\n',
+        ])
+
+
+class DataVersionTests(TestCase):
+    """Версия данных таблицы растёт один раз на зафиксированную транзакцию"""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('owner', password='password')
+        cls.first = Table.objects.create(title='Первая', owner=owner, created_at=datetime.datetime.now())
+        cls.second = Table.objects.create(title='Вторая', owner=owner, created_at=datetime.datetime.now())
+
+    def versions(self):
+        return [table.data_version for table in Table.objects.order_by('pk')]
+
+    def test_touch_once_per_transaction(self):
+        before = self.versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            Table.touch(self.first.pk)
+            Table.touch(self.first.pk)
+            with transaction.atomic():
+                Table.touch(self.first.pk)
+            # Увеличение из отменённой точки сохранения отбрасывается и планируется заново
+            try:
+                with transaction.atomic():
+                    Table.touch(self.second.pk)
+                    raise ValueError
+            except ValueError:
+                pass
+            Table.touch(self.second.pk)
+        self.assertEqual(self.versions(), [before[0] + 1, before[1] + 1])
+
+
+class RowEventTests(TestCase):
+    """События по строкам одного типа объединяются в одно на транзакцию"""
+
+    def test_merged_per_transaction(self):
+        with events.get_broker().listen(1) as queue:
+            with self.captureOnCommitCallbacks(execute=True):
+                events.publish_rows(1, 'update', [1, 2])
+                events.publish_rows(1, 'update', [2, 3])
+                events.publish_rows(1, 'delete', [4])
+            received = [queue.get_nowait() for _ in range(queue.qsize())]
+        self.assertEqual(received, [{'type': 'update', 'rows': [1, 2, 3]}, {'type': 'delete', 'rows': [4]}])
+
+
+class BulkAddRowsTests(TestCase):
+    """Пакетное добавление строк (add_rows_api): ошибки по строкам, всё или ничего"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='password')
+        cls.table = Table.objects.create(title='Таблица', owner=cls.owner, created_at=datetime.datetime.now())
+        cls.num = Column.objects.create(table=cls.table, name='num', data_type=Column.ColumnType.INTEGER, order=0)
+        cls.name = Column.objects.create(table=cls.table, name='name', data_type=Column.ColumnType.TEXT, order=1)
+
+    def post(self, rows):
+        self.client.force_login(self.owner)
+        return self.client.post(reverse('add_rows_api', args=[self.table.pk]), json.dumps({'rows': rows}),
+                                content_type='application/json')
+
+    def test_created(self):
+        # Ключ - название колонки или имя поля формы
+        response = self.post([{'num': 1, 'name': 'Первая'}, {f'col_{self.num.pk}': 2}])
+        self.assertEqual(response.json(), {'status': 'success', 'created': 2})
+        self.assertEqual(list(self.table.rows.order_by('order').values_list('data', flat=True)),
+                         [{str(self.num.pk): 1, str(self.name.pk): 'Первая'}, {str(self.num.pk): 2, str(self.name.pk): ''}])
+
+    def test_row_errors(self):
+        response = self.post([{'num': 'один'}, {'num': 1}, {'unknown': 1}])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual([error['row'] for error in errors], [0, 2])
+        self.assertEqual(list(errors[0]['errors']), [f'col_{self.num.pk}'])
+        self.assertEqual(errors[1]['errors'], {'unknown': ['Неизвестная колонка']})
+        # Одна ошибочная строка отменяет весь запрос
+        self.assertFalse(self.table.rows.exists())
+
+    def test_failed_insert_rolls_back(self):
+        with mock.patch.object(Row, 'grant_creator_permissions', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.post([{'num': index} for index in range(3)])
+        self.assertFalse(self.table.rows.exists())
+        self.assertFalse(Cell.objects.filter(column__table=self.table).exists())
+
+    def test_integer_out_of_range(self):
+        response = self.post([{'num': 1}, {'num': 99999999999}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['row'] for error in response.json()['errors']], [1])
+        self.assertFalse(self.table.rows.exists())
+
+
+class ImportTests(TestCase):
+    """Импорт CSV/XLSX: сопоставление заголовков, пропуск строк с ошибками и отчёт"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='password')
+        cls.table = Table.objects.create(title='Таблица', owner=cls.owner, created_at=datetime.datetime.now())
+        cls.num = Column.objects.create(table=cls.table, name='num', data_type=Column.ColumnType.INTEGER, order=0)
+        cls.day = Column.objects.create(table=cls.table, name='day', data_type=Column.ColumnType.DATE, order=1)
+        cls.name = Column.objects.create(table=cls.table, name='name', data_type=Column.ColumnType.TEXT, order=2,
+                                         is_required=True)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(EXPORT_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(self.owner)
+
+    def xlsx(self, rows):
+        workbook = Workbook()
+        for values in rows:
+            workbook.active.append(values)
+        content = io.BytesIO()
+        workbook.save(content)
+        return content.getvalue()
+
+    def upload(self, name, content):
+        response = self.client.post(reverse('import_table', args=[self.table.pk]),
+                                    {'file': SimpleUploadedFile(name, content)})
+        self.assertEqual(response.status_code, 200)
+        return response.context['result']
+
+    def documents(self):
+        return list(self.table.rows.order_by('order').values_list('data', flat=True))
+
+    def test_header_mapping(self):
+        # Порядок столбцов файла не важен, незнакомые столбцы пропускаются
+        result = self.upload('rows.xlsx', self.xlsx([
+            [' name ', 'Комментарий', 'num', 'day'],
+            ['Первая', 'x', 1, datetime.datetime(2025, 3, 1)],
+            ['Вторая', 'y', '2', '02.03.2025'],
+        ]))
+        self.assertEqual((result.created, result.errors, result.ignored_headers), (2, [], ['Комментарий']))
+        self.assertEqual(self.documents(), [
+            {str(self.num.pk): 1, str(self.day.pk): '2025-03-01', str(self.name.pk): 'Первая'},
+            {str(self.num.pk): 2, str(self.day.pk): '2025-03-02', str(self.name.pk): 'Вторая'},
+        ])
+
+    def test_bad_cells_skipped(self):
+        content = 'num;day;name\n1;01.03.2025;Первая\nодин;;Вторая\n\n3;32.03.2025;\n4;;Четвёртая\n'
+        result = self.upload('rows.csv', content.encode())
+        # Строки с ошибками не добавляются, номера строк - как в файле, с заголовком
+        self.assertEqual(result.created, 2)
+        self.assertEqual([document[str(self.num.pk)] for document in self.documents()], [1, 4])
+        self.assertEqual([error[:3] for error in result.errors], [
+            (3, 'num', 'один'), (5, 'day', '32.03.2025'), (5, 'name', ''),
+        ])
+
+        response = self.client.get(reverse('import_report', args=[self.table.pk, result.report_name]))
+        report = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual(report[0], REPORT_HEADER)
+        self.assertEqual([line[:3] for line in report[1:]], [['3', 'num', 'один'], ['5', 'day', '32.03.2025'],
+                                                              ['5', 'name', '']])
+
+    def test_report_requires_owner(self):
+        result = self.upload('rows.csv', 'num\nодин\n'.encode())
+        self.client.force_login(User.objects.create_user('other', password='password'))
+        response = self.client.get(reverse('import_report', args=[self.table.pk, result.report_name]))
+        self.assertEqual(response.status_code, 403)
+
+    def test_large_xlsx_in_process(self):
+        # Большой файл разбирается в отдельном процессе, результат тот же
+        rows = [['num', 'name']] + [[index, f'Строка {index}'] for index in range(IMPORT_BATCH_SIZE + 5)]
+        with tempfile.NamedTemporaryFile(suffix='.xlsx') as file:
+            file.write(self.xlsx(rows))
+            file.flush()
+            self.assertEqual(sum(1 for _ in iter_xlsx_rows_in_process(file.name)), len(rows))
+        # Ошибка дочернего процесса передаётся в запрос
+        with self.assertRaises(FileNotFoundError):
+            list(iter_xlsx_rows_in_process(file.name))
+
+
+class ConditionalPageTests(TestCase):
+    """Условные GET страниц таблицы: 304 по ETag, новый ETag после изменения данных"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='password')
+        # Без колонок: сигнал колонки запланировал бы Table.touch в незафиксируемой транзакции
+        # setUpTestData, и touch внутри теста объединился бы с ним
+        cls.table = Table.objects.create(title='Таблица', owner=cls.owner, created_at=datetime.datetime.now())
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+        self.url = reverse('table_detail', args=[self.table.pk])
+        # Первый ответ выдаёт CSRF-cookie, без неё ETag не ставится
+        self.assertNotIn('ETag', self.client.get(self.url).headers)
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response.headers['ETag']
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        # Другие параметры запроса - другой ответ
+        self.assertEqual(self.client.get(self.url, {'q': 'x'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_changes_after_touch(self):
+        etag = self.client.get(self.url).headers['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Table.touch(self.table.pk)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn('Last-Modified', response.headers)
+
+
+class GridCacheKeyTests(TestCase):
+    """Ключ кэша HTML таблицы зависит от версии данных и от прав пользователя"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for filial_id in (100, 200):
+            Filial.objects.create(id=filial_id, name=f'Филиал {filial_id}')
+        cls.owner = User.objects.create_user('owner', password='password')
+        cls.first = User.objects.create_user('first', password='password')
+        cls.second = User.objects.create_user('second', password='password')
+        for user in (cls.first, cls.second):
+            employee = Employee.objects.create(id=user.pk, id_filial=100, tabnumber=user.pk,
+                                               firstname=user.username, secondname=user.username,
+                                               lastname=user.username)
+            Profile.objects.create(user=user, employee=employee)
+        cls.table = Table.objects.create(title='Таблица', owner=cls.owner, created_at=datetime.datetime.now())
+
+    def key(self, user, **params):
+        request = RequestFactory().get('/', params)
+        return grid_cache_key(request, self.table, PermissionContext(user, self.table), 'table_detail')
+
+    def test_permission_fingerprint(self):
+        self.assertEqual(self.key(self.first), self.key(self.first))
+        self.assertNotEqual(self.key(self.first), self.key(self.second))
+        self.assertNotEqual(self.key(self.first), self.key(self.owner))
+        self.assertNotEqual(self.key(self.first), self.key(self.first, q='x'))
+
+        # Переход в другой филиал меняет видимые строки и колонки - и ключ
+        before = self.key(self.first)
+        Employee.objects.filter(pk=self.first.pk).update(id_filial=200)
+        self.assertNotEqual(self.key(self.first), before)
+
+        # Права администратора тоже
+        before = self.key(self.second)
+        Admin.objects.create(user=self.second)
+        self.assertNotEqual(self.key(self.second), before)
+
+    def test_data_version(self):
+        before = self.key(self.first)
+        Table.bump_data_version(self.table.pk)
+        self.table.refresh_from_db()
+        self.assertNotEqual(self.key(self.first), before)
@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+from django.views.static import serve
 from django.contrib.auth import views as auth_views
 from . import views
 
@@ -12,6 +14,7 @@ urlpatterns = [
     path('<int:pk>/delete_table', views.delete_table, name='delete_table'),
     path('<int:pk>/add_column/', views.add_column, name='add_column'),
     path('<int:pk>/add_row/', views.add_row, name='add_row'),
+    path('api/<int:pk>/add_rows/', views.add_rows_api, name='add_rows_api'),
     path('<int:table_pk>/delete_column/<int:column_pk>/', views.delete_column, name='delete_column'),
     path('<int:table_pk>/delete_row/<int:row_pk>/', views.delete_row, name='delete_row'),
     path('<int:table_pk>/edit_row/<int:row_pk>/', views.edit_row, name='edit_row'),
@@ -23,6 +26,22 @@ urlpatterns = [
     path('<int:table_pk>/table_permissions/', views.manage_table_permissions, name='manage_table_permissions'),
     path('<int:table_pk>/unlock_filial/', views.unlock_filial_table, name='unlock_filial_table'),
     path('api/unlock_row/<int:row_pk>/', views.unlock_row_api, name='unlock_row_api'),
+    path('api/renew_row_lock/<int:row_pk>/', views.renew_row_lock_api, name='renew_row_lock_api'),
+    path('<int:table_pk>/events/', views.table_events, name='table_events'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('<int:table_pk>/rows/<int:row_pk>/', views.row_fragment, name='row_fragment'),
     path('admins/', views.manage_admins, name='manage_admins'),
     path('<int:table_pk>/export/', views.export_table, name='export_table'),
+    path('<int:table_pk>/import/', views.import_table, name='import_table'),
+    path('<int:table_pk>/import/<slug:report_name>/', views.import_report, name='import_report'),
+    path('export/', views.export_tables, name='export_tables'),
+    path('export/<int:job_pk>/', views.export_job, name='export_job'),
+    path('export/<int:job_pk>/status/', views.export_job_status, name='export_job_status'),
+    path('export/<int:job_pk>/download/', views.download_export, name='download_export'),
 ]
+
+if settings.SERVE_STATIC and not settings.DEBUG:
+    # В режиме отладки статику раздаёт runserver, без него - приложение из STATIC_ROOT (после collectstatic)
+    urlpatterns += [
+        re_path(r'^static/(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT}),
+    ]
@@ -1,35 +1,52 @@
 import datetime
+import functools
+import json
+import os
+import time
+from django.conf import settings
 from django.db import transaction
-from django.db.models import F, Value, TextField, Subquery, OuterRef, Q
-from django.db.models.functions import Concat
+from django.db.models import F, Value, TextField, Subquery, OuterRef, Q, FloatField
+from django.db.models.functions import Cast, Concat
+from django.db.models.lookups import IContains, Range
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchVectorExact
 from django.contrib.auth.models import User
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseForbidden
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponseForbidden, FileResponse, Http404, HttpResponse, \
+    StreamingHttpResponse
 from django.template.loader import render_to_string
+from django.utils.crypto import constant_time_compare
 from django_tables2.export import TableExport
 from .models import Table, Column, Row, Cell, RowPermission, Filial, Employee, RowFilialPermission, TablePermission, \
-    TableFilialPermission, TableFilialLock, Admin, ColumnPermission, ColumnFilialPermission
+    TableFilialPermission, TableFilialLock, Admin, ColumnPermission, ColumnFilialPermission, DocumentValue, \
+    PermissionContext, ExportJob
 from .forms import TableForm, ColumnForm, RowEditForm, AddRowForm, ColumnPermissionUserForm, ColumnPermissionFilialForm, \
-    ColumnPermissionForm, ColumnFilialPermissionForm
-from .service import unlock_row, lock_row
+    ColumnPermissionForm, ColumnFilialPermissionForm, ColumnDefaultPermissionForm, ImportForm
+from .service import unlock_row, lock_row, renew_row_lock, held_lock, resync_events, \
+    table_version, ROW_LOCK_LEASE, ROW_LOCK_HEARTBEAT
 from django.contrib import messages
 from django_tables2 import RequestConfig
 from .tables import DynamicTable, ExportTable
+from .export import BACKGROUND_FORMATS, start_export
+from .importer import import_rows, report_path
+from .grid_cache import render_grid, render_rows, conditional_page
+from .events import event_stream, aevent_stream
+from .metrics import EXPORT_DURATION, EXPORT_BYTES, PERMISSION_ROWS, render as render_metrics
 from django.views.decorators.http import require_POST
 
+# Сколько строк можно добавить одним запросом add_rows_api
+BULK_ADD_ROWS_LIMIT = 20000
+
 
 def save_row_data(row, form, columns):
     """Сохраняет данные строки из формы"""
-    for column in columns:
-        field_name = f'col_{column.id}'
-        value = form.cleaned_data[field_name]
-
-        Cell.objects.update_or_create(
-            row=row,
-            column=column,
-            defaults={'value': value}
-        )
+    # Пишутся только изменившиеся ячейки, одним INSERT ... ON CONFLICT
+    row.save_cells({
+        column: form.cleaned_data[f'col_{column.id}']
+        for column in columns
+    })
 
 
 @login_required
@@ -104,51 +121,10 @@ def add_column(request, pk):
                 column = form.save(commit=False)
                 column.table = table
                 column.order = table.columns.count()
+                # Права пользователей не создаются: действует доступ колонки по умолчанию
+                # (Column.with_permission_type), ColumnPermission - только исключения
                 column.save()
-
-                permissions_to_create = []
-
-                # Все обычные пользователи
-                users = User.objects.exclude(
-                    Q(pk=table.owner.pk) |
-                    Q(admin__isnull=False) |
-                    Q(profile__employee__id_filial=1910)
-                )
-
-                permissions_to_create.extend([
-                    ColumnPermission(
-                        column=column,
-                        user=user,
-                        permission_type=ColumnPermission.PermissionType.VIEW_ONLY
-                    ) for user in users
-                ])
-
-                # Администраторы и филиал администрации
-                admin_users = User.objects.filter(
-                    Q(pk=table.owner.pk) |
-                    Q(admin__isnull=False) |
-                    Q(profile__employee__id_filial=1910)
-                )
-                permissions_to_create.extend([
-                    *[ColumnPermission(
-                        column=column,
-                        user=admin,
-                        permission_type=ColumnPermission.PermissionType.EDIT_VIEW
-                    ) for admin in admin_users]
-                ])
-
-                # Массовое создание всех прав доступа
-                ColumnPermission.objects.bulk_create(
-                    permissions_to_create,
-                    batch_size=1000  # Оптимальный размер партии
-                )
-
-                # Овнер таблицы
-                ColumnPermission.objects.update_or_create(
-                    column=column,
-                    user=table.owner,
-                    permission_type=ColumnPermission.PermissionType.EDIT_VIEW
-                ),
+                PERMISSION_ROWS.observe(0, operation='add_column')
 
                 messages.success(request, f'Колонка "{column.name}" успешно добавлена')
                 return redirect('table_detail', pk=table.pk)
@@ -163,7 +139,10 @@ def manage_column_permissions(request, table_pk, column_pk):
     column = get_object_or_404(Column, pk=column_pk, table=table)
 
     if request.method == 'POST':
-        print(request.POST)
+        # Права на колонку меняют только владелец и администраторы
+        if not (table.owner == request.user or table.is_admin(request.user)):
+            return HttpResponseForbidden("Вы не можете изменять права на эту колонку")
+
         if 'update_user' in request.POST:
             with transaction.atomic():
                 user_id = int(request.POST['update_user'])
@@ -174,12 +153,24 @@ def manage_column_permissions(request, table_pk, column_pk):
                     perm.save()
                 messages.success(request, 'Права пользователей обновлены')
 
-        elif 'remove_user' in request.POST:
+        elif 'update_default' in request.POST:
+            form = ColumnDefaultPermissionForm(request.POST, instance=column)
+            if form.is_valid():
+                form.save()
+                messages.success(request, 'Доступ по умолчанию обновлён')
+
+        elif 'reset_user' in request.POST:
             with transaction.atomic():
                 user_id = request.POST.get('user_id')
                 if user_id:
+                    # Без личного исключения действует право филиала или доступ по умолчанию
                     column.permissions.filter(user_id=user_id).delete()
-                    messages.success(request, 'Права пользователя удалены')
+                    filial_id = Employee.objects.filter(profile__user_id=user_id).values_list(
+                        'id_filial', flat=True).first()
+                    level = column.fallback_permission_type(
+                        filial_id, dict(column.filial_permissions.values_list('filial_id', 'permission_type')))
+                    messages.success(request, f'Личное право сброшено, теперь действует: '
+                                              f'{Column.PermissionType(level).label}')
 
         elif 'add_user' in request.POST:
             with transaction.atomic():
@@ -201,35 +192,19 @@ def manage_column_permissions(request, table_pk, column_pk):
                 if field_name in request.POST:
                     perm.permission_type = request.POST[field_name]
                     perm.save()
-
-                users = User.objects.filter(
-                    profile__employee__id_filial=filial_id
-                )
-                for user in users:
-                    ColumnPermission.objects.update_or_create(
-                        column=column,
-                        user=user,
-                        defaults={'permission_type': perm.permission_type}
-                    )
+                # Сотрудники получают право филиала при чтении (Column.with_permission_type)
+                PERMISSION_ROWS.observe(1, operation='filial_grant')
                 messages.success(request, 'Права филиала обновлены')
 
-        elif 'remove_filial' in request.POST:
+        elif 'reset_filial' in request.POST:
             with transaction.atomic():
                 filial_id = request.POST.get('filial_id')
                 if filial_id:
+                    # Сотрудники без личного исключения получают доступ по умолчанию, исключения сохраняются
                     column.filial_permissions.filter(filial_id=filial_id).delete()
-
-                    users = User.objects.filter(
-                        profile__employee__id_filial=filial_id
-                    )
-
-                    for user in users:
-                        ColumnPermission.objects.filter(
-                            column=column,
-                            user=user,
-                        ).delete()
-
-                    messages.success(request, 'Права филиала удалены')
+                    level = column.fallback_permission_type(int(filial_id), {})
+                    messages.success(request, f'Право филиала сброшено, его сотрудникам без личного права '
+                                              f'теперь действует: {Column.PermissionType(level).label}')
 
         elif 'add_filial' in request.POST:
             with transaction.atomic():
@@ -241,40 +216,42 @@ def manage_column_permissions(request, table_pk, column_pk):
                         filial_id=filial_id,
                         defaults={'permission_type': permission_type}
                     )
-                    users = User.objects.filter(
-                        profile__employee__id_filial=filial_id
-                    )
-                    for user in users:
-                        ColumnPermission.objects.update_or_create(
-                            column=column,
-                            user=user,
-                            defaults={'permission_type': permission_type}
-                        )
+                    PERMISSION_ROWS.observe(1, operation='filial_grant')
 
                     messages.success(request, 'Права филиала добавлены')
 
+        # Права на колонки влияют на страницы таблицы: их кэш устаревает
+        Table.touch(table.pk)
         return redirect('manage_column_permissions', table_pk=table.pk, column_pk=column.pk)
 
     # Получаем текущие права
-    user_permissions = []
-    for perm in column.permissions.all():
-        perm.form = ColumnPermissionForm(initial={
-            'permission_type': perm.permission_type
-        }, prefix=f'user_{perm.user.id}')
-        user_permissions.append(perm)
-
     filial_permissions = []
-    for perm in column.filial_permissions.all():
+    for perm in column.filial_permissions.select_related('filial'):
         perm.form = ColumnFilialPermissionForm(initial={
             'permission_type': perm.permission_type
-        }, prefix=f'filial_{perm.filial.id}')
+        }, prefix=f'filial_{perm.filial_id}')
+        # Уровень, который получат сотрудники филиала без личного исключения после сброса
+        perm.fallback_label = Column.PermissionType(column.fallback_permission_type(perm.filial_id, {})).label
         filial_permissions.append(perm)
+    filial_levels = {perm.filial_id: perm.permission_type for perm in filial_permissions}
+
+    user_permissions = []
+    for perm in column.permissions.select_related('user__profile__employee'):
+        perm.form = ColumnPermissionForm(initial={
+            'permission_type': perm.permission_type
+        }, prefix=f'user_{perm.user_id}')
+        # Уровень, который получит пользователь после сброса личного исключения
+        employee = getattr(getattr(perm.user, 'profile', None), 'employee', None)
+        perm.fallback_label = Column.PermissionType(
+            column.fallback_permission_type(employee.id_filial if employee else None, filial_levels)).label
+        user_permissions.append(perm)
 
     context = {
         'table': table,
         'column': column,
         'permissions': user_permissions,
         'filial_permissions': filial_permissions,
+        'default_form': ColumnDefaultPermissionForm(instance=column),
         'user_form': ColumnPermissionUserForm(table=table),
         'filial_form': ColumnPermissionFilialForm(table=table),
     }
@@ -355,22 +332,7 @@ def manage_row_permissions(request, table_pk, row_pk):
                     filial_id = str(f_perm.filial.id)
                     f_perm.can_edit = f'filial_can_edit_{filial_id}' in request.POST
                     f_perm.can_delete = f'filial_can_delete_{filial_id}' in request.POST
-
-                    users_from_filial = User.objects.filter(
-                        profile__employee__id_filial=filial_id
-                    )
-
-                    for user in users_from_filial:
-                        # Обработка добавления пользователей для филиалов
-                        RowPermission.objects.update_or_create(
-                            row=row,
-                            user=user,
-                            defaults={
-                                'can_edit': f_perm.can_edit,
-                                'can_delete': f_perm.can_delete,
-                            }
-                        )
-
+                    # Сотрудники филиала получают права при чтении, личные права остаются исключениями
                     f_perm.save()
 
         if 'add_filials_submit' in request.POST:
@@ -389,22 +351,7 @@ def manage_row_permissions(request, table_pk, row_pk):
                                 'can_delete': filial_can_delete,
                             }
                         )
-                        # Применяем права ко всем пользователям филиала
-                        users = User.objects.filter(
-                            profile__employee__id_filial=filial.id
-                        ).exclude(
-                            pk__in=row.permissions.values_list('user__id', flat=True)
-                        )
-
-                        for user in users:
-                            RowPermission.objects.update_or_create(
-                                row=row,
-                                user=user,
-                                defaults={
-                                    'can_edit': filial_can_edit,
-                                    'can_delete': filial_can_delete,
-                                }
-                            )
+                    PERMISSION_ROWS.observe(len(new_filials), operation='filial_grant')
 
         if 'remove_user' in request.POST:
             with transaction.atomic():
@@ -429,27 +376,17 @@ def manage_row_permissions(request, table_pk, row_pk):
                         filial=filial,
                     ).delete()
 
-                    # Применяем права ко всем пользователям филиала
-                    users = User.objects.filter(
-                        profile__employee__id_filial=filial_id
-                    )
-
-                    for user in users:
-                        RowPermission.objects.filter(
-                            row=row,
-                            user=user,
-                        ).delete()
-
                     messages.success(request, 'Пользователь удален')
 
         messages.success(request, 'Обновление прав успешно!')
+        Table.touch(table.pk)
         return redirect('manage_row_permissions', table_pk=table.pk, row_pk=row.pk)
 
-    # Получаем текущие разрешения для строки
-    permissions = row.permissions.all()
-    filial_permissions = row.filial_permissions.all()
+    # Получаем текущие разрешения для строки; пользователи и филиалы - в том же запросе
+    permissions = row.permissions.select_related('user__profile__employee')
+    filial_permissions = row.filial_permissions.select_related('filial')
 
-    all_users = User.objects.exclude(pk=table.owner.pk)
+    all_users = User.objects.exclude(pk=table.owner_id).select_related('profile__employee')
     all_filials = Filial.objects.exclude(id=1910)
 
     return render(request, 'tables/manage_permissions.html', {
@@ -546,6 +483,7 @@ def manage_table_permissions(request, table_pk):
                                     'can_view': filial_can_view,
                                 }
                             )
+                        PERMISSION_ROWS.observe(1 + len(users), operation='filial_grant')
 
         if 'remove_user' in request.POST:
             with transaction.atomic():
@@ -584,13 +522,14 @@ def manage_table_permissions(request, table_pk):
                     messages.success(request, 'Пользователь удален')
 
         messages.success(request, 'Обновление прав успешно!')
+        Table.touch(table.pk)
         return redirect('manage_table_permissions', table_pk=table.pk)
 
-    # Получаем текущие разрешения для таблицы
-    permissions = table.permissions.all()
-    filial_permissions = table.filial_permissions.all()
+    # Получаем текущие разрешения для таблицы; пользователи и филиалы - в том же запросе
+    permissions = table.permissions.select_related('user__profile__employee')
+    filial_permissions = table.filial_permissions.select_related('filial')
 
-    all_users = User.objects.exclude(pk=table.owner.pk)
+    all_users = User.objects.exclude(pk=table.owner_id).select_related('profile__employee')
     all_filials = Filial.objects.exclude(id=1910)
 
     return render(request, 'tables/manage_table_permissions.html', {
@@ -614,8 +553,6 @@ def revoke_redact_rows(request, share_token):
         filial_id = request.user.profile.employee.id_filial
         filial = Filial.objects.get(id=filial_id)
 
-        rows = table.rows.all()
-
         with transaction.atomic():
             RowFilialPermission.objects.filter(
                 row__table=table,
@@ -635,20 +572,17 @@ def revoke_redact_rows(request, share_token):
                 }
             )
 
-            users_from_filial = User.objects.filter(profile__employee__id_filial=filial_id)
-
-            # Получаем все существующие разрешения
-            existing_permissions = RowPermission.objects.filter(
-                user__in=users_from_filial,
-                row__in=rows
-            ).select_related('user', 'row')
-
-            # Обновляем существующие
-            for perm in existing_permissions:
-                perm.can_edit = False
-                perm.can_delete = False
+            # Личные права сотрудников филиала обновляются одним UPDATE, без загрузки в память
+            RowPermission.objects.filter(
+                user__profile__employee__id_filial=filial_id,
+                row__table=table
+            ).update(
+                can_edit=False,
+                can_delete=False
+            )
 
-            RowPermission.objects.bulk_update(existing_permissions, ['can_edit', 'can_delete'])
+            # update() и bulk_update() не отправляют сигналы, версия данных увеличивается явно
+            Table.touch(table.pk)
 
         messages.success(request, f'Права редактирования для филиала {filial.name} сняты со всех строк')
         return redirect('shared_table_view', share_token=table.share_token)
@@ -667,8 +601,10 @@ def delete_column(request, table_pk, column_pk):
     if not (table.owner == request.user or table.is_admin(request.user)):
         return HttpResponseForbidden("Вы не можете удалять колонки из этой таблицы")
 
-    Cell.objects.filter(column=column).delete()
-    column.delete()
+    with transaction.atomic():
+        Row.remove_column_data(column)
+        Cell.objects.filter(column=column).delete()
+        column.delete()
 
     messages.success(request, f'Колонка "{column.name}" успешно удалена')
     return redirect('table_detail', pk=table.pk)
@@ -701,16 +637,38 @@ def unlock_row_api(request, row_pk):
     return JsonResponse({'status': 'error'}, status=400)
 
 
+@require_POST
+@login_required
+def renew_row_lock_api(request, row_pk):
+    """Продление аренды блокировки, пока открыта форма редактирования"""
+    if renew_row_lock(row_pk, request.user):
+        return JsonResponse({'status': 'success', 'expires_in': int(ROW_LOCK_LEASE.total_seconds())})
+    return JsonResponse({
+        'status': 'error',
+        'message': 'Блокировка строки истекла и занята другим пользователем'
+    }, status=423)
+
+
 @login_required
 def edit_row(request, table_pk, row_pk):
     table = get_object_or_404(Table, pk=table_pk)
     row = get_object_or_404(Row, pk=row_pk, table=table)
-    if not row.has_edit_permission(request.user):
+    permissions = PermissionContext(request.user, table)
+    if not permissions.can_edit_row(row):
         return JsonResponse({'status': 'error', 'message': 'Нет прав на редактирование'}, status=403)
 
-    columns = Column.get_editable_columns(request.user, table)
+    # Колонки загружаются один раз и передаются в форму и в сохранение
+    columns = list(Column.get_editable_columns(request.user, table, permissions))
 
     if request.method == 'POST':
+        # Аренда могла истечь и перейти к другому пользователю, пока была открыта форма
+        lock, lock_user = lock_row(row, request.user)
+        if not lock:
+            return JsonResponse({
+                'status': 'error',
+                'message': f'Строка сейчас редактируется другим пользователем: {lock_user}'
+            }, status=423)
+
         form = RowEditForm(request.POST, row=row, columns=columns)
         if form.is_valid():
             # Снимаем блокировку после успешного редактирования
@@ -728,106 +686,103 @@ def edit_row(request, table_pk, row_pk):
             'message': f'Строка сейчас редактируется другим пользователем: {lock_user}'
         }, status=423)  # 423 - Locked
 
-    # GET запрос - возвращаем форму
-    form = RowEditForm(row=row, columns=columns)
-    html = render_to_string('tables/row_edit_form/row_edit_form.html', {
-        'form': form,
-        'table': table,
-        'row': row
-    }, request=request)
-    return JsonResponse({'status': 'success', 'html': html})
+    # GET запрос - возвращаем форму; блокировка берётся и при ответе 304
+    def get_response():
+        form = RowEditForm(row=row, columns=columns)
+        html = render_to_string('tables/row_edit_form/row_edit_form.html', {
+            'form': form,
+            'table': table,
+            'row': row
+        }, request=request)
+        return JsonResponse({
+            'status': 'success',
+            'html': html,
+            'heartbeat': int(ROW_LOCK_HEARTBEAT.total_seconds())
+        })
+
+    return conditional_page(request, table, permissions, f'edit_row:{row.pk}', get_response)
 
 
 @login_required
 def add_row(request, pk):
     table = get_object_or_404(Table, pk=pk)
+    permissions = PermissionContext(request.user, table)
 
-    if not table.has_view_permission(request.user) or not table.has_add_permission:
+    if not permissions.can_view or not permissions.can_add_rows:
         return HttpResponseForbidden("Вы не можете добавлять строки в эту таблицу")
 
-    columns = Column.get_editable_columns(request.user, table)
+    columns = Column.get_editable_columns(request.user, table, permissions)
 
     if request.method == 'POST':
         form = AddRowForm(request.POST, table=table, columns=columns)
         if form.is_valid():
 
-            # Создаем новую строку
-            row = Row.objects.create(
-                table=table,
-                order=table.rows.count(),  # Порядковый номер новой строки
-                created_by=request.user
-            )
+            # Строка, её ячейки и права филиала добавляются постоянным числом запросов
+            Row.bulk_insert(table, request.user, permissions.filial_id, [{
+                column: form.cleaned_data.get(f'col_{column.id}')
+                for column in columns
+            }])
 
-            RowPermission.objects.create(
-                row=row,
-                user=request.user,
-                can_edit=True,
-                can_delete=True,
-            )
+            messages.success(request, 'Новая строка успешно добавлена')
+            return JsonResponse({'status': 'success'})
+        return JsonResponse({'status': 'error', 'errors': form.errors}, status=400)
 
-            user_filial = request.user.profile.employee.id_filial
+    # GET запрос - возвращаем форму
+    def get_response():
+        form = AddRowForm(table=table, columns=columns)
+        html = render_to_string('tables/add_row/add_row.html', {
+            'form': form,
+            'table': table  # Передаем сам объект таблицы
+        }, request=request)
+        return JsonResponse({'status': 'success', 'html': html})
 
-            if user_filial:
-                if user_filial != 1910:
-                    # Добавляем права для филиала создателя
-                    filial = get_object_or_404(Filial, pk=user_filial)
-                    RowFilialPermission.objects.update_or_create(
-                        row=row,
-                        filial=filial,
-                        defaults={
-                            'can_edit': True,
-                            'can_delete': True,
-                        }
-                    )
+    return conditional_page(request, table, permissions, 'add_row', get_response)
 
-                    colleagues = User.objects.filter(
-                        profile__employee__id_filial=user_filial,
-                    ).exclude(id=request.user.id)
 
-                    # Создаем права для всех коллег
-                    for colleague in colleagues:
-                        RowPermission.objects.update_or_create(
-                            row=row,
-                            user=colleague,
-                            can_edit=True,  # Могут редактировать
-                            can_delete=True  # Могут удалять
-                        )
+@require_POST
+@login_required
+def add_rows_api(request, pk):
+    """Пакетное добавление строк из JSON: {"rows": [{"col_<id>" или название колонки: значение}, ...]}
 
-                administration = User.objects.filter(
-                    profile__employee__id_filial=1910,
-                ).exclude(id=request.user.id)
+    Все строки проверяются полями AddRowForm; при ошибках ничего не добавляется
+    и возвращаются ошибки по номерам строк.
+    """
+    table = get_object_or_404(Table, pk=pk)
+    permissions = PermissionContext(request.user, table)
 
-                # Создаем права для всей администрации
-                for admin in administration:
-                    RowPermission.objects.update_or_create(
-                        row=row,
-                        user=admin,
-                        can_edit=True,
-                        can_delete=True
-                    )
+    if not permissions.can_view or not permissions.can_add_rows:
+        return HttpResponseForbidden("Вы не можете добавлять строки в эту таблицу")
 
-            # Заполняем ячейки данными из формы
-            for column in columns:
-                field_name = f'col_{column.id}'
-                value = form.cleaned_data.get(field_name)
+    try:
+        # Чтение потока, а не request.body: тело больше DATA_UPLOAD_MAX_MEMORY_SIZE
+        rows = json.load(request)['rows']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'status': 'error', 'message': 'Ожидается JSON вида {"rows": [...]}'}, status=400)
+    if not isinstance(rows, list) or not all(isinstance(values, dict) for values in rows):
+        return JsonResponse({'status': 'error', 'message': 'rows должен быть списком объектов'}, status=400)
+    if len(rows) > BULK_ADD_ROWS_LIMIT:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'За один запрос можно добавить не более {BULK_ADD_ROWS_LIMIT} строк'
+        }, status=400)
 
-                Cell.objects.create(
-                    row=row,
-                    column=column,
-                    value=value
-                )
+    columns = list(Column.get_editable_columns(request.user, table, permissions))
+    form = AddRowForm(table=table, columns=columns)
 
-            messages.success(request, 'Новая строка успешно добавлена')
-            return JsonResponse({'status': 'success'})
-        return JsonResponse({'status': 'error', 'errors': form.errors}, status=400)
+    rows_values = []
+    errors = []
+    for index, values in enumerate(rows):
+        cleaned_data, row_errors = form.clean_values(values)
+        if row_errors:
+            errors.append({'row': index, 'errors': row_errors})
+        else:
+            rows_values.append({column: cleaned_data[f'col_{column.id}'] for column in columns})
 
-    # GET запрос - возвращаем форму
-    form = AddRowForm(table=table, columns=columns)
-    html = render_to_string('tables/add_row/add_row.html', {
-        'form': form,
-        'table': table  # Передаем сам объект таблицы
-    }, request=request)
-    return JsonResponse({'status': 'success', 'html': html})
+    if errors:
+        return JsonResponse({'status': 'error', 'errors': errors}, status=400)
+
+    created = Row.bulk_insert(table, request.user, permissions.filial_id, rows_values)
+    return JsonResponse({'status': 'success', 'created': len(created)})
 
 
 @login_required
@@ -843,16 +798,9 @@ def shared_tables_list(request):
         else:
             is_owner = False
 
-        can_edit = is_owner or RowPermission.objects.filter(
-            row__table=table,
-            user=request.user,
-            can_edit=True
-        ).exists()
-        can_delete = is_owner or RowPermission.objects.filter(
-            row__table=table,
-            user=request.user,
-            can_delete=True
-        ).exists()
+        permissions = PermissionContext(request.user, table)
+        can_edit = is_owner or permissions.has_any_row_permission('can_edit')
+        can_delete = is_owner or permissions.has_any_row_permission('can_delete')
 
         tables_with_access.append({
             'table': table,
@@ -870,53 +818,112 @@ def shared_tables_list(request):
 @login_required
 def table_detail(request, pk):
     table_obj = get_object_or_404(Table, pk=pk)
+    permissions = PermissionContext(request.user, table_obj)
     # Проверка прав доступа
-    if not (table_obj.owner == request.user or table_obj.is_admin(request.user)):
+    if not permissions.has_full_access:
         return HttpResponseForbidden("You don't have permission to access this table.")
 
-    queryset = table_obj.rows.all().prefetch_related('cells', 'cells__column')
-    columns = table_obj.columns.all()
+    def build_table():
+        queryset = table_obj.rows.all()
+        columns = table_obj.columns.all()
 
-    queryset, search_query = filter_func(queryset, columns, request)
+        queryset, _ = filter_func(queryset, permissions, columns, request)
 
-    # Добавляем аннотации для каждого столбца
-    queryset = sort_func(queryset, columns)
+        # Аннотация сортировки добавляется только для выбранного столбца
+        queryset = sort_func(queryset, columns, request)
 
-    table = DynamicTable(data=queryset, table_obj=table_obj, columns=columns, request=request)
-    RequestConfig(request).configure(table)
-    return render(request, 'tables/table_detail.html', {
-        'table_obj': table_obj,
-        'table': table,
-        'is_admin': table_obj.is_admin(request.user),
-        'search_query': search_query
-    })
+        table = DynamicTable(data=queryset, table_obj=table_obj, columns=columns, request=request,
+                             permissions=permissions)
+        RequestConfig(request).configure(table)
+        return table
+
+    return conditional_page(request, table_obj, permissions, 'table_detail', lambda: render(
+        request, 'tables/table_detail.html', {
+            'table_obj': table_obj,
+            'table_html': render_grid(request, table_obj, permissions, 'table_detail', build_table),
+            'is_admin': permissions.is_admin,
+            'search_query': request.GET.get('q', '')
+        }))
 
 
 @login_required()
 def shared_table_view(request, share_token):
-    table = get_object_or_404(Table, share_token=share_token)
+    table = get_object_or_404(Table.objects.select_related('owner'), share_token=share_token)
+    permissions = PermissionContext(request.user, table)
 
-    if not table.has_view_permission(request.user):
+    if not permissions.can_view:
         return HttpResponseForbidden("У вас нет прав на просмотр этой таблицы")
 
-    # Получаем строки, которые пользователь может видеть
-    rows = Row.get_visible_rows(request.user, table)
-    columns = Column.get_visible_columns(request.user, table)
+    def build_table():
+        # Получаем строки, которые пользователь может видеть
+        rows = Row.get_visible_rows(request.user, table, permissions)
+        columns = Column.get_visible_columns(request.user, table, permissions)
 
-    rows, search_query = filter_func(rows, columns, request)
+        rows, _ = filter_func(rows, permissions, columns, request)
 
-    queryset = sort_func(rows, columns)
-    table_view = DynamicTable(data=queryset, table_obj=table, columns=columns, request=request)
-    RequestConfig(request).configure(table_view)
+        queryset = sort_func(rows, columns, request)
+        table_view = DynamicTable(data=queryset, table_obj=table, columns=columns, request=request,
+                                  permissions=permissions)
+        RequestConfig(request).configure(table_view)
+        return table_view
 
-    return render(request, 'tables/shared_table.html', {
-        'table_obj': table,
-        'table': table_view,
-        'is_owner': table.owner == request.user,
-        'is_admin': table.is_admin(request.user),
-        'is_add_permission': table.has_add_permission(request.user),
-        'search_query': search_query
-    })
+    return conditional_page(request, table, permissions, 'shared_table_view', lambda: render(
+        request, 'tables/shared_table.html', {
+            'table_obj': table,
+            'table_html': render_grid(request, table, permissions, 'shared_table_view', build_table),
+            'is_owner': permissions.is_owner,
+            'is_admin': permissions.is_admin,
+            'is_add_permission': permissions.can_add_rows,
+            'search_query': request.GET.get('q', '')
+        }))
+
+
+@login_required
+def table_events(request, table_pk):
+    """Поток событий таблицы (Server-Sent Events): блокировки и изменения строк"""
+    table = get_object_or_404(Table, pk=table_pk)
+    permissions = PermissionContext(request.user, table)
+    if not permissions.can_view:
+        return HttpResponseForbidden("У вас нет прав на просмотр этой таблицы")
+
+    # Версия данных, до которой страница получила события: при переподключении её
+    # передаёт браузер (Last-Event-ID), при первом подключении - сама страница
+    try:
+        version = int(request.headers.get('Last-Event-ID') or request.GET['version'])
+    except (KeyError, ValueError):
+        version = None
+    resync = functools.partial(resync_events, table.pk, version)
+
+    # Под ASGI ожидание событий не занимает поток, под WSGI - занимает поток на соединение
+    if isinstance(request, ASGIRequest):
+        stream = aevent_stream(table.pk, resync)
+    else:
+        stream = event_stream(table.pk, resync, functools.partial(table_version, table.pk))
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+def row_fragment(request, table_pk, row_pk):
+    """HTML одной строки в том виде, в каком её видит пользователь; 404, если строка ему не видна"""
+    table = get_object_or_404(Table, pk=table_pk)
+    permissions = PermissionContext(request.user, table)
+    if not permissions.can_view:
+        return HttpResponseForbidden("У вас нет прав на просмотр этой таблицы")
+
+    row = Row.get_visible_rows(request.user, table, permissions).filter(pk=row_pk).first()
+    if row is None:
+        raise Http404
+    lock = held_lock(row, request.user)
+    if lock is not None:
+        row.locked_by = lock.user.username
+        row.lock_expires_in = max(int((lock.expires_at - datetime.datetime.now()).total_seconds()), 1)
+    columns = Column.get_visible_columns(request.user, table, permissions)
+    table_view = DynamicTable(data=[row], table_obj=table, columns=columns, request=request,
+                              permissions=permissions)
+    return HttpResponse(render_rows(request, table_view))
 
 
 @login_required
@@ -933,31 +940,34 @@ def unlock_filial_table(request, table_pk):
             with transaction.atomic():
                 try:
                     filial = Filial.objects.get(id=filial_id)
-                    users_from_filial = User.objects.filter(profile__employee__id_filial=filial_id)
-                    rows = Row.objects.filter(table=table)
-
-                    # Получаем все существующие разрешения
-                    existing_permissions = RowPermission.objects.filter(
-                        user__in=users_from_filial,
-                        row__in=rows
-                    ).select_related('user', 'row')
 
-                    # Обновляем существующие
-                    for perm in existing_permissions:
-                        perm.can_edit = can_edit
-                        perm.can_delete = can_delete
+                    RowFilialPermission.objects.filter(
+                        row__table=table,
+                        filial=filial
+                    ).update(
+                        can_edit=can_edit,
+                        can_delete=can_delete
+                    )
 
-                    RowPermission.objects.bulk_update(existing_permissions, ['can_edit', 'can_delete'])
+                    # Личные права сотрудников филиала обновляются одним UPDATE, без загрузки в память
+                    RowPermission.objects.filter(
+                        user__profile__employee__id_filial=filial_id,
+                        row__table=table
+                    ).update(
+                        can_edit=can_edit,
+                        can_delete=can_delete
+                    )
 
                     TableFilialLock.objects.filter(
                         table=table,
                         filial=filial,
                     ).delete()
+                    Table.touch(table.pk)
                     messages.success(request, f'Таблица разблокирована для филиала {filial.name}')
                 except Filial.DoesNotExist:
                     messages.error(request, 'Филиал не найден')
 
-    filial_permissions = table.filial_add_permissions.all()
+    filial_permissions = table.filial_add_permissions.select_related('filial')
 
     return render(request, 'tables/add_row/unlock_row.html', {
         'table_obj': table,
@@ -968,114 +978,283 @@ def unlock_filial_table(request, table_pk):
 @login_required
 def export_table(request, table_pk):
     table_obj = get_object_or_404(Table, pk=table_pk)
+    permissions = PermissionContext(request.user, table_obj)
     # Проверка прав доступа
-    if not (table_obj.owner == request.user or table_obj.is_admin(request.user)):
+    if not permissions.has_full_access:
         return HttpResponseForbidden("Вы не можете скачать таблицу")
 
-    queryset = table_obj.rows.all().prefetch_related('cells', 'cells__column')
+    queryset = table_obj.rows.all()
+    export_format = request.GET.get("_export", None)
 
-    table = ExportTable(data=queryset, table_obj=table_obj, request=request)
+    # csv и xlsx выгружаются фоновой задачей, готовый файл для той же версии данных переиспользуется
+    if export_format in BACKGROUND_FORMATS:
+        job = start_export([table_obj], export_format, request.user)
+        return redirect('export_job', job_pk=job.pk)
 
-    RequestConfig(request).configure(table)
+    def get_response():
+        table = ExportTable(data=queryset, table_obj=table_obj, request=request)
 
-    export_format = request.GET.get("_export", None)
-    if TableExport.is_valid_format(export_format):
-        exporter = TableExport(export_format, table)
-        return exporter.response(f"table.{export_format}")
+        RequestConfig(request).configure(table)
 
-    return render(request, "tables/export/export_table.html", {
-        "table": table
+        if TableExport.is_valid_format(export_format):
+            start = time.perf_counter()
+            exporter = TableExport(export_format, table)
+            response = exporter.response(f"table.{export_format}")
+            EXPORT_DURATION.observe(time.perf_counter() - start, format=export_format)
+            EXPORT_BYTES.observe(len(response.content), format=export_format)
+            return response
+
+        return render(request, "tables/export/export_table.html", {
+            "table": table
+        })
+
+    return conditional_page(request, table_obj, permissions, 'export_table', get_response)
+
+
+@login_required
+def import_table(request, table_pk):
+    """Импорт строк из CSV/XLSX, например из ранее выгруженного файла"""
+    table = get_object_or_404(Table, pk=table_pk)
+    permissions = PermissionContext(request.user, table)
+    if not permissions.has_full_access:
+        return HttpResponseForbidden("Вы не можете импортировать строки в эту таблицу")
+
+    result = None
+    if request.method == 'POST':
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                result = import_rows(
+                    table,
+                    request.user,
+                    permissions.filial_id,
+                    form.cleaned_data['file'],
+                    form.cleaned_data['import_format']
+                )
+            except Exception as e:
+                messages.error(request, f'Не удалось прочитать файл: {str(e)}')
+            else:
+                messages.success(request, f'Добавлено строк: {result.created}')
+    else:
+        form = ImportForm()
+
+    return render(request, 'tables/import/import_table.html', {
+        'table_obj': table,
+        'form': form,
+        'result': result,
+    })
+
+
+@login_required
+def import_report(request, table_pk, report_name):
+    """Отчёт об ошибках импорта"""
+    table = get_object_or_404(Table, pk=table_pk)
+    if not (table.owner == request.user or table.is_admin(request.user)):
+        return HttpResponseForbidden("Вы не можете скачать отчёт")
+    path = report_path(table, report_name)
+    if not os.path.exists(path):
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename='import_errors.csv')
+
+
+@login_required
+def export_tables(request):
+    """Выгрузка нескольких таблиц в одну книгу XLSX, по листу на таблицу"""
+    if Admin.objects.filter(user=request.user).exists():
+        tables = Table.objects.all()
+    else:
+        tables = Table.objects.filter(owner=request.user)
+
+    if request.method == 'POST':
+        selected = list(tables.filter(pk__in=request.POST.getlist('tables')))
+        if not selected:
+            messages.error(request, 'Выберите хотя бы одну таблицу')
+            return redirect('export_tables')
+        job = start_export(selected, 'xlsx', request.user)
+        return redirect('export_job', job_pk=job.pk)
+
+    return render(request, 'tables/export/export_tables.html', {'tables': tables})
+
+
+def get_export_job(request, job_pk):
+    job = get_object_or_404(ExportJob, pk=job_pk)
+    if not job.can_access(request.user):
+        raise Http404
+    return job
+
+
+@login_required
+def export_job(request, job_pk):
+    """Страница ожидания фоновой выгрузки"""
+    job = get_export_job(request, job_pk)
+    if job.is_ready:
+        return redirect('download_export', job_pk=job.pk)
+    return render(request, 'tables/export/export_job.html', {'job': job})
+
+
+@login_required
+def export_job_status(request, job_pk):
+    """Статус и прогресс фоновой выгрузки"""
+    job = get_export_job(request, job_pk)
+    return JsonResponse({
+        'status': job.status,
+        'progress': job.progress,
+        'processed_rows': job.processed_rows,
+        'total_rows': job.total_rows,
+        'error': job.error,
+        'download_url': reverse('download_export', args=[job.pk]) if job.is_ready else None,
     })
 
 
-def filter_func(queryset, columns, request):
+@login_required
+def download_export(request, job_pk):
+    """Отдаёт готовый файл выгрузки"""
+    job = get_export_job(request, job_pk)
+    if not job.is_ready:
+        return redirect('export_job', job_pk=job.pk)
+    # FileResponse отдаёт файл через wsgi.file_wrapper (sendfile на стороне сервера)
+    return FileResponse(open(job.file_path, 'rb'), as_attachment=True, filename=job.download_name)
+
+
+def metrics(request):
+    """Метрики процесса в текстовом формате Prometheus: для сотрудников или по METRICS_TOKEN"""
+    token = settings.METRICS_TOKEN
+    authorized = bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (authorized or (request.user.is_authenticated and request.user.is_staff)):
+        return HttpResponseForbidden('Нет доступа к метрикам')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def filter_func(queryset, permissions, columns, request):
     search_query = request.GET.get('q', '')
     if search_query:
-        # Создаем условие для поиска по всем колонкам
-        column_conditions = Q()
+        # Условия, которые проверяет GIN-индекс (pg_trgm, tsvector, jsonb_path_ops): их OR
+        # выполняется как BitmapOr. Остальные совпадения ищутся отдельными запросами по
+        # своим индексам, найденные строки объединяются через UNION
+        table_rows = Row.objects.filter(table=permissions.table).order_by()
+        text_query = SearchQuery(search_query, config='simple', search_type='websearch')
+        if permissions.has_full_access:
+            # Владелец и администраторы видят все колонки: ищется весь документ строки
+            search_vector = F('search_vector')
+            conditions = Q(search_text__icontains=search_query) | Q(search_vector=text_query)
+        else:
+            # В документе строки есть и скрытые от пользователя колонки: индекс только
+            # отбирает строки, совпадение перепроверяется по видимым текстовым колонкам
+            text_values = [DocumentValue(column.id) for column in columns
+                           if column.data_type == Column.ColumnType.TEXT]
+            search_vector = SearchVector(*text_values, config='simple') if text_values else None
+            conditions = Q()
+            for value in text_values:
+                conditions |= Q(IContains(value, search_query))
+            if text_values:
+                conditions = (Q(search_text__icontains=search_query) & conditions) | (
+                    Q(search_vector=text_query) & Q(SearchVectorExact(search_vector, text_query)))
+        float_conditions = Q()
+
+        # Типизированные значения ищутся в документе строки
         for column in columns:
-            column_conditions |= Q(cells__column=column, cells__text_value__icontains=search_query)
+            key = str(column.id)
             if column.data_type == Column.ColumnType.INTEGER:
                 try:
                     int_value = int(search_query)
-                    column_conditions |= Q(cells__column=column, cells__integer_value=int_value)
+                    conditions |= Q(data__contains={key: int_value})
                 except ValueError:
                     pass
             elif column.data_type == Column.ColumnType.FLOAT:
+                # Поиск с допуском индексом не проверяется: только среди строк таблицы
                 try:
                     float_value = float(search_query)
-                    column_conditions |= Q(cells__column=column,
-                                           cells__float_value__gte=float_value - 0.001,
-                                           cells__float_value__lte=float_value + 0.001)
+                    float_conditions |= Q(Range(Cast(DocumentValue(column.id), FloatField()),
+                                                (float_value - 0.001, float_value + 0.001)))
                 except ValueError:
                     pass
             elif column.data_type == Column.ColumnType.BOOLEAN:
                 # Поиск по булевым значениям (true/false, да/нет и т.д.)
                 bool_value = None
-                if search_query.lower() in ['true', 'да', 'yes', 'истина']:
+                if search_query.lower() in Cell.TRUE_VALUES:
                     bool_value = True
-                elif search_query.lower() in ['false', 'нет', 'no', 'ложь']:
+                elif search_query.lower() in Cell.FALSE_VALUES:
                     bool_value = False
 
                 if bool_value is not None:
-                    column_conditions |= Q(cells__column=column, cells__boolean_value=bool_value)
+                    conditions |= Q(data__contains={key: bool_value})
             elif column.data_type == Column.ColumnType.DATE:
-                try:
-                    # Пробуем разные форматы дат
-                    date_formats = ['%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%m/%d/%Y']
-                    parsed_date = None
-                    for fmt in date_formats:
-                        try:
-                            parsed_date = datetime.datetime.strptime(search_query, fmt).date()
-                            break
-                        except ValueError:
-                            continue
-
-                    if parsed_date:
-                        column_conditions |= Q(cells__column=column, cells__date_value=parsed_date)
-                except ValueError:
-                    pass
+                parsed_date = parse_search_date(search_query)
+                if parsed_date:
+                    conditions |= Q(data__contains={key: parsed_date.isoformat()})
 
-        filter_filial_ids = Filial.objects.filter(
+        # Авторы строк, подходящие по ФИО или филиалу, - списками id: сотрудники ищутся
+        # по индексам ФИО и филиала, строки - по индексу created_by
+        filter_filial_ids = list(Filial.objects.filter(
             Q(name__icontains=search_query) |
             Q(long_name__icontains=search_query) |
             Q(short_name__icontains=search_query)
-        ).values_list('id', flat=True)
+        ).values_list('id', flat=True))
+
+        creator_conditions = (
+            Q(profile__employee__firstname__icontains=search_query) |
+            Q(profile__employee__secondname__icontains=search_query) |
+            Q(profile__employee__lastname__icontains=search_query)
+        )
+        if filter_filial_ids:
+            creator_conditions |= Q(profile__employee__id_filial__in=filter_filial_ids)
+        creator_ids = list(User.objects.filter(creator_conditions).values_list('pk', flat=True))
+
+        # Без условий filter() вернул бы все строки таблицы
+        matched = table_rows.filter(conditions).values('pk') if conditions else table_rows.none().values('pk')
+        if creator_ids:
+            matched = matched.union(table_rows.filter(created_by__in=creator_ids).values('pk'))
+        if float_conditions:
+            matched = matched.union(table_rows.filter(float_conditions).values('pk'))
 
         queryset = queryset.filter(
-            column_conditions |
-            Q(created_by__profile__employee__firstname__icontains=search_query) |
-            Q(created_by__profile__employee__secondname__icontains=search_query) |
-            Q(created_by__profile__employee__lastname__icontains=search_query) |
-            Q(created_by__profile__employee__id_filial__in=filter_filial_ids)
-        ).distinct()
+            pk__in=matched
+        ).annotate(
+            search_rank=SearchRank(search_vector, text_query) if search_vector is not None else Value(0.0)
+        ).order_by('-search_rank', 'order')
 
         return queryset, search_query
     else:
         return queryset, search_query
 
 
-def sort_func(queryset, columns):
-    queryset = queryset.annotate(
-        user_full_name=Concat(
-            F('created_by__profile__employee__secondname'),
-            Value(' '),
-            F('created_by__profile__employee__firstname'),
-            Value(' '),
-            F('created_by__profile__employee__lastname'),
-            output_field=TextField()
-        ),
-    )
-
-    queryset = queryset.annotate(
-        filial_name=Subquery(
-            Filial.objects.filter(
-                id=OuterRef('created_by__profile__employee__id_filial')
-            ).values('name')[:1],
-            output_field=TextField()  # Указываем тип поля явно
+def parse_search_date(search_query):
+    """Пробует разобрать поисковый запрос как дату в одном из поддерживаемых форматов"""
+    for fmt in Cell.DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(search_query, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def sort_func(queryset, columns, request):
+    """Добавляет аннотацию сортировки только для колонки из ?sort="""
+    sort_field = request.GET.get('sort', '').lstrip('-')
+
+    if sort_field == 'user':
+        return queryset.annotate(
+            user_full_name=Concat(
+                F('created_by__profile__employee__secondname'),
+                Value(' '),
+                F('created_by__profile__employee__firstname'),
+                Value(' '),
+                F('created_by__profile__employee__lastname'),
+                output_field=TextField()
+            ),
+        )
+
+    if sort_field == 'filial':
+        return queryset.annotate(
+            filial_name=Subquery(
+                Filial.objects.filter(
+                    id=OuterRef('created_by__profile__employee__id_filial')
+                ).values('name')[:1],
+                output_field=TextField()  # Указываем тип поля явно
+            )
         )
-    )
 
     for column in columns:
-        queryset = Row.annotate_for_sorting(queryset, column.id, column.data_type)
+        if sort_field == f'col_{column.id}':
+            return Row.annotate_for_sorting(queryset, column.id, column.data_type)
     return queryset
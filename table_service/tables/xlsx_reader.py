@@ -0,0 +1,27 @@
+"""Чтение XLSX без Django: модуль загружается в дочернем процессе импорта (spawn)"""
+
+from openpyxl import load_workbook
+
+
+def iter_xlsx_rows(file):
+    """Строки первого листа XLSX в read-only режиме openpyxl"""
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def xlsx_worker(path, queue, batch_size):
+    """Разбирает XLSX в дочернем процессе и передаёт строки пачками по batch_size"""
+    try:
+        batch = []
+        for values in iter_xlsx_rows(path):
+            batch.append(values)
+            if len(batch) >= batch_size:
+                queue.put(batch)
+                batch = []
+        queue.put(batch)
+        queue.put(None)
+    except Exception as e:
+        queue.put(e)